@@ -0,0 +1,253 @@
+'''
+Local stand-in of the Power BI push dataset REST API and the OAuth token endpoint.
+
+Serves the endpoints used by the PowerBI class with configurable latency, 429 injection,
+request body size limit and access token lifetime. Pushed rows are only counted, not stored.
+
+'''
+
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+API_PATH = "/v1.0/myorg/"
+TOKEN_PATH = "/oauth2/token"
+
+DATASETS_PATTERN = re.compile(r"^(?:groups/[^/]+/)?datasets$")
+DATASET_PATTERN = re.compile(r"^(?:groups/[^/]+/)?datasets/([^/]+)$")
+TABLES_PATTERN = re.compile(r"^(?:groups/[^/]+/)?datasets/([^/]+)/tables$")
+TABLE_PATTERN = re.compile(r"^(?:groups/[^/]+/)?datasets/([^/]+)/tables/([^/]+)$")
+ROWS_PATTERN = re.compile(r"^(?:groups/[^/]+/)?datasets/([^/]+)/tables/([^/]+)/rows$")
+
+
+class MockPowerBI:
+    '''
+    State of the mocked API shared by the request handlers
+    '''
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=1, max_body_bytes=None, seed=0,
+                 token_expires_in=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_body_bytes = max_body_bytes
+        # tokens are only checked when their lifetime is set
+        self.token_expires_in = token_expires_in
+        self.tokens = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.datasets = {}
+        self.rows = {}
+        self.requests = {}
+        self.bytes_received = 0
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.monotonic() + (self.token_expires_in or 3600)
+        return token
+
+    def authorized(self, header):
+        if not self.token_expires_in:
+            return True
+        token = (header or "").replace("Bearer ", "", 1)
+        with self.lock:
+            return self.tokens.get(token, 0) > time.monotonic()
+
+    def should_throttle(self):
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "rows": dict(self.rows),
+                "bytes_received": self.bytes_received
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status, payload=None, headers=None):
+        data = json.dumps(payload if payload is not None else {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, method):
+        path = self.path.split("?")[0]
+        if path == TOKEN_PATH and method == "POST":
+            self._read_body()
+            self.api.count("token")
+            return self._send(200, {"access_token": self.api.issue_token(),
+                                    "expires_in": str(self.api.token_expires_in or 3600)})
+        if not path.startswith(API_PATH):
+            return self._send(404, {"error": {"message": "Unknown path"}})
+
+        resource = path[len(API_PATH):]
+        body = self._read_body()
+        if not self.api.authorized(self.headers.get("Authorization")):
+            self.api.count("unauthorized")
+            return self._send(401, {"error": {"code": "TokenExpired"}})
+        if self.api.latency:
+            time.sleep(self.api.latency)
+
+        match = ROWS_PATTERN.match(resource)
+        if match:
+            return self._rows(method, match.group(1), match.group(2), body)
+        match = TABLE_PATTERN.match(resource)
+        if match and method == "PUT":
+            self.api.count("put_table")
+            return self._put_table(match.group(1), match.group(2), body)
+        match = TABLES_PATTERN.match(resource)
+        if match and method == "GET":
+            self.api.count("get_tables")
+            dataset = self.api.datasets.get(match.group(1))
+            if not dataset:
+                return self._send(404, {"error": {"message": "Dataset not found"}})
+            return self._send(200, {"value": dataset["tables"]})
+        match = DATASET_PATTERN.match(resource)
+        if match:
+            return self._dataset(method, match.group(1))
+        if DATASETS_PATTERN.match(resource):
+            return self._datasets(method, body)
+
+        return self._send(404, {"error": {"message": "Unknown resource"}})
+
+    def _datasets(self, method, body):
+        if method == "GET":
+            self.api.count("list_datasets")
+            return self._send(200, {"value": [
+                {"id": dataset["id"], "name": dataset["name"]} for dataset in self.api.datasets.values()]})
+        if method == "POST":
+            self.api.count("create_dataset")
+            payload = json.loads(body)
+            dataset = {"id": str(uuid.uuid4()), "name": payload["name"], "tables": payload["tables"]}
+            with self.api.lock:
+                self.api.datasets[dataset["id"]] = dataset
+            return self._send(201, {"id": dataset["id"], "name": dataset["name"]})
+        return self._send(405)
+
+    def _dataset(self, method, dataset_id):
+        dataset = self.api.datasets.get(dataset_id)
+        if not dataset:
+            return self._send(404, {"error": {"message": "Dataset not found"}})
+        if method == "GET":
+            self.api.count("get_dataset")
+            return self._send(200, {"id": dataset["id"], "name": dataset["name"]})
+        if method == "DELETE":
+            self.api.count("delete_dataset")
+            with self.api.lock:
+                del self.api.datasets[dataset_id]
+            return self._send(200)
+        return self._send(405)
+
+    def _put_table(self, dataset_id, tablename, body):
+        dataset = self.api.datasets.get(dataset_id)
+        if not dataset:
+            return self._send(404, {"error": {"message": "Dataset not found"}})
+        table = json.loads(body)
+        with self.api.lock:
+            dataset["tables"] = [t for t in dataset["tables"] if t["name"] != tablename] + [table]
+        return self._send(200, table)
+
+    def _rows(self, method, dataset_id, tablename, body):
+        key = "{0}/{1}".format(dataset_id, tablename)
+        if method == "DELETE":
+            self.api.count("delete_rows")
+            with self.api.lock:
+                self.api.rows[key] = 0
+            return self._send(200)
+        if method != "POST":
+            return self._send(405)
+
+        self.api.count("post_rows")
+        if self.api.max_body_bytes and len(body) > self.api.max_body_bytes:
+            self.api.count("post_rows_413")
+            return self._send(413, {"error": {"message": "Request entity too large"}})
+        if self.api.should_throttle():
+            self.api.count("post_rows_429")
+            return self._send(429, {"error": {"message": "Too many requests"}},
+                              {"Retry-After": str(self.api.retry_after)})
+        rows = json.loads(body)["rows"]
+        with self.api.lock:
+            self.api.rows[key] = self.api.rows.get(key, 0) + len(rows)
+            self.api.bytes_received += len(body)
+        return self._send(200)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class MockServer:
+    '''
+    Mocked API running in a background thread, usable as a context manager
+    '''
+
+    def __init__(self, api=None, host="127.0.0.1", port=0):
+        self.api = api or MockPowerBI()
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = self.api
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    @property
+    def api_url(self):
+        return self.base_url + API_PATH
+
+    @property
+    def token_url(self):
+        return self.base_url + TOKEN_PATH
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
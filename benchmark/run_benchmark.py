@@ -0,0 +1,212 @@
+'''
+Offline benchmark of the upload path.
+
+Generates synthetic input tables and manifests, starts the local Power BI stand-in and runs
+the component end-to-end against it, once per scenario. Reports rows per second, peak RSS
+of the component process and the requests received by the API.
+
+    python benchmark/run_benchmark.py [--scale 1.0] [--latency 0.05] [--scenario wide] [--output report.json]
+
+'''
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from mock_powerbi import MockPowerBI, MockServer
+
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# name, tables as (column count, row count[, gzipped slices]), mocked API options, component parameters
+SCENARIOS = [
+    ("narrow", [(3, 200_000)], {}, {}),
+    ("wide", [(75, 20_000)], {}, {}),
+    ("wide_no_prefetch", [(75, 20_000)], {}, {"prefetch_depth": 0}),
+    ("many_tables", [(10, 5_000)] * 30, {}, {}),
+    ("throttled", [(10, 50_000)], {"throttle_rate": 0.2, "retry_after": 1}, {}),
+    ("small_body_limit", [(20, 30_000)], {"max_body_bytes": 512 * 1024}, {}),
+    ("compressed", [(20, 50_000)], {}, {"compress_requests": True}),
+    ("memory_limited", [(75, 20_000)] * 4, {}, {"max_memory_mb": 64}),
+    ("token_expiry", [(10, 50_000)] * 2, {"token_expires_in": 2}, {"max_concurrent_uploads": 2}),
+    ("large_serial", [(75, 60_000)], {}, {"parse_processes": 1}),
+    ("large_parallel", [(75, 60_000)], {}, {}),
+    ("sliced_gzip", [(20, 100_000, 8)], {}, {})
+]
+
+BASETYPES = ["INTEGER", "NUMERIC", "TIMESTAMP", "BOOLEAN", "STRING"]
+
+
+def column_basetype(index):
+    return BASETYPES[index % len(BASETYPES)] if index else "INTEGER"
+
+
+def generate_value(basetype, row, rnd):
+    if basetype == "INTEGER":
+        return str(row)
+    if basetype == "NUMERIC":
+        return "{0:.2f}".format(rnd.uniform(0, 10_000))
+    if basetype == "TIMESTAMP":
+        return (datetime(2020, 1, 1) + timedelta(seconds=rnd.randrange(10 ** 8))).strftime("%Y-%m-%d %H:%M:%S")
+    if basetype == "BOOLEAN":
+        return rnd.choice(["true", "false"])
+    return "value {0} with \"quotes\", commas".format(rnd.randrange(10 ** 6))
+
+
+def generate_table(tables_dir, name, column_count, row_count, seed, slices=0):
+    '''
+    Writing the table as one CSV file, or as a folder of gzipped slices without header if slices are given
+    '''
+
+    rnd = random.Random(seed)
+    columns = ["col_{0}".format(i) for i in range(column_count)]
+    basetypes = [column_basetype(i) for i in range(column_count)]
+    if slices:
+        os.mkdir(os.path.join(tables_dir, name + ".csv"))
+        bounds = [row_count * i // slices for i in range(slices + 1)]
+        for i in range(slices):
+            path = os.path.join(tables_dir, name + ".csv", "part_{0:04d}.csv.gz".format(i))
+            with gzip.open(path, "wt", newline="", encoding="utf-8") as file_out:
+                writer = csv.writer(file_out, quoting=csv.QUOTE_ALL, lineterminator="\n")
+                for row in range(bounds[i], bounds[i + 1]):
+                    writer.writerow([generate_value(basetype, row, rnd) for basetype in basetypes])
+    else:
+        with open(os.path.join(tables_dir, name + ".csv"), "w", newline="", encoding="utf-8") as file_out:
+            writer = csv.writer(file_out, quoting=csv.QUOTE_ALL, lineterminator="\n")
+            writer.writerow(columns)
+            for row in range(row_count):
+                writer.writerow([generate_value(basetype, row, rnd) for basetype in basetypes])
+
+    manifest = {
+        "id": "in.c-benchmark." + name,
+        "name": name,
+        "primary_key": ["col_0"],
+        "columns": columns,
+        "column_metadata": {
+            column: [{"key": "KBC.datatype.basetype", "value": basetype}]
+            for column, basetype in zip(columns, basetypes)
+        }
+    }
+    with open(os.path.join(tables_dir, name + ".csv.manifest"), "w") as file_out:
+        json.dump(manifest, file_out)
+
+
+def build_data_dir(data_dir, tables, parameters):
+    tables_dir = os.path.join(data_dir, "in", "tables")
+    for folder in [tables_dir, os.path.join(data_dir, "in", "files"),
+                   os.path.join(data_dir, "out", "tables"), os.path.join(data_dir, "out", "files")]:
+        os.makedirs(folder, exist_ok=True)
+
+    input_tables = []
+    for i, (column_count, row_count, *slices) in enumerate(tables):
+        name = "table_{0}".format(i)
+        generate_table(tables_dir, name, column_count, row_count, seed=i, slices=slices[0] if slices else 0)
+        input_tables.append({"source": "in.c-benchmark." + name, "destination": name + ".csv"})
+
+    config = {
+        "storage": {"input": {"tables": input_tables, "files": []}, "output": {"tables": [], "files": []}},
+        "parameters": dict({
+            "workspace": "",
+            "dataset": [{"dataset_type": "Name", "dataset_input": "benchmark"}],
+            "incremental_load": False,
+            "table_relationship": []
+        }, **parameters),
+        "authorization": {"oauth_api": {"credentials": {
+            "appKey": "benchmark",
+            "#appSecret": "benchmark",
+            "#data": json.dumps({"refresh_token": "benchmark"})
+        }}}
+    }
+    with open(os.path.join(data_dir, "config.json"), "w") as file_out:
+        json.dump(config, file_out)
+    with open(os.path.join(data_dir, "in", "state.json"), "w") as file_out:
+        json.dump({}, file_out)
+
+
+def run_component(data_dir, server):
+    '''
+    Running the component in a separate process, returns exit code, wall time and peak RSS in MB
+    '''
+
+    env = dict(os.environ, KBC_DATADIR=data_dir, POWERBI_API_URL=server.api_url, POWERBI_TOKEN_URL=server.token_url)
+    started = time.monotonic()
+    with open(os.path.join(data_dir, "component.log"), "w") as log_file:
+        process = subprocess.Popen([sys.executable, "-u", os.path.join(SRC_DIR, "component.py")],
+                                   cwd=SRC_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    elapsed = time.monotonic() - started
+
+    return process.returncode, elapsed, usage.ru_maxrss / 1024
+
+
+def run_scenario(name, tables, api_options, parameters, scale, latency, keep):
+    tables = [(columns, max(1, int(rows * scale)), *slices) for columns, rows, *slices in tables]
+    data_dir = tempfile.mkdtemp(prefix="powerbi-benchmark-{0}-".format(name))
+    try:
+        build_data_dir(data_dir, tables, parameters)
+        api = MockPowerBI(latency=latency, **api_options)
+        with MockServer(api) as server:
+            exit_code, elapsed, peak_rss_mb = run_component(data_dir, server)
+        stats = api.stats()
+        total_rows = sum(rows for _, rows, *_ in tables)
+        received_rows = sum(stats["rows"].values())
+        result = {
+            "scenario": name,
+            "tables": len(tables),
+            "rows": total_rows,
+            "rows_received": received_rows,
+            "exit_code": exit_code,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(received_rows / elapsed, 1),
+            "peak_rss_mb": round(peak_rss_mb, 1),
+            "bytes_received": stats["bytes_received"],
+            "requests": stats["requests"]
+        }
+        if exit_code != 0 or received_rows != total_rows:
+            result["log"] = os.path.join(data_dir, "component.log")
+            keep = True
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the row counts of the scenarios")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latency of every API request in seconds")
+    parser.add_argument("--scenario", action="append", help="Scenario to run, all scenarios by default")
+    parser.add_argument("--output", help="Path of the JSON report")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data folders")
+    args = parser.parse_args()
+
+    results = []
+    for name, tables, api_options, parameters in SCENARIOS:
+        if args.scenario and name not in args.scenario:
+            continue
+        result = run_scenario(name, tables, api_options, parameters, args.scale, args.latency, args.keep)
+        results.append(result)
+        print("{scenario:<18} rows={rows:<9} rows/s={rows_per_second:<10} peak_rss={peak_rss_mb}MB "
+              "exit={exit_code} requests={requests}".format(**result))
+        if "log" in result:
+            print("  upload incomplete, see {0}".format(result["log"]))
+
+    if args.output:
+        with open(args.output, "w") as file_out:
+            json.dump(results, file_out, indent=2)
+
+    return 0 if all(r["exit_code"] == 0 and r["rows_received"] == r["rows"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
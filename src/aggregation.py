@@ -0,0 +1,167 @@
+'''
+Pre-aggregation of input tables into grouped sums, counts, minimums and maximums.
+
+'''
+
+import csv
+import logging
+from decimal import Decimal, InvalidOperation
+
+from encoder import NULL_VALUES, iter_counted_lines
+from projection import PARSERS
+from table_files import has_header, iter_table_lines
+
+
+FUNCTIONS = ("sum", "count", "min", "max")
+
+
+def parse_integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+
+def parse_decimal(value):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Not a number: {value}")
+    if not number.is_finite():
+        raise ValueError(f"Not a finite number: {value}")
+    return number
+
+
+class Measure:
+    '''
+    One aggregated column, values which cannot be parsed by the column data type are ignored and counted
+    '''
+
+    def __init__(self, column, index, function, name, data_type):
+        if function not in FUNCTIONS:
+            raise ValueError("Aggregation function {0} is not supported, use one of {1}".format(
+                function, ", ".join(FUNCTIONS)))
+        if function == "sum" and data_type not in ("Int64", "Decimal"):
+            raise ValueError("Column {0} is not numeric and cannot be summed".format(column))
+        self.column = column
+        self.index = index
+        self.function = function
+        self.name = name
+        self.invalid = 0
+        if function == "count":
+            self.data_type = "Int64"
+        elif function == "sum":
+            self.data_type = data_type
+        else:
+            self.data_type = data_type or "String"
+        if function == "sum":
+            self.parse = parse_integer if data_type == "Int64" else parse_decimal
+        else:
+            self.parse = PARSERS.get(data_type, str)
+
+    def initial(self):
+        return 0 if self.function in ("sum", "count") else None
+
+    def update(self, accumulator, values):
+        if self.index is None:
+            return accumulator + 1
+        value = values[self.index] if self.index < len(values) else ''
+        if value in NULL_VALUES:
+            return accumulator
+        if self.function == "count":
+            return accumulator + 1
+        try:
+            parsed = self.parse(value)
+        except ValueError:
+            self.invalid += 1
+            return accumulator
+        if self.function == "sum":
+            return accumulator + parsed
+        if accumulator is None:
+            return (parsed, value)
+        if (self.function == "min" and parsed < accumulator[0]) or (self.function == "max" and parsed > accumulator[0]):
+            return (parsed, value)
+        return accumulator
+
+    def format(self, accumulator):
+        if accumulator is None:
+            return ''
+        if self.function in ("min", "max"):
+            return accumulator[1]
+        return str(accumulator)
+
+
+class TableAggregation:
+    '''
+    Grouping rows of a table by the dimension columns, the measures are computed in one pass over the file
+    and the result holds one row per group
+    '''
+
+    def __init__(self, columns, group_by, measures, column_types=None):
+        '''
+        columns are the columns of the table after the column selection, measures a list of
+        (column, function, name in the dataset), column is empty to count rows
+        '''
+
+        column_types = column_types or {}
+        for column in group_by + [column for column, _, _ in measures if column]:
+            if column not in columns:
+                raise ValueError("Column {0} is not found in the input table".format(column))
+        if not measures:
+            raise ValueError("No aggregated columns are configured")
+        self.group_by = list(group_by)
+        self.group_indexes = [columns.index(column) for column in group_by]
+        self.measures = [
+            Measure(column, columns.index(column) if column else None, function,
+                    name or "{0}_{1}".format(function, column or "rows"), column_types.get(column))
+            for column, function, name in measures
+        ]
+        self.columns = self.group_by + [measure.name for measure in self.measures]
+        if len(set(self.columns)) != len(self.columns):
+            raise ValueError("Column names {0} are not unique".format(self.columns))
+        self.column_types = dict({column: column_types.get(column, "String") for column in group_by},
+                                 **{measure.name: measure.data_type for measure in self.measures})
+
+    def aggregate(self, csv_path, output_path, projection=None):
+        '''
+        Streaming the input table and writing the aggregated rows to output_path, returns the number of groups
+        '''
+
+        groups = {}
+        group_indexes = self.group_indexes
+        measures = self.measures
+        input_rows = 0
+        reader = csv.reader(iter_counted_lines(iter_table_lines(csv_path), [0]))
+        if has_header(csv_path):
+            next(reader, None)
+        for values in reader:
+            if projection is not None:
+                values = projection.apply(values)
+                if values is None:
+                    continue
+            input_rows += 1
+            width = len(values)
+            key = tuple([values[i] if i < width else '' for i in group_indexes])
+            accumulators = groups.get(key)
+            if accumulators is None:
+                accumulators = groups[key] = [measure.initial() for measure in measures]
+            for i, measure in enumerate(measures):
+                accumulators[i] = measure.update(accumulators[i], values)
+
+        with open(output_path, 'w', newline='', encoding='utf-8') as file_out:
+            writer = csv.writer(file_out, lineterminator='\n')
+            writer.writerow(self.columns)
+            for key, accumulators in groups.items():
+                writer.writerow(list(key) + [measure.format(accumulator)
+                                             for measure, accumulator in zip(measures, accumulators)])
+
+        for measure in measures:
+            if measure.invalid:
+                logging.warning("{0} values of column {1} not matching the column data type were not aggregated".format(
+                    measure.invalid, measure.column))
+        logging.info("{0} rows aggregated into {1} rows".format(input_rows, len(groups)))
+
+        return len(groups)
@@ -0,0 +1,56 @@
+'''
+Upload progress stored in the component state to resume interrupted loads.
+
+'''
+
+import hashlib
+import json
+import threading
+
+
+class UploadCheckpoint:
+    '''
+    Progress of the tables uploaded into one dataset.
+    Progress of a table is only reused if the dataset, the table schema and the input file size match.
+    '''
+
+    def __init__(self, state, dataset_id):
+        state = state or {}
+        self.dataset_id = dataset_id
+        self.tables = state.get("tables", {}) if state.get("dataset_id") == dataset_id else {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def schema_hash(columns, column_types):
+        schema = [[column, column_types.get(column, "String")] for column in columns]
+        return hashlib.sha1(json.dumps(schema).encode('utf-8')).hexdigest()
+
+    def resume_point(self, table, schema_hash, byte_size):
+        '''
+        Saved progress of the table or None if the table has to be loaded from the start
+        '''
+
+        progress = self.tables.get(table)
+        if not progress:
+            return None
+        if progress.get("schema_hash") != schema_hash or progress.get("byte_size") != byte_size:
+            return None
+
+        return progress
+
+    def record(self, table, schema_hash, byte_size, row_index, byte_offset, completed=False):
+        with self._lock:
+            self.tables[table] = {
+                "schema_hash": schema_hash,
+                "byte_size": byte_size,
+                "row_index": row_index,
+                "byte_offset": byte_offset,
+                "completed": completed
+            }
+
+    def to_state(self):
+        with self._lock:
+            return {
+                "dataset_id": self.dataset_id,
+                "tables": dict(self.tables)
+            }
@@ -0,0 +1,59 @@
+'''
+Sizing of POST rows batches against a target request size.
+
+'''
+
+from rate_limiter import MAX_ROWS_PER_REQUEST
+
+
+DEFAULT_TARGET_BYTES = 2 * 1024 * 1024
+# Weight of the latest batch in the average encoded row size
+ROW_BYTES_SMOOTHING = 0.3
+GROWTH_FACTOR = 1.5
+# Smallest batch size the memory limit can shrink batches to
+MIN_MEMORY_ROW_LIMIT = 500
+
+
+class ChunkPlanner:
+    '''
+    Plans the number of rows of the next batch of one table.
+    The batch is sized by the average encoded row size, capped by the API row limit, halved
+    after the API rejects a batch as too large or times out and grown back after successes.
+    '''
+
+    def __init__(self, avg_row_bytes=0, target_bytes=DEFAULT_TARGET_BYTES, max_rows=MAX_ROWS_PER_REQUEST):
+        self.avg_row_bytes = avg_row_bytes
+        self.target_bytes = target_bytes
+        self.max_rows = max_rows
+        self.row_limit = max_rows
+        self.memory_row_limit = max_rows
+
+    def next_batch_size(self):
+        if self.avg_row_bytes > 0:
+            rows = int(self.target_bytes / self.avg_row_bytes)
+        else:
+            rows = self.max_rows
+        return max(1, min(rows, self.row_limit, self.memory_row_limit, self.max_rows))
+
+    def record_success(self, row_count, body_bytes):
+        row_bytes = body_bytes / max(1, row_count)
+        if self.avg_row_bytes > 0:
+            self.avg_row_bytes += ROW_BYTES_SMOOTHING * (row_bytes - self.avg_row_bytes)
+        else:
+            self.avg_row_bytes = row_bytes
+        if self.row_limit < self.max_rows:
+            self.row_limit = min(self.max_rows, int(self.row_limit * GROWTH_FACTOR) + 1)
+
+    def record_failure(self, row_count):
+        self.row_limit = max(1, row_count // 2)
+
+    def shrink(self):
+        '''
+        Halving the batch size when memory usage is high
+        '''
+
+        self.memory_row_limit = max(MIN_MEMORY_ROW_LIMIT, self.next_batch_size() // 2)
+
+    def relax(self):
+        if self.memory_row_limit < self.max_rows:
+            self.memory_row_limit = min(self.max_rows, int(self.memory_row_limit * GROWTH_FACTOR) + 1)
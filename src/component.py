@@ -3,23 +3,40 @@ Template Component main class.
 
 '''
 
-import csv
 import logging
 import logging_gelf.handlers
 import logging_gelf.formatters
 import os
 import sys
 import json
+import shutil
+import tempfile
 from datetime import datetime  # noqa
-import time
-import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 from kbc.env_handler import KBCEnvHandler
 from kbc.result import KBCTableDef  # noqa
 from kbc.result import ResultWriter  # noqa
 
-from powerbi import PowerBI
+from checkpoint import UploadCheckpoint
+from dataset_cache import DatasetCache
+from fingerprint import FingerprintStore
+from memory import MemoryGuard
+from metrics import write_report
+from plan import plan_dataset, plan_table, write_plan
+from powerbi import TRANSIENT_ERRORS, PowerBI, create_session
+from prefetch import DEFAULT_PREFETCH_DEPTH
+from quarantine import Quarantine
+from rate_limiter import LARGE_TABLE_ROW_COUNT, RateGovernor
+from scanner import scan_table
+from sharding import MIN_SHARDED_BYTES, SHARDS_PER_PROCESS, ParserPool, default_processes
+from spool import SharedTables
+from token_manager import TokenManager
+from schema import diff_tables
+from uploader import TableUpload, Uploader
+from validation import POLICIES, POLICY_FAIL, POLICY_SEND_AS_STRING, table_limit_errors, value_issues
 
 
 # configuration variables
@@ -28,6 +45,33 @@ KEY_WORKSPACE = 'workspace'
 KEY_INCREMENTAL = 'incremental'
 KEY_TABLE_RELATIONSHIP = 'table_relationship'
 KEY_INCREMENTAL = 'incremental_load'
+KEY_MAX_CONCURRENT_UPLOADS = 'max_concurrent_uploads'
+KEY_COMPRESS_REQUESTS = 'compress_requests'
+KEY_RESUME_UPLOAD = 'resume_upload'
+KEY_DELTA_LOAD = 'delta_load'
+KEY_MAX_MEMORY_MB = 'max_memory_mb'
+KEY_INVALID_VALUES = 'invalid_values'
+KEY_COLUMN_SELECTION = 'column_selection'
+KEY_ROW_FILTERS = 'row_filters'
+KEY_AGGREGATION_GROUP_BY = 'aggregation_group_by'
+KEY_AGGREGATION_MEASURES = 'aggregation_measures'
+KEY_PARSE_PROCESSES = 'parse_processes'
+KEY_DRY_RUN = 'dry_run'
+KEY_QUARANTINE_REJECTED_ROWS = 'quarantine_rejected_rows'
+KEY_PREFETCH_DEPTH = 'prefetch_depth'
+KEY_SHARE_PARSED_TABLES = 'share_parsed_tables'
+
+# Performance report of the run, stored in out/files
+REPORT_FILE_NAME = 'powerbi_upload_report.json'
+PLAN_FILE_NAME = 'powerbi_upload_plan.json'
+QUARANTINE_TABLE_NAME = 'powerbi_rejected_rows.csv'
+
+# state keys
+STATE_UPLOAD_CHECKPOINT = 'upload_checkpoint'
+STATE_ROW_FINGERPRINTS = 'row_fingerprints'
+STATE_TABLE_SCHEMAS = 'table_schemas'
+STATE_DATASET_CACHE = 'dataset_cache'
+STATE_DATASETS = 'datasets'
 
 MANDATORY_PARS = [
     KEY_DATASET,
@@ -37,8 +81,8 @@ MANDATORY_PARS = [
 ]
 MANDATORY_IMAGE_PARS = []
 
-# Default Table Output Destination
-DEFAULT_TABLE_SOURCE = "/data/in/tables/"
+# OAuth token endpoint, can be pointed to a local stand-in
+TOKEN_URL = os.getenv("POWERBI_TOKEN_URL", "https://login.microsoftonline.com/common/oauth2/token")
 
 # Logging
 logging.basicConfig(
@@ -61,6 +105,7 @@ if 'KBC_LOGGER_ADDR' in os.environ and 'KBC_LOGGER_PORT' in os.environ:
 
 APP_VERSION = '0.0.7'
 MAX_ROW_COUNT = 3_000_000
+DEFAULT_MAX_CONCURRENT_UPLOADS = 4
 
 
 class Component(KBCEnvHandler):
@@ -79,7 +124,7 @@ class Component(KBCEnvHandler):
 
     def get_oauth_token(self, config):
         """
-        Extracting OAuth Token out of Authorization
+        Extracting OAuth Token out of Authorization, returns the token and its lifetime in seconds
         """
 
         data = config["oauth_api"]["credentials"]
@@ -89,7 +134,7 @@ class Component(KBCEnvHandler):
         client_secret = data["#appSecret"]
         refresh_token = data_encrypted["refresh_token"]
 
-        url = "https://login.microsoftonline.com/common/oauth2/token"
+        url = TOKEN_URL
         header = {
             "Content-Type": "application/x-www-form-urlencoded"
         }
@@ -112,7 +157,7 @@ class Component(KBCEnvHandler):
         data_r = response.json()
         token = data_r["access_token"]
 
-        return token
+        return token, data_r.get("expires_in")
 
     def get_tables(self, tables, mapping):
         """
@@ -147,13 +192,9 @@ class Component(KBCEnvHandler):
                 "No tables are found in input mapping to export into PowerBI.")
             sys.exit(1)
 
-        for table in in_tables:
-            self.check_csv_row_count(table.get("full_path"))
-
         # Activate when oauth in KBC is ready
         # Get Authorization Token
         authorization = self.configuration.get_authorization()
-        oauth_token = self.get_oauth_token(authorization)
 
         # Configuration parameters
         params = self.cfg_params  # noqa
@@ -162,6 +203,14 @@ class Component(KBCEnvHandler):
             logging.error(
                 "There are no inputs in the configurations. Please configure.")
             sys.exit(1)
+
+        # Dry run plans the upload from the input tables only, nothing is sent to Power BI
+        dry_run = bool(params.get(KEY_DRY_RUN, False))
+        # Token is refreshed in the background, long rate limited uploads can outlive it
+        token_manager = None
+        if not dry_run:
+            token_manager = TokenManager(lambda: self.get_oauth_token(authorization))
+            token_manager.start()
         workspace = params["workspace"]
         dataset_array = params["dataset"]
         # Handling input error
@@ -176,94 +225,444 @@ class Component(KBCEnvHandler):
         else:
             incremental = False
 
-        dataset_type = dataset_array[0]["dataset_type"]
-        dataset = dataset_array[0]["dataset_input"]
+        datasets = [(item["dataset_type"], item["dataset_input"]) for item in dataset_array]
+        if len(set(datasets)) != len(datasets):
+            logging.error("The same dataset is configured more than once. Please remove the duplicates.")
+            sys.exit(1)
         table_relationship = params["table_relationship"]
         # TEMP authorization method
         # oauth_token = params["#access_token"]
 
-        _PowerBI = PowerBI(
-            oauth_token=oauth_token,
-            workspace=workspace,
-            dataset_type=dataset_type,
-            dataset=dataset,
-            input_tables=in_table_names,
-            table_relationship=table_relationship
-        )
-
-        # Dropping rows in table
-        # will find better ways to load incrementally
-        # currently have issues to load the same table consecutively
-        if _PowerBI.dataset_found:
-            all_tables = _PowerBI.get_tables()  # noqa
-            drop_file_bool = True  # noqa
-            """for file in _PowerBI.input_table_columns:
-                logging.info("FILE: {}".format(file))
-                if file not in all_tables:
-                    drop_file_bool = False
-                    if dataset_type != "ID":
-                        logging.info("DELETE DATASET")
-                        _PowerBI.dataset_found = False
-                        _PowerBI.delete_dataset()
-                    else:
-                        logging.error(
-                            "Schema does not match. Please create a new dataset or modify the input tables to match "
-                            + "the input dataset_id's schema")
-                        sys.exit(1)"""
-            drop_list = []
-            for file in _PowerBI.input_table_columns:
-                if file in all_tables:
-                    drop_list.append(file)
-
-            # if drop_file_bool:
-            if len(drop_list) > 0 and not incremental:
-                # for file in _PowerBI.input_table_columns:
-                for file in drop_list:
-                    _PowerBI.delete_rows(file)
+        # Input tables of the data folder, /data/in/tables/ in the production environment
+        table_source = os.path.join(self.data_path, 'in', 'tables', '')
+
+        # Connections are pooled, one per concurrent upload of every dataset
+        max_workers = max(1, int(params.get(KEY_MAX_CONCURRENT_UPLOADS) or DEFAULT_MAX_CONCURRENT_UPLOADS))
+        compress = bool(params.get(KEY_COMPRESS_REQUESTS, False))
+        session = create_session(max_workers * len(datasets))
+
+        # Workspace listing is cached between runs
+        state = self.get_state_file() or {}
+        dataset_cache = DatasetCache(state.get(STATE_DATASET_CACHE), workspace)
+        dataset_states = self.get_dataset_states(state, datasets)
+
+        # Datasets share the session, the token and the workspace listing
+        projections = self.get_projections(params)
+        aggregations = self.get_aggregations(params)
+        clients = []
+        for dataset_type, dataset in datasets:
+            clients.append(PowerBI(
+                oauth_token=token_manager.token if token_manager else None,
+                workspace=workspace,
+                dataset_type=dataset_type,
+                dataset=dataset,
+                input_tables=in_table_names,
+                table_relationship=table_relationship,
+                session=session,
+                compress=compress,
+                table_source=table_source,
+                dataset_cache=dataset_cache,
+                token_manager=token_manager,
+                projections=projections,
+                aggregations=aggregations,
+                offline=dry_run
+            ))
+
+        # Input tables are read once up front and validated against the limits before anything is sent,
+        # the scans are shared by all datasets and reused for progress reporting
+        invalid_values = params.get(KEY_INVALID_VALUES) or POLICY_SEND_AS_STRING
+        if invalid_values not in POLICIES:
+            logging.error("Invalid values policy {0} is not supported, use one of {1}".format(
+                invalid_values, ", ".join(POLICIES)))
+            sys.exit(1)
+        # Aggregated tables are written to a temporary folder and uploaded instead of the input tables
+        aggregation_dir = tempfile.mkdtemp(prefix='aggregated_tables_') if aggregations else None
+        sources = self.aggregate_tables(in_tables, clients[0], aggregation_dir)
+        scans = self.scan_tables(sources, clients[0])
+        if dry_run:
+            self.write_upload_plan(clients, scans, max_workers, params)
+            if aggregation_dir:
+                shutil.rmtree(aggregation_dir, ignore_errors=True)
+            self.validate_tables(scans, invalid_values)
+            # State of the previous run is kept as it was
+            self.write_state_file(state)
+            logging.info("Dry run finished, no rows were uploaded")
+            return
+        self.validate_tables(scans, invalid_values)
+
+        # Batches of every table are read and encoded ahead of the request in flight, 0 reads them when sent
+        prefetch_depth = params.get(KEY_PREFETCH_DEPTH)
+        prefetch_depth = max(0, int(prefetch_depth)) if prefetch_depth is not None else DEFAULT_PREFETCH_DEPTH
+        # Large tables are parsed in worker processes, 0 uses all available cores and 1 parses in the upload threads
+        parse_processes = int(params.get(KEY_PARSE_PROCESSES) or 0) or default_processes()
+        parser_pool = None
+        if parse_processes > 1 and any(scan.byte_size >= MIN_SHARDED_BYTES for scan in scans.values()):
+            logging.info("Large tables are parsed by {0} processes".format(parse_processes))
+            parser_pool = ParserPool(parse_processes)
+        # Batches in flight and their size are lowered when memory usage gets close to the limit,
+        # shards parsed ahead by the worker processes share one budget for all uploads
+        max_memory_mb = params.get(KEY_MAX_MEMORY_MB)
+        memory_guard = MemoryGuard(int(max_memory_mb) * 2 ** 20 if max_memory_mb else None,
+                                   max_workers * len(datasets) * (prefetch_depth + 1),
+                                   SHARDS_PER_PROCESS * parse_processes if parser_pool else 0)
+        # Several datasets read every table from a spool parsed and encoded once for all of them,
+        # encoded rows not read by every dataset yet are kept on disk
+        shared_tables = None
+        if params.get(KEY_SHARE_PARSED_TABLES) and len(clients) > 1:
+            shared_tables = SharedTables(tempfile.mkdtemp(prefix='shared_tables_'), clients, parser_pool,
+                                         memory_guard)
+        # Rows rejected by Power BI are isolated and kept in an output table instead of failing the upload
+        quarantine = None
+        if params.get(KEY_QUARANTINE_REJECTED_ROWS):
+            quarantine = Quarantine(os.path.join(self.data_path, 'out', 'tables', QUARANTINE_TABLE_NAME))
+        settings = {
+            "incremental": incremental,
+            "resume": bool(params.get(KEY_RESUME_UPLOAD, False)),
+            "delta_load": bool(params.get(KEY_DELTA_LOAD, False)),
+            "invalid_values": invalid_values,
+            "max_workers": max_workers,
+            "sources": sources,
+            "parser_pool": parser_pool,
+            "quarantine": quarantine,
+            "prefetch_depth": prefetch_depth,
+            "shared_tables": shared_tables
+        }
 
-        # Creating dataset is not found
-        if not _PowerBI.dataset_found:
-            logging.info("Creating new dataset: {}".format(dataset))
-            _PowerBI.create_dataset()
-            # Search loop until the dataset is created
-            while not _PowerBI.dataset_found:
-                _PowerBI.dataset_found = _PowerBI.search_datasetid()
-
-        # API limits parameters
-        start_time = time.time()
-        one_min_in_sec = 60
-        num_of_post_request = 0
-        for file in _PowerBI.input_table_columns:
-            logging.info("Loading table: {0}".format(file))
-
-            for chunk in pd.read_csv(DEFAULT_TABLE_SOURCE+file+'.csv', dtype=str, chunksize=10000):
-                rows = chunk.to_json(orient='records')
-                if (int(time.time())-start_time) <= one_min_in_sec and num_of_post_request <= 120:
-                    _PowerBI.post_rows(file, rows)
-                    num_of_post_request += 1
-                else:
-                    wait_sec = one_min_in_sec - (int(time.time())-start_time)
-                    if wait_sec > 0:
-                        time.sleep(wait_sec)
-                    start_time = time.time()
-                    _PowerBI.post_rows(file, rows)
-                    num_of_post_request = 1
+        # Datasets are loaded concurrently, each within its own API limits
+        results, errors = self.load_datasets(clients, scans, dataset_states, memory_guard, settings)
+
+        if shared_tables:
+            shared_tables.close()
+        if parser_pool:
+            parser_pool.shutdown()
+        if quarantine:
+            quarantine.close()
+            if quarantine.row_count:
+                logging.warning("{0} rows rejected by Power BI were written to the output table {1}".format(
+                    quarantine.row_count, QUARANTINE_TABLE_NAME))
+        if aggregation_dir:
+            shutil.rmtree(aggregation_dir, ignore_errors=True)
+        if memory_guard.enabled:
+            logging.info("Memory: {0}".format(memory_guard.metrics()))
+        write_report(os.path.join(self.data_path, 'out', 'files', REPORT_FILE_NAME),
+                     [summary for result in results for summary in result["tables"]],
+                     {result["dataset"]: result["rate_limits"] for result in results},
+                     memory_guard.metrics() if memory_guard.enabled else None)
+        token_manager.stop()
+        if errors:
+            raise errors[0]
+
+        # Keboola keeps the state of successful jobs only, interrupted upload finishes with a warning
+        for result in results:
+            if result["interrupted"]:
+                logging.warning("Upload into dataset {0} was interrupted. Progress is saved and the next run will "
+                                "resume from the first chunk not sent.".format(result["dataset"]))
+        state = {
+            STATE_DATASET_CACHE: dataset_cache.to_state(),
+            STATE_DATASETS: dataset_states
+        }
+        self.write_state_file(state)
 
         logging.info("Extraction finished")
 
     @staticmethod
-    def check_csv_row_count(csv_file_path):
-        with open(csv_file_path, 'r') as file:
-            csv_reader = csv.reader(file)
-            row_count = sum(1 for _ in csv_reader)
-
-            if row_count > MAX_ROW_COUNT:
-                logging.error(f"CSV file exceeds maximum row count. Found {row_count} rows, "
-                              f"expected {MAX_ROW_COUNT} or less.")
-                logging.error("Push datasets are very limited in their functionality. "
-                              "They're designed only for a near real-time streaming scenario to be consumed by a "
-                              "streaming tile in a dashboard, and not by a Power BI report.")
+    def get_projections(params):
+        '''
+        Column selection and row filters of the configuration grouped by table
+        '''
+
+        projections = {}
+        for item in params.get(KEY_COLUMN_SELECTION) or []:
+            projection = projections.setdefault(item["table"], {"columns": [], "filters": []})
+            projection["columns"].append((item["column"], item.get("rename_to") or None))
+        for item in params.get(KEY_ROW_FILTERS) or []:
+            projection = projections.setdefault(item["table"], {"columns": [], "filters": []})
+            projection["filters"].append((item["column"], item["operator"], item["value"]))
+
+        return projections
+
+    @staticmethod
+    def get_aggregations(params):
+        '''
+        Group columns and aggregated columns of the configuration grouped by table,
+        only tables with aggregated columns are aggregated
+        '''
+
+        aggregations = {}
+        for item in params.get(KEY_AGGREGATION_MEASURES) or []:
+            aggregation = aggregations.setdefault(item["table"], {"group_by": [], "measures": []})
+            aggregation["measures"].append((item.get("column") or None, item.get("function") or "sum",
+                                            item.get("rename_to") or None))
+        for item in params.get(KEY_AGGREGATION_GROUP_BY) or []:
+            if item["table"] not in aggregations:
+                logging.error("Table {0}: group columns are configured without aggregated columns.".format(
+                    item["table"]))
+                sys.exit(1)
+            aggregations[item["table"]]["group_by"].append(item["column"])
+
+        return aggregations
+
+    @staticmethod
+    def get_dataset_states(state, datasets):
+        '''
+        State of every configured dataset, keyed by the dataset type and value.
+        State written before several datasets were supported is used for a single configured dataset.
+        '''
+
+        saved = state.get(STATE_DATASETS)
+        if saved is None and len(datasets) == 1:
+            saved = {"{0}:{1}".format(*datasets[0]): {
+                key: state[key] for key in (STATE_UPLOAD_CHECKPOINT, STATE_ROW_FINGERPRINTS, STATE_TABLE_SCHEMAS)
+                if key in state
+            }}
+        saved = saved or {}
+
+        return {"{0}:{1}".format(*dataset): saved.get("{0}:{1}".format(*dataset), {}) for dataset in datasets}
+
+    def load_datasets(self, clients, scans, dataset_states, memory_guard, settings):
+        '''
+        Loading the datasets concurrently, the first failed dataset stops the uploads of the others
+        at their next batch. The state of a failed job is not kept, rows sent by the other datasets
+        after the failure would be sent again by the next run.
+        Returns the results of the loaded datasets and the errors of the failed ones.
+        '''
+
+        aborts = [threading.Event() for _ in clients]
+
+        def load(client, dataset_state, abort):
+            try:
+                return self.load_dataset(client, scans, dataset_state, memory_guard, settings, abort)
+            except (Exception, SystemExit):
+                for event in aborts:
+                    event.set()
+                raise
+
+        results = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            futures = [executor.submit(load, client, dataset_states[key], abort)
+                       for client, key, abort in zip(clients, dataset_states, aborts)]
+            for client, future in zip(clients, futures):
+                try:
+                    results.append(future.result())
+                except (Exception, SystemExit) as e:
+                    logging.error("Loading dataset {0} failed.".format(client.dataset))
+                    errors.append(e)
+
+        return results, errors
+
+    def load_dataset(self, _PowerBI, scans, dataset_state, memory_guard, settings, abort=None):
+        '''
+        Uploading all input tables into one dataset, the dataset state is updated in place.
+        Uploads stop at their next batch once abort is set.
+        '''
+
+        # Creating dataset is not found
+        dataset_created = not _PowerBI.dataset_found
+        if dataset_created:
+            logging.info("Creating new dataset: {}".format(_PowerBI.dataset))
+            _PowerBI.create_dataset()
+
+        # Progress of a previously interrupted run, tables with saved progress are not dropped
+        resume = settings["resume"]
+        delta_load = settings["delta_load"]
+        checkpoint = UploadCheckpoint(dataset_state.get(STATE_UPLOAD_CHECKPOINT) if resume else None,
+                                      _PowerBI.dataset_id)
+        fingerprints = FingerprintStore(dataset_state.get(STATE_ROW_FINGERPRINTS), _PowerBI.dataset_id)
+        primary_keys = _PowerBI.fetch_table_primary_keys()
+        uploads = []
+        for file, columns in _PowerBI.input_table_columns.items():
+            column_types = _PowerBI.get_column_types(file)
+            scan = scans.get(file)
+            schema_hash = checkpoint.schema_hash(columns, column_types)
+            resume_point = checkpoint.resume_point(file, schema_hash, scan.byte_size if scan else None)
+            if resume_point:
+                logging.info("Table {0}: resuming after {1} rows processed by the previous run".format(
+                    file, resume_point["row_index"]))
+            delta = fingerprints.delta_filter(file, columns, primary_keys.get(file)) if delta_load else None
+            uploads.append(TableUpload(file, settings["sources"][file], columns, column_types,
+                                       scan=scan, schema_hash=schema_hash, resume_point=resume_point, delta=delta,
+                                       invalid_values=settings["invalid_values"],
+                                       projection=_PowerBI.get_projection(file)))
+
+        # Schema changes and dropping rows are prepared per table, each upload starts after its own preparation
+        # delta load appends only new rows to the rows pushed before
+        if not dataset_created:
+            all_tables, table_definitions = self.reconcile_schema(_PowerBI, dataset_state.get(STATE_TABLE_SCHEMAS))
+            for table in uploads:
+                table.table_definition = table_definitions.get(table.name)
+                table.drop_rows = (table.name in all_tables and not table.resume_point
+                                   and not settings["incremental"] and not delta_load)
+                if table.delta is not None and table.name not in all_tables:
+                    # the table is created empty, rows pushed into it before are gone
+                    fingerprints.forget(table.name)
+                    table.delta = fingerprints.delta_filter(table.name, table.columns, primary_keys.get(table.name))
+
+        # Tables are uploaded concurrently, API limits are enforced by the governor shared by all uploads
+        governor = RateGovernor()
+        if any(table.scan and table.scan.row_count >= LARGE_TABLE_ROW_COUNT for table in uploads):
+            logging.info("Tables with {0} or more rows are loaded, POST rows requests are limited to 120 per "
+                         "hour".format(LARGE_TABLE_ROW_COUNT))
+            governor.enable_large_table_regime()
+        abort = abort or threading.Event()
+        uploader = Uploader(_PowerBI, governor, checkpoint, abort, memory_guard, settings["parser_pool"],
+                            settings["quarantine"], settings["prefetch_depth"], settings["shared_tables"])
+        saved_progress = checkpoint.to_state()["tables"]
+        interrupted = False
+        try:
+            uploader.run(uploads, settings["max_workers"])
+        except TRANSIENT_ERRORS as e:
+            # only failures which may pass in the next run are resumed, other failures fail the job
+            if not resume:
+                logging.error("Dataset {0}: {1}".format(_PowerBI.dataset, e))
                 sys.exit(1)
+            logging.warning("Dataset {0}: upload interrupted - {1}".format(_PowerBI.dataset, e))
+            interrupted = True
+        if not interrupted and abort.is_set():
+            logging.warning("Dataset {0}: upload stopped, loading another dataset failed".format(_PowerBI.dataset))
+        resumed = resume and STATE_UPLOAD_CHECKPOINT in dataset_state
+        if interrupted and resumed and checkpoint.to_state()["tables"] == saved_progress:
+            logging.error("Dataset {0}: the resumed upload made no progress past the progress saved by the previous "
+                          "run.".format(_PowerBI.dataset))
+            sys.exit(1)
+
+        logging.info("Dataset {0} rate limits: {1}".format(_PowerBI.dataset, governor.metrics()))
+
+        if interrupted:
+            dataset_state[STATE_UPLOAD_CHECKPOINT] = checkpoint.to_state()
+        else:
+            dataset_state.pop(STATE_UPLOAD_CHECKPOINT, None)
+        if delta_load:
+            dataset_state[STATE_ROW_FINGERPRINTS] = fingerprints.to_state()
+        else:
+            # rows are dropped or sent without fingerprints, the fingerprints no longer tell the rows in the dataset
+            dataset_state.pop(STATE_ROW_FINGERPRINTS, None)
+        dataset_state[STATE_TABLE_SCHEMAS] = {
+            "dataset_id": _PowerBI.dataset_id,
+            "tables": {table["name"]: table["columns"] for table in _PowerBI.dataset_payload["tables"]}
+        }
+
+        return {
+            "dataset": _PowerBI.dataset,
+            "interrupted": interrupted,
+            "tables": [dict(metrics.summary(), dataset=_PowerBI.dataset) for metrics in uploader.metrics.values()],
+            "rate_limits": governor.metrics()
+        }
+
+    def reconcile_schema(self, powerbi, recorded_schemas):
+        '''
+        Finding the missing tables and the tables whose schema differs from the input tables.
+        Get Tables does not return columns of push datasets, schemas pushed by previous runs are used instead.
+        Returns names of the tables existing in the dataset and the table definitions to be pushed.
+        '''
+
+        existing_tables = powerbi.get_table_definitions()
+        recorded = {}
+        if recorded_schemas and recorded_schemas.get("dataset_id") == powerbi.dataset_id:
+            recorded = recorded_schemas.get("tables") or {}
+        missing, changed = diff_tables(powerbi.dataset_payload["tables"], existing_tables, recorded)
+
+        for table in missing:
+            logging.info("Table {0}: not found in the dataset, creating".format(table["name"]))
+        for table in changed:
+            logging.info("Table {0}: schema changed or not recorded by a previous run, updating".format(
+                table["name"]))
+
+        return list(existing_tables), {table["name"]: table for table in missing + changed}
+
+    def aggregate_tables(self, in_tables, powerbi, aggregation_dir):
+        '''
+        Pre-aggregating the configured tables, returns the file to be uploaded for every input table
+        '''
+
+        sources = {}
+        for table in in_tables:
+            path = table.get("full_path")
+            name = os.path.splitext(os.path.basename(path))[0]
+            aggregation = powerbi.get_aggregation(name)
+            if aggregation is None:
+                sources[name] = path
+                continue
+            projection = powerbi.projections.get(name)
+            logging.info("Table {0}: aggregating by {1}".format(name, ", ".join(aggregation.group_by) or "all rows"))
+            sources[name] = os.path.join(aggregation_dir, name + '.csv')
+            aggregation.aggregate(path, sources[name], None if projection.identity else projection)
+
+        return sources
+
+    def scan_tables(self, sources, powerbi):
+        '''
+        Scanning input tables and validating their values against the column data types of the manifests.
+        Sliced tables are read slice by slice, plain or gzipped, without merging the slices.
+        '''
+
+        scans = {}
+        for name, path in sources.items():
+            scan = scan_table(path, powerbi.get_column_types(name), powerbi.get_projection(name),
+                              powerbi.input_table_columns[name])
+            self.check_csv_row_count(scan.row_count)
+            logging.info("Table {0}: {1} rows, {2} bytes".format(name, scan.row_count, scan.byte_size))
+            scans[name] = scan
+
+        return scans
+
+    def write_upload_plan(self, clients, scans, max_workers, params):
+        '''
+        Writing the requests, payload and duration expected by uploading the scanned tables into every dataset
+        '''
+
+        datasets = []
+        for client in clients:
+            tables = [plan_table(name, scans.get(name), columns, client.get_column_types(name))
+                      for name, columns in client.input_table_columns.items()]
+            large_table_regime = any(table["rows"] >= LARGE_TABLE_ROW_COUNT for table in tables)
+            plan = plan_dataset(client.dataset, tables, max_workers, large_table_regime)
+            logging.info("Dataset {0}: {1} rows in {2} requests, about {3} seconds, limited by {4}".format(
+                client.dataset, plan["rows"], plan["requests"], plan["estimated_seconds"],
+                plan["limited_by"] or "no rate limit"))
+            datasets.append(plan)
+
+        notes = []
+        if params.get(KEY_DELTA_LOAD) or params.get(KEY_RESUME_UPLOAD):
+            notes.append("Rows already uploaded by previous runs are not known, rows and requests are upper bounds")
+        write_plan(os.path.join(self.data_path, 'out', 'files', PLAN_FILE_NAME), datasets, max_workers, notes)
+
+    @staticmethod
+    def validate_tables(scans, invalid_values):
+        '''
+        Failing before the upload on violations of the push dataset limits, invalid values fail the run
+        only with the fail policy
+        '''
+
+        errors = table_limit_errors(scans)
+        for name, scan in scans.items():
+            issues = value_issues(name, scan)
+            if invalid_values == POLICY_FAIL:
+                errors.extend(issues)
+                continue
+            for issue in issues:
+                logging.warning(issue)
+            if issues:
+                logging.warning("Table {0}: {1} rows with invalid values, policy: {2}".format(
+                    name, scan.invalid_rows, invalid_values))
+
+        if errors:
+            for error in errors:
+                logging.error(error)
+            logging.error("Input tables do not meet the limits of push datasets: "
+                          "https://learn.microsoft.com/en-us/power-bi/developer/embedded/push-datasets-limitations")
+            sys.exit(1)
+
+    @staticmethod
+    def check_csv_row_count(row_count):
+        if row_count > MAX_ROW_COUNT:
+            logging.error(f"CSV file exceeds maximum row count. Found {row_count} rows, "
+                          f"expected {MAX_ROW_COUNT} or less.")
+            logging.error("Push datasets are very limited in their functionality. "
+                          "They're designed only for a near real-time streaming scenario to be consumed by a "
+                          "streaming tile in a dashboard, and not by a Power BI report.")
+            logging.error("Large tables can be pre-aggregated before the upload, see the aggregation settings.")
+            sys.exit(1)
 
 
 """
@@ -0,0 +1,65 @@
+'''
+Datasets of a workspace cached in the component state.
+
+'''
+
+import time
+
+
+# Workspace listing older than this is fetched again
+DEFAULT_TTL_SECONDS = 3600
+
+
+class DatasetCache:
+    '''
+    Name to ID and ID to metadata index of the datasets of one workspace.
+    The index is only reused if it was built from a listing of the same workspace within the TTL.
+    '''
+
+    def __init__(self, state=None, workspace='', ttl=DEFAULT_TTL_SECONDS):
+        state = state or {}
+        self.workspace = workspace
+        self.ttl = ttl
+        self.datasets = {}
+        self.listed_at = None
+        self.names = {}
+        listed_at = state.get("listed_at")
+        if state.get("workspace") == workspace and listed_at and time.time() - listed_at < ttl:
+            self.listed_at = listed_at
+            for dataset in state.get("datasets", []):
+                self.add(dataset)
+
+    @property
+    def fresh(self):
+        return self.listed_at is not None and time.time() - self.listed_at < self.ttl
+
+    def update(self, datasets):
+        '''
+        Replacing the index with the full listing of the workspace
+        '''
+
+        self.datasets = {}
+        self.names = {}
+        self.listed_at = time.time()
+        for dataset in datasets:
+            self.add(dataset)
+
+    def add(self, dataset):
+        self.remove(dataset["id"])
+        self.datasets[dataset["id"]] = {"id": dataset["id"], "name": dataset["name"]}
+        self.names.setdefault(dataset["name"], []).append(dataset["id"])
+
+    def remove(self, dataset_id):
+        dataset = self.datasets.pop(dataset_id, None)
+        if dataset:
+            self.names[dataset["name"]].remove(dataset_id)
+
+    def ids_by_name(self, name):
+        return list(self.names.get(name, []))
+
+    def to_state(self):
+        return {
+            "workspace": self.workspace,
+            "listed_at": self.listed_at,
+            "datasets": list(self.datasets.values())
+        }
@@ -0,0 +1,267 @@
+'''
+Streaming encoding of input CSV files into POST rows request bodies.
+
+'''
+
+import csv
+import math
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from json.encoder import encode_basestring
+
+from table_files import has_header, iter_table_lines
+from validation import MAX_STRING_LENGTH, POLICY_SKIP_ROW, POLICY_TRUNCATE
+
+
+# Values loaded as null by pandas.read_csv, which was used to read the input tables previously
+NULL_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+JSON_NULL = 'null'
+
+TRUE_VALUES = frozenset(['true', 't', '1', 'yes', 'y'])
+FALSE_VALUES = frozenset(['false', 'f', '0', 'no', 'n'])
+
+INTEGER_PATTERN = re.compile(r'-?(0|[1-9][0-9]*)\Z')
+NUMBER_PATTERN = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?\Z')
+# ISO-8601 date with optional time, fraction of any length and offset written as Z, +HH, +HHMM or +HH:MM
+DATETIME_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2})(?::(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?)?'
+                              r'\s*(?:(Z)|([+-])(\d{2}):?(\d{2})?)?\Z')
+
+
+def encode_string(value):
+    return encode_basestring(value)
+
+
+def encode_truncated_string(value):
+    return encode_basestring(value[:MAX_STRING_LENGTH])
+
+
+def encode_limited_string(value):
+    if len(value) > MAX_STRING_LENGTH:
+        raise ValueError(f"Longer than {MAX_STRING_LENGTH} characters")
+    return encode_basestring(value)
+
+
+def encode_integer(value):
+    if INTEGER_PATTERN.match(value):
+        return value
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"Not an integer: {value}")
+    return str(int(number))
+
+
+def encode_decimal(value):
+    if NUMBER_PATTERN.match(value):
+        return value
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Not a finite number: {value}")
+    return repr(number)
+
+
+def encode_boolean(value):
+    lowered = value.strip().lower()
+    if lowered in TRUE_VALUES:
+        return 'true'
+    if lowered in FALSE_VALUES:
+        return 'false'
+    raise ValueError(f"Not a boolean: {value}")
+
+
+def parse_iso_datetime(value):
+    '''
+    Parsing ISO-8601 datetime without relying on datetime.fromisoformat, which accepts fewer forms before
+    Python 3.11. Fractions of seconds are truncated to microseconds.
+    '''
+
+    stripped = value.strip()
+    # plain dates and datetimes with seconds are parsed the same way by every version
+    if (len(stripped) == 10 or len(stripped) == 19 and stripped[10] in 'T ' and stripped[13] == ':'
+            and stripped[16] == ':') and stripped[4] == '-' and stripped[7] == '-':
+        try:
+            return datetime.fromisoformat(stripped)
+        except ValueError:
+            pass
+    match = DATETIME_PATTERN.match(stripped)
+    if not match:
+        raise ValueError(f"Not an ISO-8601 datetime: {value}")
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    tzinfo = None
+    if utc:
+        tzinfo = timezone.utc
+    elif sign:
+        offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes or 0))
+        tzinfo = timezone(-offset if sign == '-' else offset)
+    return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                    int((fraction or '0')[:6].ljust(6, '0')), tzinfo)
+
+
+def encode_datetime(value):
+    return '"' + parse_iso_datetime(value).isoformat() + '"'
+
+
+# Power BI column data types, as defined by PowerBI._define_datatype
+ENCODERS = {
+    "String": encode_string,
+    "Int64": encode_integer,
+    "Decimal": encode_decimal,
+    "Boolean": encode_boolean,
+    "DateTime": encode_datetime
+}
+
+
+class RowEncoder:
+    '''
+    Encoding CSV rows into JSON objects with values typed by the column data types.
+    Values which cannot be converted are sent as strings, as before, and counted per column.
+    With the truncate policy long strings are truncated and values not matching the data type are sent empty,
+    with the skip_row policy rows with such values are not sent.
+    '''
+
+    def __init__(self, columns, column_types=None, policy=None):
+        column_types = column_types or {}
+        string_encoder = {
+            POLICY_TRUNCATE: encode_truncated_string,
+            POLICY_SKIP_ROW: encode_limited_string
+        }.get(policy, encode_string)
+        self.columns = columns
+        self.column_types = column_types
+        self.policy = policy
+        self.keys = [encode_basestring(column) + ':' for column in columns]
+        self.encoders = [ENCODERS.get(column_types.get(column), encode_string) for column in columns]
+        self.encoders = [string_encoder if encode is encode_string else encode for encode in self.encoders]
+        self.errors = dict.fromkeys(columns, 0)
+        self.skipped_rows = 0
+        self.invalid_rows = 0
+
+    def encode(self, values):
+        '''
+        Encoding one CSV row into a JSON object, None if the row is skipped
+        '''
+
+        try:
+            return '{' + ','.join([
+                key + (JSON_NULL if value in NULL_VALUES else encode(value))
+                for key, encode, value in zip(self.keys, self.encoders, values)
+            ]) + '}'
+        except ValueError:
+            self.invalid_rows += 1
+            if self.policy == POLICY_SKIP_ROW:
+                self.skipped_rows += 1
+                return None
+            return '{' + ','.join([
+                key + self._encode_checked(column, encode, value)
+                for key, column, encode, value in zip(self.keys, self.columns, self.encoders, values)
+            ]) + '}'
+
+    def _encode_checked(self, column, encode, value):
+        if value in NULL_VALUES:
+            return JSON_NULL
+        try:
+            return encode(value)
+        except ValueError:
+            self.errors[column] += 1
+            return JSON_NULL if self.policy == POLICY_TRUNCATE else encode_string(value)
+
+    @property
+    def error_counts(self):
+        return {column: count for column, count in self.errors.items() if count}
+
+
+class RowBatch:
+    '''
+    JSON encoded rows with their position in the input file.
+    Rows first_row to end_row of the file were read for the batch, end_offset is the byte offset of end_row.
+    '''
+
+    def __init__(self, rows, first_row, end_row, end_offset, fingerprints=None, read_seconds=0, encode_seconds=0):
+        self.rows = rows
+        self.first_row = first_row
+        self.end_row = end_row
+        self.end_offset = end_offset
+        self.fingerprints = fingerprints or []
+        self.read_seconds = read_seconds
+        self.encode_seconds = encode_seconds
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def iter_counted_lines(file_in, position):
+    '''
+    Decoding binary lines while counting bytes read.
+    csv.reader pulls lines only up to the end of the current record, so the count is
+    the offset of the next record whenever a row is returned.
+    '''
+
+    for line in file_in:
+        position[0] += len(line)
+        yield line.decode('utf-8')
+
+
+def iter_row_batches(csv_path, row_encoder, planner, start_offset=0, start_row=0, delta=None, projection=None):
+    '''
+    Reading the table once and yielding batches of JSON encoded rows sized by the planner.
+    Header of the file is skipped, column names are taken from the manifest. Slices of a sliced table
+    are read one after another, offsets are offsets in the data of all slices.
+    Reading continues from start_offset, the byte offset of row start_row, if given.
+    Rows already pushed before are skipped if the delta filter is given.
+    Only the selected columns of the rows passing the filters are encoded if the projection is given.
+    '''
+
+    encode = row_encoder.encode
+    clock = time.perf_counter
+    batch = []
+    fingerprints = []
+    batch_size = planner.next_batch_size()
+    first_row = row_index = start_row
+    batch_started = clock()
+    encode_seconds = 0
+    position = [start_offset]
+    reader = csv.reader(iter_counted_lines(iter_table_lines(csv_path, start_offset), position))
+    if start_offset == 0 and has_header(csv_path):
+        next(reader, None)
+    for values in reader:
+        row_index += 1
+        if projection is not None:
+            values = projection.apply(values)
+            if values is None:
+                continue
+        if delta is not None:
+            digest = delta.new_row_fingerprint(values)
+            if digest is None:
+                continue
+            fingerprints.append(digest)
+        encode_started = clock()
+        row = encode(values)
+        encode_seconds += clock() - encode_started
+        if row is None:
+            if delta is not None:
+                fingerprints.pop()
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            read_seconds = clock() - batch_started - encode_seconds
+            yield RowBatch(batch, first_row, row_index, position[0], fingerprints, read_seconds, encode_seconds)
+            first_row = row_index
+            batch = []
+            fingerprints = []
+            batch_size = planner.next_batch_size()
+            batch_started = clock()
+            encode_seconds = 0
+
+    if batch:
+        read_seconds = clock() - batch_started - encode_seconds
+        yield RowBatch(batch, first_row, row_index, position[0], fingerprints, read_seconds, encode_seconds)
+
+
+def build_body(rows):
+    '''
+    Building POST rows request body out of JSON encoded rows
+    '''
+
+    return ('{"rows":[' + ','.join(rows) + ']}').encode('utf-8')
@@ -0,0 +1,118 @@
+'''
+Fingerprints of rows already pushed into the dataset, used for delta loads.
+
+'''
+
+import base64
+import hashlib
+
+
+DIGEST_SIZE = 8
+# Separator of the values in the fingerprinted string, not expected in the data
+VALUE_SEPARATOR = '\x1f'
+
+
+def fingerprint(values):
+    return hashlib.blake2b(VALUE_SEPARATOR.join(values).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class FingerprintIndex:
+    '''
+    Set of row fingerprints, serialized into the state as one base64 string of fixed size digests
+    '''
+
+    def __init__(self, digests=None):
+        self.digests = set(digests or [])
+
+    @classmethod
+    def from_state(cls, encoded):
+        data = base64.b64decode(encoded or '')
+        return cls(data[i:i + DIGEST_SIZE] for i in range(0, len(data), DIGEST_SIZE))
+
+    def to_state(self):
+        return base64.b64encode(b''.join(sorted(self.digests))).decode('ascii')
+
+    def update(self, digests):
+        self.digests.update(digests)
+
+    def __contains__(self, digest):
+        return digest in self.digests
+
+    def __len__(self):
+        return len(self.digests)
+
+
+class DeltaFilter:
+    '''
+    Selecting rows not pushed before, identified by the key columns or by the whole row
+    '''
+
+    def __init__(self, index, key_indexes=None):
+        self.index = index
+        self.key_indexes = key_indexes
+        self.seen = set()
+        self.skipped = 0
+
+    def new_row_fingerprint(self, values):
+        '''
+        Fingerprint of the row if it was not pushed before, None otherwise
+        '''
+
+        if self.key_indexes:
+            values = [values[i] for i in self.key_indexes]
+        return self.accept(fingerprint(values))
+
+    def accept(self, digest):
+        '''
+        Digest of a row fingerprinted elsewhere if the row was not pushed before, None otherwise
+        '''
+
+        if digest in self.index or digest in self.seen:
+            self.skipped += 1
+            return None
+        self.seen.add(digest)
+
+        return digest
+
+
+class FingerprintStore:
+    '''
+    Fingerprint indexes of the tables of one dataset kept in the component state.
+    Index of a table is dropped when the dataset or the columns identifying its rows change.
+    '''
+
+    def __init__(self, state, dataset_id):
+        state = state or {}
+        self.dataset_id = dataset_id
+        self.tables = dict(state.get("tables", {})) if state.get("dataset_id") == dataset_id else {}
+        self.indexes = {}
+
+    def delta_filter(self, table, columns, key_columns=None):
+        key = list(key_columns or columns)
+        saved = self.tables.get(table, {})
+        if saved.get("key") == key:
+            index = FingerprintIndex.from_state(saved.get("fingerprints"))
+        else:
+            index = FingerprintIndex()
+        self.indexes[table] = (key, index)
+        key_indexes = [columns.index(column) for column in key_columns] if key_columns else None
+
+        return DeltaFilter(index, key_indexes)
+
+    def forget(self, table):
+        '''
+        Dropping the saved index of a table whose rows are no longer in the dataset
+        '''
+
+        self.tables.pop(table, None)
+        self.indexes.pop(table, None)
+
+    def to_state(self):
+        tables = dict(self.tables)
+        for table, (key, index) in self.indexes.items():
+            tables[table] = {"key": key, "fingerprints": index.to_state()}
+
+        return {
+            "dataset_id": self.dataset_id,
+            "tables": tables
+        }
@@ -0,0 +1,124 @@
+'''
+Keeping the resident memory of the uploads under a configured ceiling.
+
+'''
+
+import logging
+import os
+import threading
+
+
+# Fractions of the ceiling at which the uploads are slowed down and sped up again
+HIGH_WATERMARK = 0.85
+LOW_WATERMARK = 0.6
+
+
+def current_rss():
+    '''
+    Resident set size of the process in bytes, None where /proc is not available
+    '''
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryGuard:
+    '''
+    Limits the number of batches held in memory at once.
+    Memory is checked after every batch, above the high watermark one less batch is allowed in flight
+    and the batch size of the table is halved, below the low watermark both are raised back step by step.
+    Shards parsed ahead by the worker processes take slots of a read-ahead budget of max_shards shared by all
+    uploads, lowered and raised back the same way.
+    '''
+
+    def __init__(self, max_rss_bytes=None, max_workers=1, max_shards=0):
+        self.max_rss_bytes = max_rss_bytes
+        self.max_workers = max_workers
+        self.allowed = max_workers
+        self.active = 0
+        self.max_shards = max_shards
+        self.allowed_shards = max_shards
+        self.shards = 0
+        self.peak_rss = 0
+        self.reductions = 0
+        self._condition = threading.Condition()
+        self.enabled = bool(max_rss_bytes)
+        if self.enabled and current_rss() is None:
+            logging.warning("Memory usage of the process cannot be measured, memory limit is not applied")
+            self.enabled = False
+
+    def acquire(self):
+        '''
+        Waiting for one batch to be read and held in memory until it is sent and released
+        '''
+
+        if not self.enabled:
+            return
+        with self._condition:
+            while self.active >= self.allowed:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, planner):
+        '''
+        Releasing a sent batch of the table planned by the planner
+        '''
+
+        if not self.enabled:
+            return
+        rss = current_rss() or 0
+        with self._condition:
+            self.active -= 1
+            self.peak_rss = max(self.peak_rss, rss)
+            if rss > self.max_rss_bytes * HIGH_WATERMARK:
+                self.reductions += 1
+                planner.shrink()
+                if self.allowed > 1:
+                    self.allowed -= 1
+                    logging.warning("Memory usage {0} MB is close to the limit of {1} MB, uploading {2} batches at "
+                                    "once".format(rss // 2 ** 20, self.max_rss_bytes // 2 ** 20, self.allowed))
+            elif rss < self.max_rss_bytes * LOW_WATERMARK:
+                planner.relax()
+                if self.allowed < self.max_workers:
+                    self.allowed += 1
+            self._condition.notify_all()
+
+    def acquire_shard(self):
+        '''
+        Taking a slot of the read-ahead budget for a shard parsed ahead, returns False without waiting
+        when the budget is used up
+        '''
+
+        with self._condition:
+            if self.shards >= self.allowed_shards:
+                return False
+            self.shards += 1
+            return True
+
+    def release_shard(self):
+        '''
+        Releasing the slot of a shard taken by its upload
+        '''
+
+        rss = (current_rss() or 0) if self.enabled else None
+        with self._condition:
+            self.shards -= 1
+            if rss is None:
+                return
+            self.peak_rss = max(self.peak_rss, rss)
+            if rss > self.max_rss_bytes * HIGH_WATERMARK:
+                if self.allowed_shards > 0:
+                    self.reductions += 1
+                    self.allowed_shards -= 1
+            elif rss < self.max_rss_bytes * LOW_WATERMARK and self.allowed_shards < self.max_shards:
+                self.allowed_shards += 1
+
+    def metrics(self):
+        return {
+            "max_rss_mb": self.max_rss_bytes // 2 ** 20 if self.max_rss_bytes else None,
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1),
+            "memory_reductions": self.reductions
+        }
@@ -0,0 +1,114 @@
+'''
+Performance metrics of the table uploads.
+
+'''
+
+import json
+import logging
+import math
+import time
+
+
+def percentile(values, pct):
+    '''
+    Nearest rank percentile of the values
+    '''
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TableMetrics:
+    '''
+    Time spent reading, encoding, sending and waiting for the rate limits while uploading one table
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.started = time.monotonic()
+        self.finished = None
+        self.rows_sent = 0
+        self.rows_rejected = 0
+        self.bytes_sent = 0
+        self.requests = 0
+        self.retries = 0
+        self.latencies = []
+        self.read_seconds = 0
+        self.encode_seconds = 0
+        self.throttled_seconds = 0
+        self.wait_seconds = 0
+
+    def record_batch(self, batch):
+        self.read_seconds += batch.read_seconds
+        self.encode_seconds += batch.encode_seconds
+
+    def record_encode(self, seconds):
+        self.encode_seconds += seconds
+
+    def record_request(self, latency, body_bytes, row_count):
+        self.requests += 1
+        self.latencies.append(round(latency, 3))
+        self.bytes_sent += body_bytes
+        self.rows_sent += row_count
+
+    def record_rejected(self, row_count):
+        self.rows_rejected += row_count
+
+    def record_wait(self, seconds):
+        self.wait_seconds += seconds
+
+    def record_retry(self):
+        self.retries += 1
+
+    def record_throttle(self, seconds):
+        self.throttled_seconds += seconds
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            "table": self.table,
+            "rows_sent": self.rows_sent,
+            "rows_rejected": self.rows_rejected,
+            "bytes_sent": self.bytes_sent,
+            "requests": self.requests,
+            "retries": self.retries,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_sent / elapsed, 1) if elapsed > 0 else None,
+            "read_seconds": round(self.read_seconds, 3),
+            "encode_seconds": round(self.encode_seconds, 3),
+            "send_seconds": round(sum(self.latencies), 3),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "batch_wait_seconds": round(self.wait_seconds, 3),
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p90": percentile(self.latencies, 90),
+            "latency_p99": percentile(self.latencies, 99)
+        }
+
+
+def log_summary(summary):
+    '''
+    Logging the summary as a structured record, the fields are sent as additional GELF fields
+    '''
+
+    logging.info("Table {0} upload metrics: {1}".format(summary["table"], json.dumps(summary)),
+                 extra={"upload_" + key: value for key, value in summary.items()})
+
+
+def write_report(path, tables, rate_limits, memory=None):
+    report = {
+        "tables": tables,
+        "rate_limits": rate_limits,
+        "memory": memory,
+        "rows_sent": sum(table["rows_sent"] for table in tables),
+        "rows_rejected": sum(table["rows_rejected"] for table in tables),
+        "bytes_sent": sum(table["bytes_sent"] for table in tables),
+        "requests": sum(table["requests"] for table in tables)
+    }
+    with open(path, 'w') as file_out:
+        json.dump(report, file_out, indent=2)
@@ -0,0 +1,128 @@
+'''
+Upload plan estimating requests, payload and duration of a run without sending any rows.
+
+'''
+
+import heapq
+import json
+import math
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder
+from rate_limiter import (MAX_REQUESTS_PER_HOUR_LARGE_TABLE, MAX_REQUESTS_PER_MINUTE, MAX_ROWS_PER_HOUR,
+                          SlidingWindow)
+from uploader import estimate_row_bytes
+
+
+# Assumed duration of a POST rows request, fixed latency plus transfer of the body
+REQUEST_LATENCY_SECONDS = 0.3
+UPLOAD_BYTES_PER_SECOND = 10 * 1024 * 1024
+BODY_OVERHEAD_BYTES = len('{"rows":[]}')
+
+
+def plan_table(name, scan, columns, column_types):
+    '''
+    Requests and payload of one table, batches are sized as by the uploader
+    '''
+
+    row_bytes = estimate_row_bytes(scan, RowEncoder(columns, column_types))
+    rows_per_request = ChunkPlanner(row_bytes).next_batch_size()
+    rows = scan.row_count if scan else 0
+    requests = math.ceil(rows / rows_per_request)
+    return {
+        "table": name,
+        "rows": rows,
+        "columns": len(columns),
+        "rows_per_request": rows_per_request,
+        "requests": requests,
+        "payload_bytes": int(rows * (row_bytes + 1)) + requests * BODY_OVERHEAD_BYTES
+    }
+
+
+def request_seconds(body_bytes):
+    return REQUEST_LATENCY_SECONDS + body_bytes / UPLOAD_BYTES_PER_SECOND
+
+
+def simulate_uploads(tables, max_workers, large_table_regime=False):
+    '''
+    Replaying the requests of the tables against the rate limits of the dataset on a virtual clock.
+    Up to max_workers tables are uploaded at once in the given order, as by the uploader.
+    Returns the time each table finishes and the seconds spent waiting for every limit.
+    '''
+
+    windows = [
+        ("requests_per_minute", SlidingWindow(MAX_REQUESTS_PER_MINUTE, 60), 1),
+        ("rows_per_hour", SlidingWindow(MAX_ROWS_PER_HOUR, 3600), None)
+    ]
+    if large_table_regime:
+        windows.append(("requests_per_hour", SlidingWindow(MAX_REQUESTS_PER_HOUR_LARGE_TABLE, 3600), 1))
+    waits = {name: 0 for name, _, _ in windows}
+    finished = [0] * len(tables)
+    queued = list(range(len(tables)))[::-1]
+    # (time the next request is ready, table index, requests sent)
+    ready = []
+    for _ in range(min(max_workers, len(tables))):
+        heapq.heappush(ready, (0, queued.pop(), 0))
+
+    while ready:
+        now, index, sent = heapq.heappop(ready)
+        table = tables[index]
+        if sent == table["requests"]:
+            finished[index] = now
+            if queued:
+                heapq.heappush(ready, (now, queued.pop(), 0))
+            continue
+        rows = min(table["rows_per_request"], table["rows"] - sent * table["rows_per_request"])
+        while True:
+            wait, limit = max((window.wait_time(amount or rows, now), name) for name, window, amount in windows)
+            if wait <= 1e-6:
+                break
+            waits[limit] += wait
+            now += wait
+        for _, window, amount in windows:
+            window.add(amount or rows, now)
+        body_bytes = table["payload_bytes"] * rows / table["rows"]
+        heapq.heappush(ready, (now + request_seconds(body_bytes), index, sent + 1))
+
+    return finished, waits
+
+
+def plan_dataset(dataset, tables, max_workers, large_table_regime=False):
+    '''
+    Plan of the upload into one dataset with the time spent waiting for each of the rate limits
+    '''
+
+    tables = [dict(table) for table in tables]
+    finished, waits = simulate_uploads(tables, max_workers, large_table_regime)
+    for table, seconds in zip(tables, finished):
+        table["estimated_seconds"] = round(seconds, 1)
+    estimated = max(finished, default=0)
+    return {
+        "dataset": dataset,
+        "large_table_regime": large_table_regime,
+        "tables": tables,
+        "rows": sum(table["rows"] for table in tables),
+        "requests": sum(table["requests"] for table in tables),
+        "payload_bytes": sum(table["payload_bytes"] for table in tables),
+        "estimated_seconds": round(estimated, 1),
+        "rate_limit_waits": {name: round(seconds, 1) for name, seconds in waits.items()},
+        "limited_by": max(waits, key=waits.get) if any(waits.values()) else None
+    }
+
+
+def write_plan(path, datasets, max_workers, notes=None):
+    '''
+    Writing the upload plan of all datasets as a JSON file
+    '''
+
+    with open(path, 'w') as file_out:
+        json.dump({
+            "dry_run": True,
+            "assumptions": {
+                "max_concurrent_uploads": max_workers,
+                "request_latency_seconds": REQUEST_LATENCY_SECONDS,
+                "upload_bytes_per_second": UPLOAD_BYTES_PER_SECOND,
+                "notes": notes or []
+            },
+            "datasets": datasets
+        }, file_out, indent=2)
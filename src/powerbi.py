@@ -3,26 +3,105 @@ import sys
 import os
 from pathlib import Path
 import json
-import csv
+import gzip
 import requests
 import backoff
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ReadTimeout, ConnectionError
 
+from dataset_cache import DatasetCache
+from aggregation import TableAggregation
+from projection import TableProjection
+
 
 # Default Table Output Destination
 DEFAULT_TABLE_SOURCE = os.path.join(Path(os.getcwd()).parent, "data/in/tables/")
 
+# Base URL of the REST API, can be pointed to a local stand-in of the API
+API_URL = os.getenv("POWERBI_API_URL", "https://api.powerbi.com/v1.0/myorg/")
+
+# (connect, read) timeout of API requests in seconds
+REQUEST_TIMEOUT = (10, 120)
+MAX_TRIES = 5
+# Server errors which are retried the same way as connection errors and timeouts
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+DEFAULT_POOL_SIZE = 4
+
 info_msg = "Push datasets are very limited in their functionality. " \
            "They're designed only for a near real-time streaming scenario to be consumed by a " \
            "streaming tile in a dashboard, and not by a Power BI report. Please consider using direct connection to " \
            "your database using Power BI Gateway."
 
 
+class PowerBIError(Exception):
+    pass
+
+
+class PayloadTooLargeError(PowerBIError):
+    '''
+    POST rows request was rejected as too large or timed out
+    '''
+    pass
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    '''
+    HTTP session keeping up to pool_size connections to the API alive
+    '''
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RowsRejectedError(PowerBIError):
+    '''
+    POST rows request was rejected with 400 because of the values of the rows sent
+    '''
+    pass
+
+
+class ServerError(PowerBIError):
+    '''
+    POST rows request failed with a server or connection error, the uploader retries it within the rate limits
+    '''
+    pass
+
+
+class ThrottledError(PowerBIError):
+    '''
+    POST rows request was rejected with 429, retry_after is the wait requested by the API in seconds
+    '''
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Failures which may pass when the upload is resumed by the next run
+TRANSIENT_ERRORS = (ThrottledError, ServerError, ReadTimeout, ConnectionError)
+
+
+def parse_retry_after(response):
+    try:
+        return max(0, int(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
 class PowerBI:
 
-    def __init__(self, oauth_token, workspace, dataset_type, dataset, input_tables, table_relationship):
+    def __init__(self, oauth_token, workspace, dataset_type, dataset, input_tables, table_relationship,
+                 session=None, compress=False, table_source=DEFAULT_TABLE_SOURCE, dataset_cache=None,
+                 token_manager=None, projections=None, aggregations=None, offline=False):
 
-        self.oauth_token = oauth_token
+        self._oauth_token = oauth_token
+        self.token_manager = token_manager
+        self.table_source = table_source
+        self.session = session or create_session()
+        self.compress = compress
         self.workspace = workspace
         if workspace != "":
             self.workspace_url = "groups/{0}/".format(workspace)
@@ -31,6 +110,8 @@ class PowerBI:
         self.dataset_type = dataset_type
         self.dataset = dataset
         self.input_tables = input_tables
+        self.projections = self.build_projections(projections or {})
+        self.aggregations = self.build_aggregations(aggregations or {})
         self.input_table_columns = self.fetch_table_columns()
         self.dataset_payload = {
             "name": dataset,
@@ -38,42 +119,69 @@ class PowerBI:
             "tables": self.construct_table_metadata(),
             "relationships": self.construct_relationship(table_relationship)
         }
+        self.dataset_cache = dataset_cache or DatasetCache(workspace=workspace)
         self.dataset_id = ''
-        self.dataset_found = self.search_datasetid()
+        # Offline clients only describe the dataset, the workspace is not searched
+        self.dataset_found = None if offline else self.search_datasetid()
 
-    @backoff.on_exception(backoff.expo, ReadTimeout, max_tries=5)
-    def get_request(self, url, header, params):
+    @property
+    def oauth_token(self):
+        return self.token_manager.token if self.token_manager else self._oauth_token
+
+    @backoff.on_predicate(backoff.expo, lambda response: response.status_code in RETRY_STATUS_CODES,
+                          max_tries=MAX_TRIES)
+    @backoff.on_exception(backoff.expo, (ReadTimeout, ConnectionError), max_tries=MAX_TRIES)
+    def request(self, method, url, header, payload=None, params=None):
         '''
-        Basic GET request
+        Sending a request, server errors, connection errors and timeouts are retried
         '''
 
-        response = requests.get(url=url, params=params, headers=header)
-
-        return response
+        return self.send_request(method, url, header, payload, params)
 
-    @backoff.on_exception(backoff.expo, (ReadTimeout, ConnectionError), max_tries=5)
-    def post_request(self, url, header, payload):
+    def send_request(self, method, url, header, payload=None, params=None):
         '''
-        Basic POST request
+        Sending a request once through the shared session, all verbs use the same timeout.
+        Payload is either an already encoded body or a JSON serializable object.
+        Requests rejected with 401 are sent once more with a refreshed token.
+        POST requests are not idempotent and are sent without the retries of request.
         '''
 
-        response = requests.post(
-            url=url, headers=header, data=json.dumps(payload))
+        header = dict(header)
+        if payload is not None and not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+        if payload is not None and self.compress:
+            payload = gzip.compress(payload, compresslevel=5)
+            header["Content-Encoding"] = "gzip"
+
+        # the token is read at send time, requests waiting for the rate limits use the refreshed token
+        authorized = self.token_manager is not None and "Authorization" in header
+        if authorized:
+            token = self.token_manager.token
+            header["Authorization"] = "Bearer {}".format(token)
+        response = self.session.request(method, url, params=params, headers=header, data=payload,
+                                        timeout=REQUEST_TIMEOUT)
+        if response.status_code == 401 and authorized:
+            logging.warning("Access token rejected, refreshing the token and retrying the request")
+            self.token_manager.refresh(expired_token=token)
+            header["Authorization"] = "Bearer {}".format(self.token_manager.token)
+            response = self.session.request(method, url, params=params, headers=header, data=payload,
+                                            timeout=REQUEST_TIMEOUT)
 
         return response
 
-    def search_datasetid(self):
+    def get_request(self, url, header, params):
         '''
-        Searching for dataset_id
+        Basic GET request
+        '''
+
+        return self.request("GET", url, header, params=params)
+
+    @staticmethod
+    def _check_dataset_response(response):
+        '''
+        Exiting on errors of the dataset lookup requests
         '''
 
-        url = "https://api.powerbi.com/v1.0/myorg/{}datasets".format(
-            self.workspace_url)
-        header = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer "+self.oauth_token
-        }
-        response = self.get_request(url, header, {})
         if response.status_code != 200:
             if response.status_code == 400:
                 logging.error(
@@ -88,51 +196,91 @@ class PowerBI:
                 )
             sys.exit(1)
 
-        response_json = response.json()
-        datasets = response_json["value"]
+    def list_datasets(self):
+        '''
+        Listing all datasets of the workspace
+        '''
+
+        url = API_URL + "{}datasets".format(
+            self.workspace_url)
+        header = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer "+self.oauth_token
+        }
+        response = self.get_request(url, header, {})
+        self._check_dataset_response(response)
         # logging.info("ALL DATASETS: {}".format(datasets))
 
-        dataset_found = False
-        dataset_id = ''
-        for dataset in datasets:
-            if self.dataset_type == 'Name':
-                if dataset["name"] == self.dataset and dataset_found:
-                    logging.error(
-                        "Duplicated dataset name found. Please enter different dataset name or specify the dataset ID.")
-                    sys.exit(1)
-                if dataset["name"] == self.dataset and not dataset_found:
-                    logging.info("Matching dataset found.")
-                    dataset_id = dataset["id"]
-                    dataset_found = True
-            if self.dataset_type == 'ID':
-                if dataset["id"] == self.dataset:
-                    dataset_id = dataset["id"]
-                    dataset_found = True
-
-        if self.dataset_type == 'ID' and not dataset_found:
-            logging.error(
-                "Input dataset ID is not found. Please verify input value.")
-            sys.exit(1)
+        return response.json()["value"]
+
+    def get_dataset(self, dataset_id):
+        '''
+        Fetching a single dataset, None if it does not exist
+        '''
+
+        url = API_URL + "{0}datasets/{1}".format(
+            self.workspace_url, dataset_id)
+        header = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer "+self.oauth_token
+        }
+        response = self.get_request(url, header, {})
+        if response.status_code == 404:
+            return None
+        self._check_dataset_response(response)
+
+        return response.json()
+
+    def search_datasetid(self):
+        '''
+        Searching for dataset_id.
+        Dataset ID is looked up directly, dataset name in the cached workspace listing. Cached ID is verified
+        with a single dataset request and the workspace is listed again if it is missing or the cache expired.
+        '''
+
+        if self.dataset_type == 'ID':
+            dataset = self.get_dataset(self.dataset)
+            if not dataset:
+                logging.error(
+                    "Input dataset ID is not found. Please verify input value.")
+                sys.exit(1)
+            self.dataset_cache.add(dataset)
+            dataset_ids = [dataset["id"]]
+        else:
+            dataset_ids = self.dataset_cache.ids_by_name(self.dataset) if self.dataset_cache.fresh else []
+            if len(dataset_ids) == 1 and not self.get_dataset(dataset_ids[0]):
+                self.dataset_cache.remove(dataset_ids[0])
+                dataset_ids = []
+            if len(dataset_ids) != 1:
+                self.dataset_cache.update(self.list_datasets())
+                dataset_ids = self.dataset_cache.ids_by_name(self.dataset)
+            if len(dataset_ids) > 1:
+                logging.error(
+                    "Duplicated dataset name found. Please enter different dataset name or specify the dataset ID.")
+                sys.exit(1)
+            if dataset_ids:
+                logging.info("Matching dataset found.")
 
-        self.dataset_id = dataset_id
-        if dataset_id != '':
-            logging.info("Dataset: {} - {}".format(self.dataset, dataset_id))
+        self.dataset_id = dataset_ids[0] if dataset_ids else ''
+        if self.dataset_id != '':
+            logging.info("Dataset: {} - {}".format(self.dataset, self.dataset_id))
 
-        return dataset_found
+        return self.dataset_id != ''
 
     def create_dataset(self):
         '''
         Creating new dataset
         '''
 
-        url = "https://api.powerbi.com/v1.0/myorg/{}datasets".format(
+        url = API_URL + "{}datasets".format(
             self.workspace_url)
         header = {
             "Content-Type": "application/json",
             "Authorization": "Bearer {}".format(self.oauth_token)
         }
 
-        response = self.post_request(url, header, self.dataset_payload)
+        # sent once, a retry after a server error could create a second dataset of the same name
+        response = self.send_request("POST", url, header, self.dataset_payload)
         if response.status_code != 201:
             logging.error(
                 "{0} - {1}".format(response.status_code, response.json()))
@@ -140,14 +288,16 @@ class PowerBI:
 
         dataset = response.json()
         self.dataset_id = dataset["id"]
+        self.dataset_found = True
+        self.dataset_cache.add({"id": dataset["id"], "name": self.dataset})
         logging.info(f"Dataset created: {self.dataset_id}")
 
-    def get_tables(self):
+    def get_table_definitions(self):
         '''
-        Fetching available tables in the datasets
+        Fetching tables of the dataset with their columns, columns are None when not returned by the API
         '''
 
-        url = "https://api.powerbi.com/v1.0/myorg/{0}datasets/{1}/tables".format(
+        url = API_URL + "{0}datasets/{1}/tables".format(
             self.workspace_url, self.dataset_id)
         header = {
             "Content-Type": "application/json",
@@ -155,34 +305,33 @@ class PowerBI:
         }
 
         response = self.get_request(url, header, {})
-        data = response.json()
-        # logging.info("GET_TABLES: {}".format(data))
-        all_tablenames = []
-        try:
-            for i in data["value"]:
-                all_tablenames.append(i["name"])
-        except Exception:
-            pass
+        # tables not listed would be pushed again and their rows not dropped, the run cannot continue without them
+        if response.status_code != 200:
+            logging.error("{0} - Tables of the dataset could not be listed - {1}".format(
+                response.status_code, response.text))
+            sys.exit(1)
+        tables = {}
+        for table in response.json().get("value", []):
+            tables[table["name"]] = table.get("columns")
 
-        return all_tablenames
+        return tables
 
     def put_table(self, tablename, payload):
         '''
-        Creating new table within the dataset
+        Creating new table within the dataset or updating the schema of an existing one
         '''
 
-        url = "https://api.powerbi.com/v1.0/myorg/{0}datasets/{1}/tables/{2}".format(
+        url = API_URL + "{0}datasets/{1}/tables/{2}".format(
             self.workspace_url, self.dataset_id, tablename)
         header = {
             "Content-Type": "application/json",
             "Authorization": "Bearer {}".format(self.oauth_token)
         }
 
-        response = requests.put(
-            url=url, headers=header, data=payload)
+        response = self.request("PUT", url, header, payload=payload)
 
         if response.status_code != 200:
-            logging.error("Table creation failed. Please contact support.")
+            logging.error("Table {0} creation failed. Please contact support.".format(tablename))
             sys.exit(1)
 
     def construct_relationship(self, config):
@@ -204,20 +353,108 @@ class PowerBI:
 
         return relationship
 
+    def build_projections(self, config):
+        '''
+        Selected columns and row filters of every input table, config maps table names to
+        {"columns": [(column, name in the dataset)], "filters": [(column, operator, value)]}
+        '''
+
+        projections = {}
+        for table in self.input_tables:
+            with open(self.table_source+table+'.manifest') as json_file:
+                manifest = json.load(json_file)
+            column_metadata = manifest.get("column_metadata", {})
+            column_types = {column: self._define_datatype(column_metadata.get(column, []))
+                            for column in manifest["columns"]}
+            table_config = config.get(manifest["name"], {})
+            try:
+                projections[manifest["name"]] = TableProjection(
+                    manifest["columns"], table_config.get("columns"), table_config.get("filters"), column_types)
+            except ValueError as e:
+                logging.error("Table {0}: {1}. Please check the column selection and row filters.".format(
+                    manifest["name"], e))
+                sys.exit(1)
+
+        unknown_tables = set(config) - set(projections)
+        if unknown_tables:
+            logging.error("Column selection or row filters configured for tables not in the input mapping: "
+                          "{0}".format(", ".join(sorted(unknown_tables))))
+            sys.exit(1)
+
+        return projections
+
+    def build_aggregations(self, config):
+        '''
+        Pre-aggregation of the input tables, config maps table names to
+        {"group_by": [column], "measures": [(column, function, name in the dataset)]}.
+        Columns are named as in the dataset, aggregation follows the column selection and row filters.
+        '''
+
+        aggregations = {}
+        for table in self.input_tables:
+            with open(self.table_source+table+'.manifest') as json_file:
+                manifest = json.load(json_file)
+            if manifest["name"] not in config:
+                continue
+            column_metadata = manifest.get("column_metadata", {})
+            projection = self.projections[manifest["name"]]
+            column_types = {name: self._define_datatype(column_metadata.get(column, []))
+                            for column, name in zip(projection.source_columns, projection.columns)}
+            table_config = config[manifest["name"]]
+            try:
+                aggregations[manifest["name"]] = TableAggregation(
+                    projection.columns, table_config.get("group_by", []), table_config.get("measures", []),
+                    column_types)
+            except ValueError as e:
+                logging.error("Table {0}: {1}. Please check the aggregation.".format(manifest["name"], e))
+                sys.exit(1)
+
+        unknown_tables = set(config) - set(aggregations)
+        if unknown_tables:
+            logging.error("Aggregation configured for tables not in the input mapping: {0}".format(
+                ", ".join(sorted(unknown_tables))))
+            sys.exit(1)
+
+        return aggregations
+
     def fetch_table_columns(self):
         '''
-        Fetching column headers from manifest
+        Fetching column headers from manifest, as named in the dataset
         '''
 
         table_columns = {}
 
         for table in self.input_tables:
-            with open(DEFAULT_TABLE_SOURCE+table+'.manifest') as json_file:
+            with open(self.table_source+table+'.manifest') as json_file:
                 manifest = json.load(json_file)
-                table_columns[manifest["name"]] = manifest["columns"]
+                aggregation = self.aggregations.get(manifest["name"])
+                if aggregation:
+                    table_columns[manifest["name"]] = aggregation.columns
+                else:
+                    table_columns[manifest["name"]] = self.projections[manifest["name"]].columns
 
         return table_columns
 
+    def fetch_table_primary_keys(self):
+        '''
+        Fetching primary key columns from manifest, as named in the dataset.
+        Primary key is not used if any of its columns is not selected, aggregated tables are keyed by their groups.
+        '''
+
+        primary_keys = {}
+
+        for table in self.input_tables:
+            with open(self.table_source+table+'.manifest') as json_file:
+                manifest = json.load(json_file)
+                if manifest["name"] in self.aggregations:
+                    primary_keys[manifest["name"]] = self.aggregations[manifest["name"]].group_by
+                    continue
+                projection = self.projections[manifest["name"]]
+                primary_key = [projection.rename(column) for column in manifest.get("primary_key", [])]
+                primary_keys[manifest["name"]] = primary_key if all(primary_key) else []
+
+        return primary_keys
+
     def _define_datatype(self, metadata_list):
         '''
         Defining input column datatype
@@ -251,7 +488,7 @@ class PowerBI:
 
         table_definition = []
         for table in self.input_tables:
-            with open(DEFAULT_TABLE_SOURCE+table+'.manifest') as json_file:
+            with open(self.table_source+table+'.manifest') as json_file:
                 manifest = json.load(json_file)
 
             table_def = {
@@ -260,6 +497,28 @@ class PowerBI:
             }
 
             column_metadata = manifest["column_metadata"]
+            aggregation = self.aggregations.get(manifest["name"])
+            if aggregation:
+                # aggregated tables hold the group columns and the measures
+                for name in aggregation.columns:
+                    table_def["columns"].append({
+                        "name": name,
+                        "dataType": aggregation.column_types[name]
+                    })
+                table_definition.append(table_def)
+                continue
+
+            projection = self.projections[manifest["name"]]
+            if projection.selected:
+                # only the selected columns are declared, named as in the dataset
+                for column, name in zip(projection.source_columns, projection.columns):
+                    table_def["columns"].append({
+                        "name": name,
+                        "dataType": self._define_datatype(column_metadata.get(column, []))
+                    })
+                table_definition.append(table_def)
+                continue
+
             for column in column_metadata:
                 column_def = {
                     "name": column,
@@ -270,51 +529,75 @@ class PowerBI:
             table_definition.append(table_def)
         return table_definition
 
-    def convert_csv_to_rows(self, table_name):
-        column_headers = self.input_table_columns[table_name]
-        with open(DEFAULT_TABLE_SOURCE+table_name+'.csv', 'r') as file_in:
-            reader = csv.DictReader(file_in, column_headers)
-            headers = next(reader, None)  # noqa
-            out = json.dumps([row for row in reader])
+    def get_projection(self, tablename):
+        '''
+        Column selection and row filters of the table, None if all rows and columns are sent
+        or if the table is aggregated, as the aggregation applies them while reading the input
+        '''
 
-        return out
+        projection = self.projections.get(tablename)
+        if projection is None or projection.identity or tablename in self.aggregations:
+            return None
+        return projection
 
-    def post_rows(self, tablename, rows):
+    def get_aggregation(self, tablename):
+        return self.aggregations.get(tablename)
+
+    def get_column_types(self, tablename):
         '''
-        Posting rows
+        Column data types of the table as declared in the dataset payload
         '''
 
-        url = f"https://api.powerbi.com/v1.0/myorg/{self.workspace_url}datasets/" \
-              f"{self.dataset_id}/tables/{tablename}/rows"
-        header = {"Authorization": f"Bearer {self.oauth_token}"}
-        payload = {"rows": json.loads(rows)}
+        for table_def in self.dataset_payload["tables"]:
+            if table_def["name"] == tablename:
+                return {column["name"]: column["dataType"] for column in table_def["columns"]}
 
-        try:
-            response = self.post_request(url, header, payload)
-        except ConnectionError:
-            logging.error("Connection error while posting rows, backoff strategy applied.")
-            sys.exit(1)
+        return {}
 
-        if not response.ok:
-            error_messages = [
-                "Failed to get response from Power BI API while sending rows to Power BI - "
-                "Please check API limits at: "
-                "https://learn.microsoft.com/en-us/power-bi/developer/embedded/push-datasets-limitations",
-                info_msg,
-                response.text
-            ]
+    def post_rows(self, tablename, body):
+        '''
+        Posting rows, body is the already encoded request body.
+        The request is sent once, a timed out request is treated as too large and the batch is split,
+        server and connection errors are retried by the uploader within the rate limits.
+        '''
 
-            error_message = '\n\n'.join(error_messages)
-            logging.error(error_message)
-            sys.exit(1)
+        url = f"{API_URL}{self.workspace_url}datasets/" \
+              f"{self.dataset_id}/tables/{tablename}/rows"
+        header = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.oauth_token}"
+        }
+
+        try:
+            response = self.send_request("POST", url, header, body)
+        except ReadTimeout:
+            raise PayloadTooLargeError(f"Request with {len(body)} bytes timed out")
+        except ConnectionError as e:
+            raise ServerError(f"Connection error while posting rows - {e}")
 
         if response.status_code == 200:
             return
 
+        if response.status_code in RETRY_STATUS_CODES:
+            raise ServerError(f"Request failed with {response.status_code} - {response.text}")
+
+        if response.status_code == 413:
+            raise PayloadTooLargeError(f"Request with {len(body)} bytes rejected as too large")
+
         if response.status_code == 429:
+            raise ThrottledError(f"Request throttled by Power BI - {response.text}", parse_retry_after(response))
+
+        if response.status_code == 400:
+            try:
+                error_text = response.json().get("error", {}).get("message") or response.text
+            except (ValueError, AttributeError):
+                error_text = response.text
+            raise RowsRejectedError(f"Rows rejected by Power BI - {error_text}")
+
+        if not response.ok:
             error_messages = [
-                "An error occurred while sending rows to Power BI. Please check the limitations of the "
-                "Push Datasets API at:"
+                "Failed to get response from Power BI API while sending rows to Power BI - "
+                "Please check API limits at: "
                 "https://learn.microsoft.com/en-us/power-bi/developer/embedded/push-datasets-limitations",
                 info_msg,
                 response.text
@@ -343,12 +626,14 @@ class PowerBI:
         '''
 
         logging.info("Dropping rows in table: {}".format(tablename))
-        url = "https://api.powerbi.com/v1.0/myorg/{0}datasets/{1}/tables/{2}/rows".format(
+        url = API_URL + "{0}datasets/{1}/tables/{2}/rows".format(
             self.workspace_url, self.dataset_id, tablename)
         header = {
             "Authorization": "Bearer {}".format(self.oauth_token)
         }
-        response = requests.delete(url, headers=header)
+        response = self.request("DELETE", url, header)
+        if response.status_code == 429:
+            raise ThrottledError(f"Request throttled by Power BI - {response.text}", parse_retry_after(response))
         if response.status_code != 200:
             logging.error(f"Cannot drop rows in table: {tablename}, reason: {response.text} Please check the "
                           f"limitations of push datasets API at: "
@@ -362,12 +647,14 @@ class PowerBI:
         '''
 
         logging.info("Dropping datasets: {}".format(self.dataset_id))
-        url = "https://api.powerbi.com/v1.0/myorg/{0}datasets/{1}".format(
+        url = API_URL + "{0}datasets/{1}".format(
             self.workspace_url, self.dataset_id)
         header = {
             "Authorization": "Bearer {}".format(self.oauth_token)
         }
-        response = requests.delete(url, headers=header)
+        response = self.request("DELETE", url, header)
         if response.status_code != 200:
             logging.error(
                 "{} - {}".format(response.status_code, response.json()))
+        else:
+            self.dataset_cache.remove(self.dataset_id)
@@ -0,0 +1,98 @@
+'''
+Reading and encoding the next batches of a table while the current request is sent.
+
+'''
+
+import queue
+import threading
+
+
+# Batches of a table read and encoded ahead of the request in flight, 1 keeps the next request body ready
+DEFAULT_PREFETCH_DEPTH = 1
+# Seconds between checks whether the consumer stopped while the queue of prepared batches is full
+POLL_SECONDS = 0.5
+
+_END = object()
+
+
+class Prefetcher:
+    '''
+    Batches of one table prepared up to depth batches ahead by a background thread, depth 0 prepares
+    every batch when it is requested. Yields (batch, prepared) pairs, every batch holds a memory guard slot
+    from reading until the consumer releases it after the send.
+    Errors of reading are raised by the consumer in the order of the batches.
+    '''
+
+    def __init__(self, batches, prepare, planner, memory_guard, depth=DEFAULT_PREFETCH_DEPTH):
+        self.batches = batches
+        self.prepare = prepare
+        self.planner = planner
+        self.memory_guard = memory_guard
+        self._queue = queue.Queue(maxsize=depth)
+        self._closed = threading.Event()
+        self._thread = None
+        if depth > 0:
+            self._thread = threading.Thread(target=self._produce, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def _read(self):
+        self.memory_guard.acquire()
+        try:
+            batch = next(self.batches, None)
+            if batch is None:
+                self.memory_guard.release(self.planner)
+                return _END
+            return batch, self.prepare(batch)
+        except BaseException as e:
+            self.memory_guard.release(self.planner)
+            return e
+
+    def _produce(self):
+        while not self._closed.is_set():
+            item = self._read()
+            if not self._put(item):
+                if isinstance(item, tuple):
+                    self.memory_guard.release(self.planner)
+                return
+            if not isinstance(item, tuple):
+                return
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self._queue.get() if self._thread else self._read()
+        if item is _END:
+            raise StopIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _drain(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                self.memory_guard.release(self.planner)
+
+    def close(self):
+        '''
+        Stopping the background thread and releasing the slots of the batches not consumed
+        '''
+
+        self._closed.set()
+        if self._thread:
+            self._drain()
+            self._thread.join()
+            self._drain()
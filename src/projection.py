@@ -0,0 +1,127 @@
+'''
+Column selection, renames and row filters applied to the input tables before encoding.
+
+'''
+
+import math
+import operator
+from datetime import datetime, timedelta, timezone
+
+from encoder import NULL_VALUES, parse_iso_datetime
+
+
+# Filter operators of the configuration, plain functions keep projections picklable for the parser processes
+OPERATORS = {
+    "equals": operator.eq,
+    "not_equals": operator.ne,
+    "greater_than": operator.gt,
+    "greater_or_equal": operator.ge,
+    "less_than": operator.lt,
+    "less_or_equal": operator.le,
+    "within_last_days": operator.ge
+}
+
+
+def parse_number(value):
+    number = float(value)
+    if math.isnan(number):
+        raise ValueError(f"Not a number: {value}")
+    return number
+
+
+def parse_datetime(value):
+    '''
+    Parsing ISO-8601 datetime, timezone aware values are compared in UTC
+    '''
+
+    parsed = parse_iso_datetime(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+PARSERS = {
+    "Int64": parse_number,
+    "Decimal": parse_number,
+    "DateTime": parse_datetime
+}
+
+
+class RowFilter:
+    '''
+    Comparison of one column with a configured value, values are compared typed by the column data type.
+    Null values and values which cannot be parsed never match.
+    '''
+
+    def __init__(self, column, index, operator, value, data_type=None):
+        if operator not in OPERATORS:
+            raise ValueError("Filter operator {0} is not supported, use one of {1}".format(
+                operator, ", ".join(OPERATORS)))
+        self.column = column
+        self.index = index
+        self.compare = OPERATORS[operator]
+        self.parse = PARSERS.get(data_type, str)
+        if operator == "within_last_days":
+            self.parse = parse_datetime
+            self.bound = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=float(value))
+        else:
+            self.bound = self.parse(str(value))
+
+    def __call__(self, values):
+        value = values[self.index] if self.index < len(values) else ''
+        if value in NULL_VALUES:
+            return False
+        try:
+            return self.compare(self.parse(value), self.bound)
+        except ValueError:
+            return False
+
+
+class TableProjection:
+    '''
+    Selected columns of a table with their names in the dataset and the row filters.
+    All columns are kept when no columns are selected, all filters have to match for a row to be sent.
+    '''
+
+    def __init__(self, columns, selection=None, filters=None, column_types=None):
+        '''
+        columns are the columns of the input table, selection is a list of (column, name in the dataset)
+        and filters a list of (column, operator, value)
+        '''
+
+        column_types = column_types or {}
+        self.selected = bool(selection)
+        selection = selection or [(column, None) for column in columns]
+        for column in [column for column, _ in selection] + [column for column, _, _ in filters or []]:
+            if column not in columns:
+                raise ValueError("Column {0} is not found in the input table".format(column))
+        self.source_columns = [column for column, _ in selection]
+        self.columns = [rename or column for column, rename in selection]
+        if len(set(self.columns)) != len(self.columns):
+            raise ValueError("Column names {0} are not unique".format(self.columns))
+        self.indexes = [columns.index(column) for column in self.source_columns]
+        self.filters = [RowFilter(column, columns.index(column), operator, value, column_types.get(column))
+                        for column, operator, value in filters or []]
+        self.identity = self.indexes == list(range(len(columns))) and not self.filters
+
+    def rename(self, column):
+        '''
+        Name of the input column in the dataset, None if the column is not selected
+        '''
+
+        if column not in self.source_columns:
+            return None
+        return self.columns[self.source_columns.index(column)]
+
+    def apply(self, values):
+        '''
+        Selected values of the row, None if the row is filtered out
+        '''
+
+        for row_filter in self.filters:
+            if not row_filter(values):
+                return None
+        if self.identity:
+            return values
+        width = len(values)
+        return [values[i] if i < width else '' for i in self.indexes]
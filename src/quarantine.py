@@ -0,0 +1,52 @@
+'''
+Rows rejected by Power BI, written to an output table instead of failing the upload.
+
+'''
+
+import csv
+import json
+import threading
+from datetime import datetime
+
+
+QUARANTINE_COLUMNS = ["dataset", "table", "row", "error", "rejected_at"]
+
+
+class Quarantine:
+    '''
+    Output table of the rejected rows shared by the uploads of all datasets, rows are kept as the JSON sent.
+    The table is created with the first rejected row and loaded incrementally.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.row_count = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+
+    def add(self, dataset, table, rows, errors):
+        rejected_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._file, lineterminator='\n')
+                self._writer.writerow(QUARANTINE_COLUMNS)
+            for row, error in zip(rows, errors):
+                self._writer.writerow([dataset, table, row, error, rejected_at])
+            # rows written so far are kept when the job fails later
+            self._file.flush()
+            self.row_count += len(rows)
+
+    def close(self):
+        '''
+        Closing the table and writing its manifest, nothing is written without rejected rows
+        '''
+
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            with open(self.path + '.manifest', 'w') as file_out:
+                json.dump({"incremental": True}, file_out)
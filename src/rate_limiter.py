@@ -0,0 +1,128 @@
+'''
+Rate limiting of POST rows requests against the push dataset API limits.
+
+'''
+
+import threading
+import time
+from collections import deque
+
+
+# Push dataset limits, see README
+MAX_REQUESTS_PER_MINUTE = 120
+MAX_ROWS_PER_HOUR = 1_000_000
+MAX_ROWS_PER_REQUEST = 10_000
+# Tables with this many rows are limited to 120 POST rows requests per hour
+LARGE_TABLE_ROW_COUNT = 250_000
+MAX_REQUESTS_PER_HOUR_LARGE_TABLE = 120
+
+# Wait applied on 429 responses without the Retry-After header
+DEFAULT_RETRY_AFTER = 60
+
+
+class SlidingWindow:
+    '''
+    Amounts consumed within the last period seconds
+    '''
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.events = deque()
+        self.total = 0
+
+    def _expire(self, now):
+        while self.events and self.events[0][0] <= now - self.period:
+            self.total -= self.events.popleft()[1]
+
+    def wait_time(self, amount, now):
+        '''
+        Seconds until the amount fits into the window
+        '''
+
+        self._expire(now)
+        excess = self.total + min(amount, self.limit) - self.limit
+        if excess <= 0:
+            return 0
+        expired = 0
+        for timestamp, consumed in self.events:
+            expired += consumed
+            if expired >= excess:
+                return timestamp + self.period - now
+        return self.period
+
+    def add(self, amount, now):
+        self.events.append((now, amount))
+        self.total += amount
+
+
+class RateGovernor:
+    '''
+    Rate limiter shared by all uploads into one dataset.
+    Tracks the per minute and per hour limits in sliding windows, honours Retry-After of
+    throttled requests and counts the time spent waiting.
+    '''
+
+    def __init__(self, requests_per_minute=MAX_REQUESTS_PER_MINUTE, rows_per_hour=MAX_ROWS_PER_HOUR):
+        self._lock = threading.Lock()
+        self.windows = [
+            (SlidingWindow(requests_per_minute, 60), 1),
+            (SlidingWindow(rows_per_hour, 3600), None)
+        ]
+        self.large_table_regime = False
+        self.blocked_until = 0
+        self.throttle_waits = 0
+        self.throttled_seconds = 0
+        self.throttled_requests = 0
+
+    def enable_large_table_regime(self):
+        '''
+        Switching to the limit of 120 POST rows requests per hour
+        '''
+
+        with self._lock:
+            if not self.large_table_regime:
+                self.large_table_regime = True
+                self.windows.append((SlidingWindow(MAX_REQUESTS_PER_HOUR_LARGE_TABLE, 3600), 1))
+
+    def acquire(self, row_count):
+        '''
+        Blocks until a POST rows request with row_count rows can be sent.
+        Returns the number of seconds spent waiting.
+        '''
+
+        start = time.monotonic()
+        slept = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait_sec = max([self.blocked_until - now] + [
+                    window.wait_time(amount or row_count, now) for window, amount in self.windows])
+                if wait_sec <= 1e-6:
+                    for window, amount in self.windows:
+                        window.add(amount or row_count, now)
+                    if not slept:
+                        return 0
+                    waited = now - start
+                    self.throttle_waits += 1
+                    self.throttled_seconds += waited
+                    return waited
+            time.sleep(wait_sec)
+            slept = True
+
+    def throttled(self, retry_after=None):
+        '''
+        Blocking all requests after the API responded with 429
+        '''
+
+        with self._lock:
+            self.throttled_requests += 1
+            retry_after = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def metrics(self):
+        return {
+            "throttle_waits": self.throttle_waits,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "throttled_requests": self.throttled_requests
+        }
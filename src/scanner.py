@@ -0,0 +1,97 @@
+'''
+Single pass scan of the input tables.
+
+'''
+
+import csv
+
+from encoder import ENCODERS, NULL_VALUES, iter_counted_lines
+from table_files import has_header, iter_table_lines
+from validation import MAX_STRING_LENGTH
+
+
+class TableScan:
+    '''
+    Statistics of one input table gathered while reading it once
+    '''
+
+    def __init__(self, path, columns, row_count, byte_size, oversize_counts=None, invalid_counts=None,
+                 invalid_rows=0, input_rows=None):
+        self.path = path
+        self.columns = columns
+        self.row_count = row_count
+        self.byte_size = byte_size
+        self.oversize_counts = dict(zip(columns, oversize_counts or [0] * len(columns)))
+        self.invalid_counts = dict(zip(columns, invalid_counts or [0] * len(columns)))
+        self.invalid_rows = invalid_rows
+        # rows of the file including the rows filtered out
+        self.input_rows = row_count if input_rows is None else input_rows
+
+    @property
+    def avg_row_bytes(self):
+        if self.row_count == 0:
+            return 0
+        return self.byte_size / self.row_count
+
+
+def _is_invalid(encode, value):
+    if value in NULL_VALUES:
+        return False
+    try:
+        encode(value)
+    except ValueError:
+        return True
+    return False
+
+
+def scan_table(csv_path, column_types=None, projection=None, columns=None):
+    '''
+    Counting rows and the size of the CSV file.
+    With column_types given, string values over the length limit and values of typed columns not
+    matching their data type are counted. With projection given, statistics cover the selected columns
+    of the rows passing the filters. Columns of sliced tables, which have no header, are to be given.
+    Byte size is the size of the data of all slices, decompressed.
+    '''
+
+    row_count = 0
+    input_rows = 0
+    invalid_rows = 0
+    position = [0]
+    reader = csv.reader(iter_counted_lines(iter_table_lines(csv_path), position))
+    header = next(reader, []) if has_header(csv_path) else []
+    columns = projection.columns if projection is not None else (columns or header)
+    width = len(columns)
+    oversize_counts = [0] * width
+    invalid_counts = [0] * width
+    if column_types is not None:
+        string_columns = [column_types.get(column, "String") == "String" for column in columns]
+        typed_columns = [(i, ENCODERS[column_types[column]]) for i, column in enumerate(columns)
+                         if column_types.get(column, "String") != "String" and column_types[column] in ENCODERS]
+    for values in reader:
+        input_rows += 1
+        if projection is not None:
+            values = projection.apply(values)
+            if values is None:
+                continue
+        row_count += 1
+        if column_types is None:
+            continue
+        if len(values) != width:
+            values = (values + [''] * width)[:width]
+        invalid = False
+        if max(map(len, values), default=0) > MAX_STRING_LENGTH:
+            for i, value in enumerate(values):
+                if len(value) > MAX_STRING_LENGTH and string_columns[i]:
+                    oversize_counts[i] += 1
+                    invalid = True
+        try:
+            [encode(values[i]) for i, encode in typed_columns if values[i] not in NULL_VALUES]
+        except ValueError:
+            for i, encode in typed_columns:
+                if _is_invalid(encode, values[i]):
+                    invalid_counts[i] += 1
+                    invalid = True
+        invalid_rows += invalid
+
+    return TableScan(csv_path, columns, row_count, position[0], oversize_counts, invalid_counts, invalid_rows,
+                     input_rows)
@@ -0,0 +1,31 @@
+'''
+Reconciliation of the table schemas of an existing dataset with the input tables.
+
+'''
+
+
+def normalize_columns(columns):
+    return [[column["name"], column.get("dataType", "String")] for column in columns or []]
+
+
+def diff_tables(expected_tables, existing_tables, recorded_schemas=None):
+    '''
+    Comparing the table definitions built from the manifests with the tables in the dataset.
+    existing_tables maps table names to their columns as returned by the API, or None when the API
+    does not return them, recorded_schemas holds the columns pushed by previous runs.
+    Returns the tables to be created and the tables to be updated.
+    '''
+
+    recorded_schemas = recorded_schemas or {}
+    missing = []
+    changed = []
+    for table in expected_tables:
+        name = table["name"]
+        if name not in existing_tables:
+            missing.append(table)
+            continue
+        known_columns = existing_tables[name] or recorded_schemas.get(name)
+        if known_columns is None or normalize_columns(known_columns) != normalize_columns(table["columns"]):
+            changed.append(table)
+
+    return missing, changed
@@ -0,0 +1,403 @@
+'''
+Parsing and encoding of large input tables in parallel worker processes.
+
+'''
+
+import csv
+import io
+import multiprocessing
+import os
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+
+from encoder import RowBatch, RowEncoder, iter_counted_lines
+from fingerprint import fingerprint
+from table_files import READ_BUFFER_SIZE, locate, table_parts
+
+
+# Size of the part of the file parsed by one worker at a time
+SHARD_BYTES = 4 * 1024 * 1024
+# Smaller tables are parsed in the upload thread, starting the workers would not pay off
+MIN_SHARDED_BYTES = 32 * 1024 * 1024
+# Shards parsed ahead per worker process, the read-ahead budget shared by the uploads of all tables
+SHARDS_PER_PROCESS = 2
+
+
+def default_processes():
+    '''
+    Number of CPU cores available to the process
+    '''
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class ParserPool:
+    '''
+    Worker processes shared by the uploads of all tables.
+    Workers are spawned, forking a process running upload threads could copy locks held by them.
+    '''
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, *args):
+        return self.executor.submit(*args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def iter_row_boundaries(blocks, start_offset, shard_bytes, header=False):
+    '''
+    Offsets of the row boundaries the first rows after every shard_bytes of the blocks read from start_offset end at.
+    Line breaks inside quoted values are told apart by the parity of the quotes read so far,
+    with header the first boundary is the end of the header.
+    '''
+
+    target = start_offset if header else start_offset + shard_bytes
+    quoted = False
+    position = start_offset
+    for block in blocks:
+        i = 0
+        while True:
+            if position + len(block) <= target:
+                quoted ^= block.count(b'"', i) & 1
+                break
+            if position + i < target:
+                quoted ^= block.count(b'"', i, target - position) & 1
+                i = target - position
+            end = block.find(b'\n', i)
+            if end < 0:
+                quoted ^= block.count(b'"', i) & 1
+                break
+            quoted ^= block.count(b'"', i, end) & 1
+            i = end + 1
+            if not quoted:
+                yield position + i
+                target = position + i + shard_bytes
+        position += len(block)
+
+
+def split_part(path, start_offset=0, shard_bytes=SHARD_BYTES, header=False):
+    '''
+    Splitting the plain file from start_offset into byte ranges of about shard_bytes ending on row boundaries,
+    the header is not part of any range.
+    '''
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file_in:
+        file_in.seek(start_offset)
+        blocks = iter(lambda: file_in.read(READ_BUFFER_SIZE), b'')
+        boundaries = list(iter_row_boundaries(blocks, start_offset, shard_bytes, header))
+    if not header:
+        boundaries.insert(0, start_offset)
+
+    if not boundaries or boundaries[-1] < size:
+        boundaries.append(size)
+
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def iter_compressed_shards(part, start_offset=0, shard_bytes=SHARD_BYTES, header=False):
+    '''
+    Decompressing the gzipped part from start_offset and cutting the data into chunks of about shard_bytes
+    ending on row boundaries, gzipped files cannot be read from the middle by the workers.
+    Yields (data, start, end), only one chunk is held at a time, the header is not part of any chunk.
+    '''
+
+    data = bytearray()
+    data_start = start_offset
+
+    with part.open() as file_in:
+        if start_offset:
+            file_in.seek(start_offset)
+
+        def blocks():
+            for block in iter(lambda: file_in.read(READ_BUFFER_SIZE), b''):
+                data.extend(block)
+                yield block
+
+        for boundary in iter_row_boundaries(blocks(), start_offset, shard_bytes, header):
+            chunk = bytes(data[:boundary - data_start])
+            del data[:boundary - data_start]
+            if header:
+                header = False
+            else:
+                yield chunk, data_start, boundary
+            data_start = boundary
+
+    if data and not header:
+        yield bytes(data), data_start, data_start + len(data)
+
+
+def find_shards(csv_path, start_offset=0, shard_bytes=SHARD_BYTES):
+    '''
+    Splitting the table from start_offset into shards parsed by the workers, plain files are split
+    into ranges of about shard_bytes, gzipped files are decompressed here into chunks of about shard_bytes
+    passed to the workers with the shards.
+    Returns the offset of the first part read within the data of all parts and an iterator of the shards
+    as (part index, path or chunk of data, start, end) with offsets within the part, headers are left out.
+    '''
+
+    parts = table_parts(csv_path)
+    index, base = locate(parts, start_offset)
+
+    def shards(offset):
+        for part_index in range(index, len(parts)):
+            part = parts[part_index]
+            header = part.header and offset == 0
+            if part.compressed:
+                for data, start, end in iter_compressed_shards(part, offset, shard_bytes, header):
+                    yield part_index, data, start, end
+            else:
+                for start, end in split_part(part.path, offset, shard_bytes, header):
+                    yield part_index, part.path, start, end
+            offset = 0
+
+    return base, shards(start_offset - base)
+
+
+class EncodedShard:
+    '''
+    JSON encoded rows of one shard, for every row its index within the shard and the offset of the next row
+    within the part, end is the offset the shard ends at.
+    Invalid values are counted per row, so that rows dropped by the delta filter are not counted.
+    Row index of the shard start and offset of its part within the table are set once the shards are read in order.
+    '''
+
+    def __init__(self, rows, row_ends, offsets, digests, input_rows, row_errors, skipped_digests, encode_seconds,
+                 end):
+        self.rows = rows
+        self.row_ends = row_ends
+        self.offsets = offsets
+        self.digests = digests
+        self.input_rows = input_rows
+        self.row_errors = row_errors
+        self.skipped_digests = skipped_digests
+        self.encode_seconds = encode_seconds
+        self.end = end
+        self.row_base = 0
+        self.offset_base = 0
+
+
+def encode_shard(source, start, end, columns, column_types=None, policy=None, projection=None,
+                 fingerprint_rows=False, key_indexes=None):
+    '''
+    Parsing and encoding the rows of the part between the offsets, runs in a worker process.
+    The source is the path of a plain part or the data of the part between the offsets.
+    '''
+
+    started = time.perf_counter()
+    row_encoder = RowEncoder(columns, column_types, policy)
+    encode = row_encoder.encode
+    errors = row_encoder.errors
+    counted_errors = dict(errors)
+    invalid_rows = 0
+    rows = []
+    row_ends = array('q')
+    offsets = array('q')
+    digests = [] if fingerprint_rows else None
+    # invalid values of the sent rows by position and fingerprints of the skipped rows
+    row_errors = {}
+    skipped_digests = []
+    if isinstance(source, bytes):
+        data = source
+    else:
+        with open(source, 'rb') as file_in:
+            file_in.seek(start)
+            data = file_in.read(end - start)
+    position = [start]
+    row_index = 0
+    reader = csv.reader(iter_counted_lines(io.BytesIO(data), position))
+    for values in reader:
+        row_index += 1
+        if projection is not None:
+            values = projection.apply(values)
+            if values is None:
+                continue
+        row = encode(values)
+        digest = None
+        if digests is not None:
+            digest = fingerprint([values[i] for i in key_indexes] if key_indexes else values)
+        if row_encoder.invalid_rows != invalid_rows:
+            invalid_rows = row_encoder.invalid_rows
+            if row is None:
+                skipped_digests.append(digest)
+                continue
+            row_errors[len(rows)] = {column: count - counted_errors[column]
+                                     for column, count in errors.items() if count != counted_errors[column]}
+            counted_errors = dict(errors)
+        if digest is not None:
+            digests.append(digest)
+        rows.append(row)
+        row_ends.append(row_index)
+        offsets.append(position[0])
+
+    return EncodedShard(rows, row_ends, offsets, digests, row_index, row_errors, skipped_digests,
+                        time.perf_counter() - started, start + len(data))
+
+
+def shard_encoding(row_encoder, projection=None, delta=None):
+    '''
+    Arguments of encode_shard following the shard
+    '''
+
+    return (row_encoder.columns, row_encoder.column_types, row_encoder.policy, projection,
+            delta is not None, delta.key_indexes if delta is not None else None)
+
+
+def iter_encoded_shards(pool, csv_path, encoding, start_offset=0, start_row=0, shard_bytes=SHARD_BYTES,
+                        memory_guard=None):
+    '''
+    Encoded shards of the table from start_offset in order, parsed by the pool or in this thread without it.
+    One shard of the table is always parsed, up to a few shards per process are parsed ahead within the
+    read-ahead budget of the memory guard if given. row_base and offset_base of every shard are set.
+    '''
+
+    part_base, shards = find_shards(csv_path, start_offset, shard_bytes)
+    part_index = None
+    part_end = 0
+    row_base = start_row
+    pending = deque()
+
+    def submit():
+        while len(pending) < SHARDS_PER_PROCESS * pool.processes:
+            # the first shard needs no slot, so that every table makes progress while others use the budget
+            budgeted = memory_guard is not None and bool(pending)
+            if budgeted and not memory_guard.acquire_shard():
+                return
+            shard = next(shards, None)
+            if shard is None:
+                if budgeted:
+                    memory_guard.release_shard()
+                return
+            pending.append((shard[0], pool.submit(encode_shard, *shard[1:], *encoding), budgeted))
+
+    def results():
+        if pool is None:
+            for shard in shards:
+                yield shard[0], encode_shard(*shard[1:], *encoding)
+            return
+        submit()
+        while pending:
+            shard_part, future, budgeted = pending.popleft()
+            shard = future.result()
+            if budgeted:
+                memory_guard.release_shard()
+            submit()
+            yield shard_part, shard
+
+    try:
+        for shard_part, shard in results():
+            # shards are read in order, a part starts where the previous one ended
+            if shard_part != part_index:
+                part_base += part_end
+                part_index = shard_part
+            part_end = shard.end
+            shard.row_base = row_base
+            shard.offset_base = part_base
+            row_base += shard.input_rows
+            yield shard
+    finally:
+        for _, future, budgeted in pending:
+            future.cancel()
+            if budgeted:
+                memory_guard.release_shard()
+        shards.close()
+
+
+def iter_shard_batches(shards, row_encoder, planner, start_row=0, delta=None):
+    '''
+    Cutting the rows of the encoded shards into batches sized by the planner, time spent waiting
+    for the next shard is counted as reading.
+    Rows already pushed before are skipped by the fingerprints of the shards.
+    '''
+
+    # parsed rows not sent yet: rows, row indexes, offsets within the part, fingerprints,
+    # row index of the shard start, offset of the part start and the next row to be sent
+    segments = deque()
+    buffered = 0
+    first_row = end_row = start_row
+    end_offset = None
+    read_seconds = encode_seconds = 0
+    clock = time.perf_counter
+
+    def cut(size, read_seconds, encode_seconds):
+        rows = []
+        fingerprints = []
+        while len(rows) < size and segments:
+            segment = segments[0]
+            rows_in, row_ends, offsets, digests, base, offset_base, index = segment
+            taken = min(size - len(rows), len(rows_in) - index)
+            rows.extend(rows_in[index:index + taken])
+            if digests is not None:
+                fingerprints.extend(digests[index:index + taken])
+            segment[6] = index + taken
+            last = (base + row_ends[index + taken - 1], offset_base + offsets[index + taken - 1])
+            if segment[6] == len(rows_in):
+                segments.popleft()
+        return RowBatch(rows, first_row, last[0], last[1], fingerprints, read_seconds, encode_seconds)
+
+    shards = iter(shards)
+    while True:
+        waiting_started = clock()
+        shard = next(shards, None)
+        read_seconds += clock() - waiting_started
+        if shard is None:
+            break
+        end_row = shard.row_base + shard.input_rows
+        end_offset = shard.offset_base + shard.end
+        encode_seconds += shard.encode_seconds
+        rows, row_ends, offsets, digests = shard.rows, shard.row_ends, shard.offsets, shard.digests
+        kept = None
+        if delta is not None:
+            kept = [delta.accept(digest) is not None for digest in digests]
+            rows, row_ends, offsets, digests = [list(compress(items, kept))
+                                                for items in (rows, row_ends, offsets, digests)]
+            skipped_digests = [digest for digest in shard.skipped_digests if delta.accept(digest) is not None]
+        else:
+            skipped_digests = shard.skipped_digests
+        row_encoder.skipped_rows += len(skipped_digests)
+        for position, counts in shard.row_errors.items():
+            if kept is None or kept[position]:
+                for column, count in counts.items():
+                    row_encoder.errors[column] += count
+        if rows:
+            segments.append([rows, row_ends, offsets, digests, shard.row_base, shard.offset_base, 0])
+            buffered += len(rows)
+        batch_size = planner.next_batch_size()
+        while buffered >= batch_size:
+            batch = cut(batch_size, read_seconds, encode_seconds)
+            buffered -= len(batch)
+            first_row = batch.end_row
+            read_seconds = encode_seconds = 0
+            yield batch
+            batch_size = planner.next_batch_size()
+    if buffered:
+        batch = cut(buffered, read_seconds, encode_seconds)
+        # rows filtered out at the end of the file are counted as read
+        batch.end_row = end_row
+        batch.end_offset = end_offset
+        yield batch
+
+
+def iter_sharded_batches(pool, csv_path, row_encoder, planner, start_offset=0, start_row=0, delta=None,
+                         projection=None, shard_bytes=SHARD_BYTES, memory_guard=None):
+    '''
+    Yielding the same batches as iter_row_batches with the rows parsed and encoded by the pool.
+    Shards are consumed in order and cut into batches sized by the planner.
+    '''
+
+    shards = iter_encoded_shards(pool, csv_path, shard_encoding(row_encoder, projection, delta), start_offset,
+                                 start_row, shard_bytes, memory_guard)
+    try:
+        yield from iter_shard_batches(shards, row_encoder, planner, start_row, delta)
+    finally:
+        shards.close()
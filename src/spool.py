@@ -0,0 +1,214 @@
+'''
+Input tables parsed and encoded once for the uploads of all datasets.
+
+'''
+
+import os
+import pickle
+import shutil
+import threading
+
+from sharding import MIN_SHARDED_BYTES, iter_encoded_shards, iter_shard_batches, shard_encoding
+
+
+class TableSpool:
+    '''
+    Encoded shards of one table written to temporary files by a background thread and read by the uploads
+    of all datasets, each at its own pace. The writer does not wait for the readers, so a dataset held back
+    by its rate limits does not hold back the others. Readers ahead of the writer wait for the next shard.
+    Every shard is written to its own file, removed once all readers expected by the spool have read it.
+    Readers not opened yet hold all shards, the writer stops once no reader is left.
+    Errors of reading the table are raised by every reader.
+    '''
+
+    def __init__(self, path, shards, readers, start_row=0):
+        self.path = path
+        self.start_row = start_row
+        self._shards = shards
+        self._pending = set(readers)
+        self._positions = {}
+        self._written = 0
+        self._removed = 0
+        self._finished = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._write, name="spool", daemon=True)
+        self._thread.start()
+
+    def shard_path(self, index):
+        return "{0}.{1}".format(self.path, index)
+
+    def _write(self):
+        error = None
+        try:
+            for shard in self._shards:
+                if self._closed.is_set():
+                    break
+                with open(self.shard_path(self._written), 'wb') as file_out:
+                    pickle.dump(shard, file_out, pickle.HIGHEST_PROTOCOL)
+                # shards are counted as written only once the readers can read them whole
+                with self._condition:
+                    self._written += 1
+                    self._remove_read()
+                    self._condition.notify_all()
+        except Exception as e:
+            error = e
+        finally:
+            self._shards.close()
+            with self._condition:
+                self._finished = True
+                self._error = error
+                self._remove_read()
+                self._condition.notify_all()
+
+    def _remove_read(self):
+        # called with the condition held
+        if self._pending:
+            return
+        read = min(self._positions.values(), default=self._written)
+        while self._removed < read:
+            try:
+                os.remove(self.shard_path(self._removed))
+            except OSError:
+                pass
+            self._removed += 1
+        if not self._pending and not self._positions:
+            self._closed.set()
+
+    def open(self, reader, start_row=0):
+        '''
+        Encoded shards of the table in order for the reader, None if the reader is not expected by the spool
+        or does not start at its row
+        '''
+
+        with self._condition:
+            if reader not in self._pending:
+                return None
+            if start_row != self.start_row:
+                self._release(reader)
+                return None
+            self._pending.discard(reader)
+            self._positions[reader] = 0
+        return self._iter_shards(reader)
+
+    def _iter_shards(self, reader):
+        read = 0
+        try:
+            while True:
+                with self._condition:
+                    while read == self._written and not self._finished:
+                        self._condition.wait()
+                    if read == self._written:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                with open(self.shard_path(read), 'rb') as file_in:
+                    shard = pickle.load(file_in)
+                read += 1
+                with self._condition:
+                    self._positions[reader] = read
+                    self._remove_read()
+                yield shard
+        finally:
+            self.release(reader)
+
+    def release(self, reader):
+        '''
+        Reader done with the spool, shards are no longer kept for it
+        '''
+
+        with self._condition:
+            self._release(reader)
+
+    def _release(self, reader):
+        self._pending.discard(reader)
+        self._positions.pop(reader, None)
+        self._remove_read()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+
+class SharedTables:
+    '''
+    Spools of the input tables shared by the uploads of all datasets, the first upload of a table starts its spool.
+    Each dataset is a reader of the spools, identified by its client. Uploads of a table starting at another row
+    than its spool, resumed from a different checkpoint, read the table on their own.
+    Large tables are parsed by the parser pool if given, within the read-ahead budget of the memory guard.
+    '''
+
+    def __init__(self, folder, readers, parser_pool=None, memory_guard=None):
+        self.folder = folder
+        self.readers = set(readers)
+        self.parser_pool = parser_pool
+        self.memory_guard = memory_guard
+        self._spools = {}
+        # tables taken by every reader, other spools of the table are not kept for it
+        self._taken = set()
+        self._lock = threading.Lock()
+
+    def iter_batches(self, table, row_encoder, planner, start_offset=0, start_row=0, reader=None):
+        '''
+        Batches of the table read from its spool, None if the upload does not start at the row of the spool
+        '''
+
+        encoding = shard_encoding(row_encoder, table.projection, table.delta)
+        # projections are configured per input table, so the path and the encoding identify the rows of a spool
+        column_types = tuple(sorted((row_encoder.column_types or {}).items()))
+        key = (table.path, tuple(row_encoder.columns), column_types, row_encoder.policy,
+               table.delta is not None, tuple(table.delta.key_indexes or ()) if table.delta is not None else None)
+        with self._lock:
+            spool = self._spools.get(key)
+            if spool is None:
+                pool = self.parser_pool
+                if (table.byte_size or 0) - start_offset < MIN_SHARDED_BYTES:
+                    pool = None
+                shards = iter_encoded_shards(pool, table.path, encoding, start_offset, start_row,
+                                             memory_guard=self.memory_guard)
+                readers = [other for other in self.readers if (table.path, other) not in self._taken]
+                spool = TableSpool(os.path.join(self.folder, "{0}.spool".format(len(self._spools))), shards,
+                                   readers, start_row)
+                self._spools[key] = spool
+            self._take(table.path, reader, spool)
+        shards = spool.open(reader, start_row)
+        if shards is None:
+            return None
+        return iter_shard_batches(shards, row_encoder, planner, start_row, table.delta)
+
+    def skip(self, table, reader=None):
+        '''
+        Table not read by the reader, the spools of the table are not kept for it
+        '''
+
+        with self._lock:
+            self._take(table.path, reader)
+
+    def release(self, reader=None):
+        '''
+        Reader done with all tables, no spool is kept for it
+        '''
+
+        with self._lock:
+            self.readers.discard(reader)
+            for spool in self._spools.values():
+                spool.release(reader)
+
+    def _take(self, path, reader, spool=None):
+        # called with the lock held
+        self._taken.add((path, reader))
+        for (spool_path, *_), other in self._spools.items():
+            if spool_path == path and other is not spool:
+                other.release(reader)
+
+    def close(self):
+        '''
+        Stopping the spools still written and removing their files
+        '''
+
+        with self._lock:
+            for spool in self._spools.values():
+                spool.close()
+            self._spools = {}
+        shutil.rmtree(self.folder, ignore_errors=True)
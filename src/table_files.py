@@ -0,0 +1,91 @@
+'''
+Input tables stored as one CSV file or as a folder of sliced CSV files, plain or gzipped.
+
+'''
+
+import gzip
+import os
+
+
+GZIP_SUFFIX = '.gz'
+# Input files are read through a fixed size buffer
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class TablePart:
+    '''
+    One file of an input table, slices of a sliced table have no header.
+    Gzipped files are decompressed while read, offsets within them are offsets in the decompressed data.
+    '''
+
+    def __init__(self, path, header=False):
+        self.path = path
+        self.header = header
+        self.compressed = path.endswith(GZIP_SUFFIX)
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb', buffering=READ_BUFFER_SIZE)
+
+    def length(self):
+        '''
+        Size of the data of the part, gzipped files are decompressed to find it
+        '''
+
+        if not self.compressed:
+            return os.path.getsize(self.path)
+        length = 0
+        with self.open() as file_in:
+            for block in iter(lambda: file_in.read(READ_BUFFER_SIZE), b''):
+                length += len(block)
+        return length
+
+
+def table_parts(csv_path):
+    '''
+    Files of the input table in reading order, a folder holds the slices of a sliced table
+    '''
+
+    if not os.path.isdir(csv_path):
+        return [TablePart(csv_path, header=True)]
+    names = sorted(name for name in os.listdir(csv_path)
+                   if not name.startswith('.') and not name.endswith('.manifest'))
+    return [TablePart(os.path.join(csv_path, name)) for name in names]
+
+
+def has_header(csv_path):
+    return not os.path.isdir(csv_path)
+
+
+def locate(parts, offset):
+    '''
+    Index of the part holding the offset within the data of all parts and the offset the part starts at
+    '''
+
+    base = 0
+    for index, part in enumerate(parts):
+        if offset == base:
+            return index, base
+        length = part.length()
+        if offset < base + length:
+            return index, base
+        base += length
+
+    return len(parts), base
+
+
+def iter_table_lines(csv_path, start_offset=0):
+    '''
+    Binary lines of all parts of the table, one part after another, starting at start_offset
+    '''
+
+    parts = table_parts(csv_path)
+    index, base = locate(parts, start_offset)
+    offset = start_offset - base
+    for part in parts[index:]:
+        with part.open() as file_in:
+            if offset:
+                file_in.seek(offset)
+                offset = 0
+            yield from file_in
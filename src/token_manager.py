@@ -0,0 +1,75 @@
+'''
+Access token kept valid for the whole upload.
+
+'''
+
+import logging
+import threading
+import time
+
+
+# Token is refreshed this long before it expires, at the latest in the middle of its lifetime
+REFRESH_MARGIN_SECONDS = 300
+DEFAULT_EXPIRES_IN = 3600
+# Delay before another attempt when a background refresh failed
+RETRY_INTERVAL_SECONDS = 30
+
+
+class TokenManager:
+    '''
+    Access token shared by all requests.
+    The token is refreshed in a background thread before it expires, requests rejected with 401 refresh it
+    on demand. Requests read the current token without locking, so uploads are not stalled by a refresh.
+    '''
+
+    def __init__(self, fetch_token, refresh_margin=REFRESH_MARGIN_SECONDS):
+        '''
+        fetch_token returns a new access token and its lifetime in seconds
+        '''
+
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.refresh_at = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.refresh()
+
+    @property
+    def token(self):
+        return self.access_token
+
+    def refresh(self, expired_token=None):
+        '''
+        Fetching a new token, a refresh on 401 is skipped if another request already replaced the expired token
+        '''
+
+        with self._lock:
+            if expired_token is not None and expired_token != self.access_token:
+                return
+            access_token, expires_in = self.fetch_token()
+            expires_in = float(expires_in or DEFAULT_EXPIRES_IN)
+            self.access_token = access_token
+            self.refresh_at = time.monotonic() + expires_in - min(self.refresh_margin, expires_in / 2)
+            self.refreshes += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refresh_loop(self):
+        delay = self.refresh_at - time.monotonic()
+        while not self._stopped.wait(max(0, delay)):
+            try:
+                self.refresh()
+                logging.info("Access token refreshed")
+                delay = self.refresh_at - time.monotonic()
+            except (Exception, SystemExit) as e:
+                logging.warning("Access token refresh failed, retrying in {0} seconds - {1}".format(
+                    RETRY_INTERVAL_SECONDS, e))
+                delay = RETRY_INTERVAL_SECONDS
@@ -0,0 +1,396 @@
+'''
+Uploading input tables into a push dataset.
+
+'''
+
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder, build_body, iter_row_batches
+from memory import MemoryGuard
+from metrics import TableMetrics, log_summary
+from powerbi import MAX_TRIES, PayloadTooLargeError, RowsRejectedError, ServerError, ThrottledError, info_msg
+from prefetch import DEFAULT_PREFETCH_DEPTH, Prefetcher
+from rate_limiter import DEFAULT_RETRY_AFTER, MAX_REQUESTS_PER_MINUTE, RateGovernor
+from sharding import MIN_SHARDED_BYTES, iter_sharded_batches
+from validation import POLICY_TRUNCATE
+
+
+# Retries of a request rejected with 429 before the upload fails
+MAX_THROTTLED_RETRIES = 10
+# Seconds before the first retry of a request failed with a server or connection error, doubled on every retry
+SERVER_ERROR_BACKOFF = 1
+# Requests spent isolating the rejected rows of one batch, rows not isolated by then are quarantined together
+MAX_ISOLATION_REQUESTS = 120
+# Isolation takes at most half of the per minute limit, the rest is left to the other uploads
+ISOLATION_REQUESTS_PER_MINUTE = MAX_REQUESTS_PER_MINUTE // 2
+
+
+class TableUpload:
+    '''
+    Input table to be uploaded with its progress from a previous run
+    '''
+
+    def __init__(self, name, path, columns, column_types, scan=None, schema_hash=None, resume_point=None,
+                 delta=None, table_definition=None, drop_rows=False, invalid_values=None, projection=None):
+        self.name = name
+        self.path = path
+        self.columns = columns
+        self.column_types = column_types
+        self.scan = scan
+        self.schema_hash = schema_hash
+        self.resume_point = resume_point
+        self.delta = delta
+        # Preparation before the upload, schema to be pushed and dropping the rows of a full load
+        self.table_definition = table_definition
+        self.drop_rows = drop_rows
+        # Policy for values exceeding the limits or not matching the column data type
+        self.invalid_values = invalid_values
+        self.projection = projection
+
+    @property
+    def byte_size(self):
+        return self.scan.byte_size if self.scan else None
+
+
+def estimate_row_bytes(scan, row_encoder):
+    '''
+    Estimated size of a JSON encoded row, CSV row size plus the repeated column keys
+    '''
+
+    if not scan or not scan.row_count:
+        return 0
+    return scan.avg_row_bytes + sum(len(key) + 1 for key in row_encoder.keys)
+
+
+class Uploader:
+    '''
+    Uploading tables into one dataset, all uploads share the rate governor and the checkpoint.
+    Large tables are parsed by the parser pool if given.
+    Rows rejected by Power BI are isolated and written to the quarantine if given, otherwise the upload fails.
+    Tables are read from the spools shared with the uploads of the other datasets if shared_tables is given.
+    Up to prefetch_depth batches of every table are read and encoded while its current batch is sent.
+    '''
+
+    def __init__(self, client, governor, checkpoint, abort, memory_guard=None, parser_pool=None, quarantine=None,
+                 prefetch_depth=DEFAULT_PREFETCH_DEPTH, shared_tables=None):
+        self.client = client
+        self.governor = governor
+        self.checkpoint = checkpoint
+        self.abort = abort
+        self.memory_guard = memory_guard or MemoryGuard()
+        self.parser_pool = parser_pool
+        self.quarantine = quarantine
+        self.prefetch_depth = prefetch_depth
+        self.shared_tables = shared_tables
+        self.isolation_governor = RateGovernor(requests_per_minute=ISOLATION_REQUESTS_PER_MINUTE)
+        self.metrics = {}
+
+    def run(self, tables, max_workers):
+        '''
+        Preparing and uploading the tables concurrently, upload of a table starts once its own preparation is done.
+        Uploads of prepared tables are started before the remaining preparations.
+        All pending work is cancelled on the first failure.
+        '''
+
+        preparations = deque(tables)
+        prepared = deque()
+        pending = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                try:
+                    while preparations or prepared or pending:
+                        # tasks are submitted only for free workers, so the executor queue does not hold back uploads
+                        while len(pending) < max_workers and (preparations or prepared):
+                            if prepared:
+                                table = prepared.popleft()
+                                pending[executor.submit(self.upload_table, table)] = (table, False)
+                            else:
+                                table = preparations.popleft()
+                                pending[executor.submit(self.prepare_table, table)] = (table, True)
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            table, preparation = pending.pop(future)
+                            future.result()
+                            if preparation:
+                                prepared.append(table)
+                except (Exception, SystemExit):
+                    self.abort.set()
+                    for future in pending:
+                        future.cancel()
+                    raise
+        finally:
+            # the spools are no longer kept for the tables this dataset did not read
+            if self.shared_tables is not None:
+                self.shared_tables.release(self.client)
+
+    def prepare_table(self, table):
+        '''
+        Pushing the table schema and dropping the rows loaded before
+        '''
+
+        if self.abort.is_set():
+            return
+        if table.table_definition:
+            self.client.put_table(table.name, table.table_definition)
+        if table.drop_rows:
+            for attempt in range(1, MAX_THROTTLED_RETRIES + 2):
+                try:
+                    self.client.delete_rows(table.name)
+                    return
+                except ThrottledError as e:
+                    if attempt > MAX_THROTTLED_RETRIES:
+                        logging.error("Table {0}: {1}".format(table.name, e))
+                        logging.error("Request was throttled {0} times, giving up. {1}".format(attempt, info_msg))
+                        raise
+                    retry_after = e.retry_after if e.retry_after is not None else DEFAULT_RETRY_AFTER
+                    logging.warning("Table {0}: dropping rows throttled by Power BI, retrying in {1} seconds".format(
+                        table.name, retry_after))
+                    self.governor.throttled(retry_after)
+                    time.sleep(retry_after)
+
+    def upload_table(self, table):
+        '''
+        Uploading all rows of the table chunk by chunk, progress is recorded after every chunk
+        '''
+
+        resume_point = table.resume_point
+        if resume_point and resume_point["completed"]:
+            logging.info("Table {0}: already loaded by the previous run, skipping".format(table.name))
+            if self.shared_tables is not None:
+                self.shared_tables.skip(table, self.client)
+            self.checkpoint.record(table.name, table.schema_hash, table.byte_size, resume_point["row_index"],
+                                   resume_point["byte_offset"], completed=True)
+            return
+
+        logging.info("Loading table: {0}".format(table.name))
+        metrics = self.metrics[table.name] = TableMetrics(table.name)
+        row_encoder = RowEncoder(table.columns, table.column_types, table.invalid_values)
+        planner = ChunkPlanner(estimate_row_bytes(table.scan, row_encoder))
+        row_index = resume_point["row_index"] if resume_point else 0
+        byte_offset = resume_point["byte_offset"] if resume_point else 0
+        batches = None
+        if self.shared_tables is not None:
+            batches = self.shared_tables.iter_batches(table, row_encoder, planner, byte_offset, row_index,
+                                                      self.client)
+        if batches is None:
+            batches = self.read_batches(table, row_encoder, planner, byte_offset, row_index)
+        # the next batches are read and encoded while the current one is sent,
+        # the guard limits the number of batches of all tables held in memory at once
+        prepared = Prefetcher(batches, self.prepare_batch, planner, self.memory_guard, self.prefetch_depth)
+        try:
+            while True:
+                wait_started = time.perf_counter()
+                item = next(prepared, None)
+                metrics.record_wait(time.perf_counter() - wait_started)
+                if item is None:
+                    break
+                batch, body = item
+                try:
+                    if self.abort.is_set():
+                        return
+                    metrics.record_batch(batch)
+                    rejected = self.send_rows(planner, metrics, table.name, batch.rows, body)
+                    if table.delta is not None:
+                        # rejected rows are not remembered as pushed, the next delta load sends them again
+                        rejected = set(rejected)
+                        table.delta.index.update([digest for position, digest in enumerate(batch.fingerprints)
+                                                  if position not in rejected])
+                    row_index = batch.end_row
+                    byte_offset = batch.end_offset
+                finally:
+                    self.memory_guard.release(planner)
+                self.checkpoint.record(table.name, table.schema_hash, table.byte_size, row_index, byte_offset)
+                if table.scan and table.scan.input_rows:
+                    logging.info("Table {0}: {1}/{2} rows processed ({3:.0%})".format(
+                        table.name, row_index, table.scan.input_rows, row_index / table.scan.input_rows))
+        finally:
+            prepared.close()
+
+        self.checkpoint.record(table.name, table.schema_hash, table.byte_size, row_index, byte_offset,
+                               completed=True)
+        metrics.finish()
+        log_summary(metrics.summary())
+        if table.delta is not None and table.delta.skipped:
+            logging.info("Table {0}: {1} rows already pushed before were skipped".format(
+                table.name, table.delta.skipped))
+        if metrics.rows_rejected:
+            logging.warning("Table {0}: {1} rows rejected by Power BI were written to the quarantine table".format(
+                table.name, metrics.rows_rejected))
+        if row_encoder.skipped_rows:
+            logging.warning("Table {0}: {1} rows with values exceeding the limits or not matching the column data "
+                            "type were skipped".format(table.name, row_encoder.skipped_rows))
+        if row_encoder.error_counts:
+            logging.warning("Table {0}: values not matching the column data type were sent {1}: {2}".format(
+                table.name, "empty" if table.invalid_values == POLICY_TRUNCATE else "as strings",
+                row_encoder.error_counts))
+        logging.info("Table loaded: {0}".format(table.name))
+
+    def read_batches(self, table, row_encoder, planner, byte_offset, row_index):
+        '''
+        Batches of the table read by this upload alone, large tables are parsed by the parser pool
+        '''
+
+        if self.parser_pool is not None and (table.byte_size or 0) - byte_offset >= MIN_SHARDED_BYTES:
+            return iter_sharded_batches(self.parser_pool, table.path, row_encoder, planner,
+                                        start_offset=byte_offset, start_row=row_index, delta=table.delta,
+                                        projection=table.projection, memory_guard=self.memory_guard)
+        return iter_row_batches(table.path, row_encoder, planner, start_offset=byte_offset, start_row=row_index,
+                                delta=table.delta, projection=table.projection)
+
+    @staticmethod
+    def prepare_batch(batch):
+        '''
+        Building the request body of a batch, the time is counted as encoding of the batch
+        '''
+
+        encode_started = time.perf_counter()
+        body = build_body(batch.rows)
+        batch.encode_seconds += time.perf_counter() - encode_started
+        return body
+
+    def send_rows(self, planner, metrics, tablename, rows, body=None):
+        '''
+        Posting a batch of rows, batches rejected as too large are split in halves.
+        Returns the positions of the rows rejected by Power BI within the batch.
+        '''
+
+        if body is None:
+            encode_started = time.perf_counter()
+            body = build_body(rows)
+            metrics.record_encode(time.perf_counter() - encode_started)
+        try:
+            self.post_throttled(metrics, tablename, body, len(rows))
+        except PayloadTooLargeError as e:
+            if len(rows) == 1:
+                logging.error("Table {0}: single row could not be sent - {1}".format(tablename, e))
+                sys.exit(1)
+            logging.warning("Table {0}: {1}, splitting batch of {2} rows".format(tablename, e, len(rows)))
+            metrics.record_retry()
+            planner.record_failure(len(rows))
+            half = len(rows) // 2
+            rejected = self.send_rows(planner, metrics, tablename, rows[:half])
+            rejected_second = self.send_rows(planner, metrics, tablename, rows[half:])
+            return rejected + [half + position for position in rejected_second]
+        except RowsRejectedError as e:
+            return self.quarantine_rows(metrics, tablename, rows, str(e))
+
+        planner.record_success(len(rows), len(body))
+        return []
+
+    def quarantine_rows(self, metrics, tablename, rows, error):
+        '''
+        Finding the rows of a rejected batch which Power BI does not accept, the other rows are sent
+        and the rejected ones written to the quarantine
+        '''
+
+        if self.quarantine is None:
+            logging.error("Table {0}: batch of {1} rows was rejected - {2}".format(tablename, len(rows), error))
+            logging.error("Enable quarantine of rejected rows to load the other rows and keep the rejected ones "
+                          "in an output table.")
+            sys.exit(1)
+        logging.warning("Table {0}: batch of {1} rows was rejected, isolating the rejected rows - {2}".format(
+            tablename, len(rows), error))
+        budget = [MAX_ISOLATION_REQUESTS]
+        rejected = self.isolate_rows(metrics, tablename, rows, error, budget)
+        if len(rejected) == len(rows) > 1:
+            logging.error("Table {0}: all {1} rows of the batch were rejected, the error is not caused by single "
+                          "rows - {2}".format(tablename, len(rows), error))
+            sys.exit(1)
+        if budget[0] <= 0:
+            logging.warning("Table {0}: rejected rows were not isolated within {1} requests, rows not isolated "
+                            "are quarantined together".format(tablename, MAX_ISOLATION_REQUESTS))
+        self.quarantine.add(self.client.dataset, tablename, [rows[position] for position, _ in rejected],
+                            [row_error for _, row_error in rejected])
+        metrics.record_rejected(len(rejected))
+        return [position for position, _ in rejected]
+
+    def isolate_rows(self, metrics, tablename, rows, error, budget, start=0):
+        '''
+        Bisecting rejected rows, halves are sent until single rejected rows are left.
+        When the first half holds no rejected rows the second half holds them and is split without sending it.
+        Returns the positions of the rejected rows with the error of the smallest rejected part.
+        '''
+
+        if len(rows) == 1 or budget[0] <= 0:
+            return [(start + position, error) for position in range(len(rows))]
+        half = len(rows) // 2
+        rejected = self.isolate_part(metrics, tablename, rows[:half], budget, start)
+        if not rejected:
+            return self.isolate_rows(metrics, tablename, rows[half:], error, budget, start + half)
+        if budget[0] <= 0:
+            return rejected + [(start + half + position, error) for position in range(len(rows) - half)]
+        return rejected + self.isolate_part(metrics, tablename, rows[half:], budget, start + half)
+
+    def isolate_part(self, metrics, tablename, rows, budget, start):
+        '''
+        Sending a part of a rejected batch which may hold no rejected rows, returns its rejected rows.
+        Parts too large for a request are split further, parts failing with server errors after the retries
+        are quarantined whole.
+        '''
+
+        try:
+            self.post_isolated(metrics, tablename, rows, budget)
+        except RowsRejectedError as e:
+            return self.isolate_rows(metrics, tablename, rows, str(e), budget, start)
+        except PayloadTooLargeError as e:
+            if len(rows) == 1 or budget[0] <= 0:
+                return [(start + position, str(e)) for position in range(len(rows))]
+            metrics.record_retry()
+            half = len(rows) // 2
+            return (self.isolate_part(metrics, tablename, rows[:half], budget, start)
+                    + self.isolate_part(metrics, tablename, rows[half:], budget, start + half))
+        except ServerError as e:
+            logging.warning("Table {0}: part of {1} rows of a rejected batch failed, quarantining it - {2}".format(
+                tablename, len(rows), e))
+            return [(start + position, str(e)) for position in range(len(rows))]
+        return []
+
+    def post_isolated(self, metrics, tablename, rows, budget):
+        '''
+        Posting a part of a rejected batch within the share of the rate limits left for isolation
+        '''
+
+        budget[0] -= 1
+        metrics.record_throttle(self.isolation_governor.acquire(len(rows)))
+        self.post_throttled(metrics, tablename, build_body(rows), len(rows))
+
+    def post_throttled(self, metrics, tablename, body, row_count):
+        '''
+        Posting rows within the rate limits, throttled requests are retried after the wait requested by the API.
+        Server and connection errors are retried with exponential backoff, every attempt is counted by the governor.
+        '''
+
+        throttled = 0
+        failed = 0
+        while True:
+            metrics.record_throttle(self.governor.acquire(row_count))
+            request_started = time.perf_counter()
+            try:
+                self.client.post_rows(tablename, body)
+                metrics.record_request(time.perf_counter() - request_started, len(body), row_count)
+                return
+            except ThrottledError as e:
+                throttled += 1
+                if throttled > MAX_THROTTLED_RETRIES:
+                    logging.error("Table {0}: {1}".format(tablename, e))
+                    logging.error("Request was throttled {0} times, giving up. {1}".format(throttled, info_msg))
+                    raise
+                logging.warning("Table {0}: request throttled by Power BI, retrying in {1} seconds".format(
+                    tablename, e.retry_after if e.retry_after is not None else DEFAULT_RETRY_AFTER))
+                metrics.record_retry()
+                self.governor.throttled(e.retry_after)
+            except ServerError as e:
+                failed += 1
+                if failed >= MAX_TRIES:
+                    logging.error("Table {0}: {1}".format(tablename, e))
+                    logging.error("Request failed {0} times, giving up.".format(failed))
+                    raise
+                retry_after = SERVER_ERROR_BACKOFF * 2 ** (failed - 1)
+                logging.warning("Table {0}: {1}, retrying in {2} seconds".format(tablename, e, retry_after))
+                metrics.record_retry()
+                time.sleep(retry_after)
@@ -0,0 +1,53 @@
+'''
+Pre-flight validation of the input tables against the push dataset limits.
+
+'''
+
+
+MAX_COLUMNS = 75
+MAX_TABLES = 75
+MAX_STRING_LENGTH = 4000
+
+# Handling of values exceeding the limits or not matching the column data type,
+# values are sent as strings by default and converted by Power BI as before the values were typed
+POLICY_SEND_AS_STRING = 'send_as_string'
+POLICY_FAIL = 'fail'
+POLICY_TRUNCATE = 'truncate'
+POLICY_SKIP_ROW = 'skip_row'
+POLICIES = (POLICY_SEND_AS_STRING, POLICY_FAIL, POLICY_TRUNCATE, POLICY_SKIP_ROW)
+
+
+def table_limit_errors(scans):
+    '''
+    Violations of the limits which cannot be fixed by dropping or truncating values,
+    the row count is checked while the tables are scanned
+    '''
+
+    errors = []
+    if len(scans) > MAX_TABLES:
+        errors.append("{0} tables found in input mapping, a dataset can contain {1} tables at most".format(
+            len(scans), MAX_TABLES))
+    for name, scan in scans.items():
+        if len(scan.columns) > MAX_COLUMNS:
+            errors.append("Table {0}: {1} columns found, {2} columns at most are allowed".format(
+                name, len(scan.columns), MAX_COLUMNS))
+
+    return errors
+
+
+def value_issues(name, scan):
+    '''
+    Columns with values exceeding the string length limit or not matching the column data type
+    '''
+
+    issues = []
+    for column, count in scan.oversize_counts.items():
+        if count:
+            issues.append("Table {0}: {1} values of column {2} are longer than {3} characters".format(
+                name, count, column, MAX_STRING_LENGTH))
+    for column, count in scan.invalid_counts.items():
+        if count:
+            issues.append("Table {0}: {1} values of column {2} do not match the column data type".format(
+                name, count, column))
+
+    return issues
@@ -0,0 +1,85 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from aggregation import TableAggregation
+from projection import TableProjection
+
+
+COLUMNS = ["region", "day", "amount", "units", "created"]
+TYPES = {"region": "String", "day": "String", "amount": "Decimal", "units": "Int64", "created": "DateTime"}
+ROWS = [
+    ["east", "mon", "1.10", "1", "2020-01-02T00:00:00"],
+    ["east", "mon", "2.20", "", "2020-01-01T00:00:00"],
+    ["west", "mon", "x", "3", "2020-01-05T00:00:00"],
+    ["east", "tue", "4", "4", ""],
+]
+
+
+class TestTableAggregation(unittest.TestCase):
+
+    def write_table(self, rows):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            writer = csv.writer(file_out)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def aggregate(self, aggregation, projection=None):
+        path = self.write_table(ROWS)
+        output_path = path + '.aggregated'
+        self.addCleanup(os.remove, output_path)
+        row_count = aggregation.aggregate(path, output_path, projection)
+        with open(output_path, newline='') as file_in:
+            rows = list(csv.reader(file_in))
+        self.assertEqual(len(rows) - 1, row_count)
+        return rows
+
+    def test_grouped_measures(self):
+        aggregation = TableAggregation(COLUMNS, ["region", "day"], [
+            ("amount", "sum", None), ("units", "sum", "units"), (None, "count", "rows"), ("units", "count", None),
+            ("created", "min", "first"), ("created", "max", "last")
+        ], TYPES)
+        self.assertEqual(aggregation.column_types, {
+            "region": "String", "day": "String", "sum_amount": "Decimal", "units": "Int64", "rows": "Int64",
+            "count_units": "Int64", "first": "DateTime", "last": "DateTime"
+        })
+        self.assertEqual(self.aggregate(aggregation), [
+            ["region", "day", "sum_amount", "units", "rows", "count_units", "first", "last"],
+            ["east", "mon", "3.30", "1", "2", "1", "2020-01-01T00:00:00", "2020-01-02T00:00:00"],
+            ["west", "mon", "0", "3", "1", "1", "2020-01-05T00:00:00", "2020-01-05T00:00:00"],
+            ["east", "tue", "4", "4", "1", "1", "", ""]
+        ])
+        self.assertEqual(aggregation.measures[0].invalid, 1)
+
+    def test_total_without_groups(self):
+        aggregation = TableAggregation(COLUMNS, [], [("units", "max", None)], TYPES)
+        self.assertEqual(self.aggregate(aggregation), [["max_units"], ["4"]])
+
+    def test_projection_is_applied_first(self):
+        projection = TableProjection(COLUMNS, [("region", "area"), ("units", None)],
+                                     [("units", "greater_than", "2")], TYPES)
+        aggregation = TableAggregation(projection.columns, ["area"], [("units", "sum", None)],
+                                       {"area": "String", "units": "Int64"})
+        self.assertEqual(self.aggregate(aggregation, projection), [
+            ["area", "sum_units"], ["west", "3"], ["east", "4"]
+        ])
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            TableAggregation(COLUMNS, ["missing"], [("amount", "sum", None)], TYPES)
+        with self.assertRaises(ValueError):
+            TableAggregation(COLUMNS, ["region"], [("region", "sum", None)], TYPES)
+        with self.assertRaises(ValueError):
+            TableAggregation(COLUMNS, ["region"], [("amount", "avg", None)], TYPES)
+        with self.assertRaises(ValueError):
+            TableAggregation(COLUMNS, ["region"], [], TYPES)
+        with self.assertRaises(ValueError):
+            TableAggregation(COLUMNS, ["region"], [("amount", "sum", "region")], TYPES)
+
+
+if __name__ == "__main__":
+    unittest.main()
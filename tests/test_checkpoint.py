@@ -0,0 +1,22 @@
+import unittest
+
+from checkpoint import UploadCheckpoint
+
+
+class TestUploadCheckpoint(unittest.TestCase):
+
+    def test_resume_point_requires_matching_dataset_schema_and_size(self):
+        checkpoint = UploadCheckpoint(None, "ds-1")
+        schema_hash = checkpoint.schema_hash(["id"], {"id": "Int64"})
+        checkpoint.record("orders", schema_hash, 100, 20, 50)
+        state = checkpoint.to_state()
+
+        resumed = UploadCheckpoint(state, "ds-1")
+        self.assertEqual(resumed.resume_point("orders", schema_hash, 100)["byte_offset"], 50)
+        self.assertIsNone(resumed.resume_point("orders", schema_hash, 101))
+        self.assertIsNone(resumed.resume_point("orders", checkpoint.schema_hash(["id"], {}), 100))
+        self.assertIsNone(UploadCheckpoint(state, "ds-2").resume_point("orders", schema_hash, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from chunking import ChunkPlanner
+
+
+class TestChunkPlanner(unittest.TestCase):
+
+    def test_batch_sized_by_row_bytes(self):
+        self.assertEqual(ChunkPlanner().next_batch_size(), 10_000)
+        self.assertEqual(ChunkPlanner(avg_row_bytes=1000, target_bytes=500_000).next_batch_size(), 500)
+        self.assertEqual(ChunkPlanner(avg_row_bytes=10, target_bytes=500_000).next_batch_size(), 10_000)
+
+    def test_shrinks_on_failure_and_grows_back(self):
+        planner = ChunkPlanner(avg_row_bytes=10, target_bytes=500_000)
+        planner.record_failure(10_000)
+        self.assertEqual(planner.next_batch_size(), 5_000)
+        for _ in range(5):
+            planner.record_success(5_000, 50_000)
+        self.assertEqual(planner.next_batch_size(), 10_000)
+
+    def test_memory_limit_shrinks_batches_and_relaxes(self):
+        planner = ChunkPlanner(avg_row_bytes=10, target_bytes=500_000)
+        planner.shrink()
+        self.assertEqual(planner.next_batch_size(), 5_000)
+        for _ in range(10):
+            planner.shrink()
+        self.assertEqual(planner.next_batch_size(), 500)
+        for _ in range(10):
+            planner.relax()
+        self.assertEqual(planner.next_batch_size(), 10_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,66 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import mock
-import os
 from freezegun import freeze_time
 
-from component import Component
+from chunking import ChunkPlanner
+from component import STATE_ROW_FINGERPRINTS, Component
+from memory import MemoryGuard
+from powerbi import RowsRejectedError
+from scanner import scan_table
+from validation import POLICY_SEND_AS_STRING
+
+
+COLUMNS = ["id", "name"]
+TYPES = {"id": "Int64", "name": "String"}
+
+
+class FakePowerBI:
+    '''
+    Power BI client keeping the rows of one push dataset in memory
+    '''
+
+    def __init__(self, dataset="a"):
+        self.dataset = dataset
+        self.dataset_id = "id-" + dataset
+        self.dataset_found = False
+        self.input_table_columns = {"t": COLUMNS}
+        self.dataset_payload = {"tables": [{"name": "t", "columns": [
+            {"name": column, "dataType": data_type} for column, data_type in TYPES.items()]}]}
+        self.tables = {}
+
+    def create_dataset(self):
+        self.dataset_found = True
+        self.tables = {"t": []}
+
+    def fetch_table_primary_keys(self):
+        return {"t": ["id"]}
+
+    def get_column_types(self, tablename):
+        return TYPES
+
+    def get_projection(self, tablename):
+        return None
+
+    def get_table_definitions(self):
+        return {name: None for name in self.tables}
+
+    def put_table(self, tablename, payload):
+        self.tables.setdefault(tablename, [])
+
+    def delete_rows(self, tablename):
+        self.tables[tablename] = []
+
+    def post_rows(self, tablename, body):
+        self.tables[tablename].extend(json.loads(body)["rows"])
 
 
 class TestComponent(unittest.TestCase):
@@ -23,6 +77,94 @@ class TestComponent(unittest.TestCase):
             comp.run()
 
 
+class TestLoadDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "t.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_table(self, rows):
+        with open(self.path, "w") as file_out:
+            file_out.write("id,name\n")
+            for i in range(rows):
+                file_out.write("{0},row {0}\n".format(i))
+        return {"t": scan_table(self.path, TYPES)}
+
+    def settings(self, delta_load):
+        return {
+            "incremental": False,
+            "resume": False,
+            "delta_load": delta_load,
+            "invalid_values": POLICY_SEND_AS_STRING,
+            "max_workers": 2,
+            "sources": {"t": self.path},
+            "parser_pool": None,
+            "quarantine": None,
+            "prefetch_depth": 1,
+            "shared_tables": None
+        }
+
+    def load(self, client, dataset_state, rows, delta_load):
+        scans = self.write_table(rows)
+        component = Component.__new__(Component)
+        with mock.patch("component.logging"), mock.patch("uploader.logging"):
+            return component.load_dataset(client, scans, dataset_state, MemoryGuard(), self.settings(delta_load))
+
+    def test_full_load_clears_row_fingerprints(self):
+        client = FakePowerBI()
+        dataset_state = {}
+        self.load(client, dataset_state, 2000, delta_load=True)
+        self.assertEqual(len(client.tables["t"]), 2000)
+        self.load(client, dataset_state, 1000, delta_load=False)
+        self.assertEqual(len(client.tables["t"]), 1000)
+        self.assertNotIn(STATE_ROW_FINGERPRINTS, dataset_state)
+        # rows dropped by the full load are sent again
+        self.load(client, dataset_state, 2000, delta_load=True)
+        self.assertEqual(len(client.tables["t"]), 3000)
+        self.assertEqual(len({row["id"] for row in client.tables["t"]}), 2000)
+
+    def test_recreated_table_is_loaded_whole(self):
+        client = FakePowerBI()
+        dataset_state = {}
+        self.load(client, dataset_state, 100, delta_load=True)
+        del client.tables["t"]
+        self.load(client, dataset_state, 100, delta_load=True)
+        self.assertEqual(len(client.tables["t"]), 100)
+
+    def test_failed_dataset_stops_the_others(self):
+        scans = self.write_table(200)
+        failed = threading.Event()
+
+        class FailingPowerBI(FakePowerBI):
+
+            def post_rows(self, tablename, body):
+                failed.set()
+                raise RowsRejectedError("400 - Bad request")
+
+        class WaitingPowerBI(FakePowerBI):
+
+            def post_rows(self, tablename, body):
+                failed.wait(5)
+                time.sleep(0.01)
+                super().post_rows(tablename, body)
+
+        clients = [WaitingPowerBI("a"), FailingPowerBI("b")]
+        dataset_states = {"Name:a": {}, "Name:b": {}}
+        component = Component.__new__(Component)
+        with mock.patch("component.logging"), mock.patch("uploader.logging"), \
+                mock.patch("uploader.ChunkPlanner", lambda *args: ChunkPlanner(max_rows=10)):
+            results, errors = component.load_datasets(clients, scans, dataset_states, MemoryGuard(),
+                                                      self.settings(delta_load=True))
+        self.assertEqual([result["dataset"] for result in results], ["a"])
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], SystemExit)
+        # rows sent after the failure would not be recorded, the next run would send them again
+        self.assertLess(len(clients[0].tables["t"]), 50)
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
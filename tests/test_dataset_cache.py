@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+
+from dataset_cache import DatasetCache
+
+
+class TestDatasetCache(unittest.TestCase):
+
+    def test_index_is_reused_within_ttl_for_the_same_workspace(self):
+        with mock.patch("dataset_cache.time.time", return_value=1000):
+            cache = DatasetCache(workspace="ws")
+            cache.update([{"id": "1", "name": "sales"}, {"id": "2", "name": "stock"}, {"id": "3", "name": "stock"}])
+            state = cache.to_state()
+
+        with mock.patch("dataset_cache.time.time", return_value=1000 + 60):
+            cached = DatasetCache(state, "ws", ttl=3600)
+            self.assertTrue(cached.fresh)
+            self.assertEqual(cached.ids_by_name("sales"), ["1"])
+            self.assertEqual(cached.ids_by_name("stock"), ["2", "3"])
+            self.assertFalse(DatasetCache(state, "other", ttl=3600).fresh)
+
+        with mock.patch("dataset_cache.time.time", return_value=1000 + 3600):
+            expired = DatasetCache(state, "ws", ttl=3600)
+            self.assertFalse(expired.fresh)
+            self.assertEqual(expired.ids_by_name("sales"), [])
+
+    def test_added_and_removed_datasets(self):
+        cache = DatasetCache(workspace="")
+        cache.update([{"id": "1", "name": "sales"}])
+        cache.add({"id": "2", "name": "stock"})
+        cache.remove("1")
+        self.assertEqual(cache.ids_by_name("sales"), [])
+        self.assertEqual(cache.ids_by_name("stock"), ["2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
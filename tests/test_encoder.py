@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder, build_body, iter_row_batches
+
+
+class TestEncoder(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            file_out.write('"id","name"\n"1","a ""quoted""\nvalue"\n"2",""\n"3","NA"\n')
+        self.addCleanup(os.remove, self.path)
+
+    def test_batches_and_body(self):
+        batches = list(iter_row_batches(self.path, RowEncoder(["id", "name"]), ChunkPlanner(max_rows=2)))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual([batch.first_row for batch in batches], [0, 2])
+        self.assertEqual(batches[-1].end_offset, os.path.getsize(self.path))
+
+        body = json.loads(build_body(batches[0].rows + batches[1].rows))
+        self.assertEqual(body, {"rows": [
+            {"id": "1", "name": 'a "quoted"\nvalue'},
+            {"id": "2", "name": None},
+            {"id": "3", "name": None}
+        ]})
+
+    def test_resume_from_offset(self):
+        planner = ChunkPlanner(max_rows=2)
+        first = next(iter_row_batches(self.path, RowEncoder(["id", "name"]), planner))
+        resumed = list(iter_row_batches(self.path, RowEncoder(["id", "name"]), planner,
+                                        start_offset=first.end_offset, start_row=len(first)))
+        self.assertEqual(len(resumed), 1)
+        self.assertEqual(resumed[0].first_row, 2)
+        self.assertEqual(json.loads(resumed[0].rows[0]), {"id": "3", "name": None})
+
+    def test_typed_values(self):
+        row_encoder = RowEncoder(['i', 'd', 'b', 't'], {'i': 'Int64', 'd': 'Decimal', 'b': 'Boolean', 't': 'DateTime'})
+        self.assertEqual(json.loads(row_encoder.encode(['12', '1.50', 'true', '2015-10-13 10:00:00'])),
+                         {'i': 12, 'd': 1.5, 'b': True, 't': '2015-10-13T10:00:00'})
+        self.assertEqual(json.loads(row_encoder.encode(['3.0', '.5', 'N', '2015-10-13'])),
+                         {'i': 3, 'd': 0.5, 'b': False, 't': '2015-10-13T00:00:00'})
+        self.assertEqual(row_encoder.error_counts, {})
+
+    def test_datetime_forms(self):
+        row_encoder = RowEncoder(['t'], {'t': 'DateTime'})
+        for value, expected in [
+            ('2024-01-02 10:00:00+00', '2024-01-02T10:00:00+00:00'),
+            ('2024-01-02T10:00:00+0530', '2024-01-02T10:00:00+05:30'),
+            ('2024-01-02 10:00:00-02:00', '2024-01-02T10:00:00-02:00'),
+            ('2024-01-02T10:00:00Z', '2024-01-02T10:00:00+00:00'),
+            ('2024-01-02 10:00:00.1234', '2024-01-02T10:00:00.123400'),
+            ('2024-01-02 10:00:00.123456789', '2024-01-02T10:00:00.123456'),
+            ('2024-01-02 10:00:00.5+00', '2024-01-02T10:00:00.500000+00:00'),
+            ('2024-01-02T10:00', '2024-01-02T10:00:00'),
+            (' 2024-01-02 ', '2024-01-02T00:00:00')
+        ]:
+            self.assertEqual(json.loads(row_encoder.encode([value])), {'t': expected})
+        self.assertEqual(row_encoder.error_counts, {})
+        for value in ['2024-13-02', '2024-01-02 25:00', '2024/01/02', '2024-01-02 10:00:00+5']:
+            self.assertEqual(json.loads(row_encoder.encode([value])), {'t': value})
+        self.assertEqual(row_encoder.error_counts, {'t': 4})
+
+    def test_conversion_errors_sent_as_strings(self):
+        row_encoder = RowEncoder(['i', 't'], {'i': 'Int64', 't': 'DateTime'}, policy='send_as_string')
+        self.assertEqual(json.loads(row_encoder.encode(['x', '13/10/2015'])), {'i': 'x', 't': '13/10/2015'})
+        self.assertEqual(json.loads(row_encoder.encode(['1', ''])), {'i': 1, 't': None})
+        self.assertEqual(row_encoder.error_counts, {'i': 1, 't': 1})
+
+    def test_truncate_policy(self):
+        row_encoder = RowEncoder(['i', 's'], {'i': 'Int64'}, policy='truncate')
+        self.assertEqual(json.loads(row_encoder.encode(['x', 'a' * 4001])), {'i': None, 's': 'a' * 4000})
+        self.assertEqual(row_encoder.error_counts, {'i': 1})
+
+    def test_skip_row_policy(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            file_out.write('i,s\n1,a\nx,b\n3,{0}\n4,d\n'.format('c' * 4001))
+        self.addCleanup(os.remove, path)
+
+        row_encoder = RowEncoder(['i', 's'], {'i': 'Int64'}, policy='skip_row')
+        batches = list(iter_row_batches(path, row_encoder, ChunkPlanner()))
+        self.assertEqual([json.loads(row)['i'] for row in batches[0].rows], [1, 4])
+        self.assertEqual(batches[0].end_row, 4)
+        self.assertEqual(row_encoder.skipped_rows, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from fingerprint import FingerprintStore
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_rows_pushed_before_are_skipped(self):
+        store = FingerprintStore(None, "ds-1")
+        delta = store.delta_filter("orders", ["id", "amount"], ["id"])
+        first = delta.new_row_fingerprint(["1", "10"])
+        self.assertIsNotNone(first)
+        self.assertIsNone(delta.new_row_fingerprint(["1", "20"]))
+        delta.index.update([first])
+
+        state = store.to_state()
+        delta = FingerprintStore(state, "ds-1").delta_filter("orders", ["id", "amount"], ["id"])
+        self.assertIsNone(delta.new_row_fingerprint(["1", "30"]))
+        self.assertIsNotNone(delta.new_row_fingerprint(["2", "30"]))
+        self.assertEqual(delta.skipped, 1)
+
+    def test_index_reset_on_key_change(self):
+        store = FingerprintStore(None, "ds-1")
+        delta = store.delta_filter("orders", ["id", "amount"])
+        delta.index.update([delta.new_row_fingerprint(["1", "10"])])
+
+        delta = FingerprintStore(store.to_state(), "ds-1").delta_filter("orders", ["id", "amount"], ["id"])
+        self.assertEqual(len(delta.index), 0)
+
+    def test_forgotten_table(self):
+        store = FingerprintStore(None, "ds-1")
+        delta = store.delta_filter("orders", ["id", "amount"], ["id"])
+        delta.index.update([delta.new_row_fingerprint(["1", "10"])])
+
+        store = FingerprintStore(store.to_state(), "ds-1")
+        store.forget("orders")
+        self.assertEqual(store.to_state()["tables"], {})
+        self.assertEqual(len(store.delta_filter("orders", ["id", "amount"], ["id"]).index), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import unittest
+from unittest import mock
+
+from chunking import ChunkPlanner
+from memory import MemoryGuard
+
+
+class TestMemoryGuard(unittest.TestCase):
+
+    def test_concurrency_lowered_above_high_watermark_and_raised_back(self):
+        with mock.patch("memory.current_rss", return_value=10):
+            guard = MemoryGuard(max_rss_bytes=100, max_workers=3)
+        planner = ChunkPlanner()
+        with mock.patch("memory.current_rss", return_value=90):
+            guard.acquire()
+            guard.release(planner)
+        self.assertEqual(guard.allowed, 2)
+        self.assertEqual(planner.next_batch_size(), 5_000)
+        with mock.patch("memory.current_rss", return_value=10):
+            guard.acquire()
+            guard.release(planner)
+        self.assertEqual(guard.allowed, 3)
+        self.assertEqual(guard.metrics()["memory_reductions"], 1)
+
+    def test_slots_wait_for_allowed_concurrency(self):
+        with mock.patch("memory.current_rss", return_value=10):
+            guard = MemoryGuard(max_rss_bytes=100, max_workers=1)
+            planner = ChunkPlanner()
+            entered = threading.Event()
+
+            def second_batch():
+                guard.acquire()
+                entered.set()
+                guard.release(planner)
+
+            thread = threading.Thread(target=second_batch)
+            guard.acquire()
+            thread.start()
+            self.assertFalse(entered.wait(0.05))
+            guard.release(planner)
+            thread.join(1)
+            self.assertTrue(entered.is_set())
+
+    def test_shard_budget_lowered_above_high_watermark_and_raised_back(self):
+        guard = MemoryGuard(max_rss_bytes=100, max_shards=2)
+        self.assertTrue(guard.acquire_shard())
+        self.assertTrue(guard.acquire_shard())
+        self.assertFalse(guard.acquire_shard())
+        with mock.patch("memory.current_rss", return_value=90):
+            guard.release_shard()
+        self.assertEqual((guard.shards, guard.allowed_shards), (1, 1))
+        self.assertFalse(guard.acquire_shard())
+        with mock.patch("memory.current_rss", return_value=10):
+            guard.release_shard()
+        self.assertEqual((guard.shards, guard.allowed_shards), (0, 2))
+        self.assertEqual(guard.metrics()["memory_reductions"], 1)
+
+    def test_disabled_without_limit(self):
+        guard = MemoryGuard()
+        guard.acquire()
+        self.assertEqual(guard.active, 0)
+        guard.release(ChunkPlanner())
+
+
+if __name__ == "__main__":
+    unittest.main()
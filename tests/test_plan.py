@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from plan import REQUEST_LATENCY_SECONDS, plan_dataset, plan_table, simulate_uploads, write_plan
+from scanner import scan_table
+
+
+def table(rows, rows_per_request=10000, name="t"):
+    requests = -(-rows // rows_per_request)
+    return {"table": name, "rows": rows, "rows_per_request": rows_per_request, "requests": requests,
+            "payload_bytes": rows * 20}
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_plan_table(self):
+        path = os.path.join(self.folder, "t.csv")
+        with open(path, "w") as file_out:
+            file_out.write("id,note\n")
+            for i in range(25):
+                file_out.write("{0},note {0}\n".format(i))
+        scan = scan_table(path, {"id": "Int64", "note": "String"})
+        plan = plan_table("t", scan, ["id", "note"], {"id": "Int64", "note": "String"})
+        self.assertEqual((plan["rows"], plan["columns"], plan["rows_per_request"], plan["requests"]),
+                         (25, 2, 10000, 1))
+        self.assertGreater(plan["payload_bytes"], os.path.getsize(path))
+        self.assertEqual(plan_table("empty", None, ["id"], {})["requests"], 0)
+
+    def test_requests_per_minute(self):
+        finished, waits = simulate_uploads([table(150, 1)], max_workers=1)
+        self.assertGreater(waits["requests_per_minute"], 0)
+        self.assertGreaterEqual(finished[0], 60)
+        self.assertEqual(waits["rows_per_hour"], 0)
+        finished, waits = simulate_uploads([table(100, 1)], max_workers=1)
+        self.assertEqual(waits, {"requests_per_minute": 0, "rows_per_hour": 0})
+        self.assertAlmostEqual(finished[0], 100 * REQUEST_LATENCY_SECONDS, places=2)
+
+    def test_rows_per_hour(self):
+        plan = plan_dataset("ds", [table(600000, name="a"), table(600000, name="b")], max_workers=2)
+        self.assertEqual(plan["limited_by"], "rows_per_hour")
+        self.assertEqual((plan["rows"], plan["requests"]), (1200000, 120))
+        self.assertGreaterEqual(plan["estimated_seconds"], 3600)
+
+    def test_large_table_regime(self):
+        tables = [table(300000, 1000)]
+        regular = plan_dataset("ds", tables, max_workers=1)
+        large = plan_dataset("ds", tables, max_workers=1, large_table_regime=True)
+        self.assertEqual(large["limited_by"], "requests_per_hour")
+        self.assertGreater(large["estimated_seconds"], regular["estimated_seconds"])
+        self.assertNotIn("estimated_seconds", tables[0])
+
+    def test_write_plan(self):
+        path = os.path.join(self.folder, "plan.json")
+        write_plan(path, [plan_dataset("ds", [table(10)], max_workers=4)], 4, ["note"])
+        with open(path) as file_in:
+            plan = json.load(file_in)
+        self.assertTrue(plan["dry_run"])
+        self.assertEqual(plan["assumptions"]["notes"], ["note"])
+        dataset = plan["datasets"][0]
+        self.assertEqual(dataset["tables"][0]["estimated_seconds"], dataset["estimated_seconds"])
+
+
+if __name__ == "__main__":
+    unittest.main()
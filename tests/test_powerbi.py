@@ -0,0 +1,87 @@
+import unittest
+
+from requests.exceptions import ReadTimeout
+
+from powerbi import PayloadTooLargeError, PowerBI
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+
+    def __init__(self, response):
+        self.response = response
+
+    def request(self, method, url, params=None, headers=None, data=None, timeout=None):
+        return self.response
+
+
+class CountingSession(FakeSession):
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.requests = 0
+
+    def request(self, method, url, params=None, headers=None, data=None, timeout=None):
+        self.requests += 1
+        return self.response
+
+
+class TimingOutSession:
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method, url, params=None, headers=None, data=None, timeout=None):
+        self.requests += 1
+        raise ReadTimeout("read timed out")
+
+
+def offline_client(session):
+    client = PowerBI.__new__(PowerBI)
+    client.session = session
+    client.compress = False
+    client.token_manager = None
+    client._oauth_token = "token"
+    client.workspace_url = ""
+    client.dataset_id = "dataset"
+    client.dataset_payload = {"name": "dataset", "tables": []}
+    return client
+
+
+class TestPowerBI(unittest.TestCase):
+
+    def test_post_rows_timeout_is_not_retried(self):
+        session = TimingOutSession()
+        with self.assertRaises(PayloadTooLargeError):
+            offline_client(session).post_rows("t", b'{"rows":[]}')
+        self.assertEqual(session.requests, 1)
+
+    def test_dataset_creation_is_not_retried(self):
+        session = CountingSession(FakeResponse(503, {"error": {"code": "ServiceUnavailable"}}))
+        with self.assertRaises(SystemExit):
+            offline_client(session).create_dataset()
+        self.assertEqual(session.requests, 1)
+
+    def test_table_definitions(self):
+        tables = {"value": [{"name": "a"}, {"name": "b", "columns": []}]}
+        client = offline_client(FakeSession(FakeResponse(200, tables)))
+        self.assertEqual(client.get_table_definitions(), {"a": None, "b": []})
+
+    def test_table_listing_failure_stops_the_run(self):
+        client = offline_client(FakeSession(FakeResponse(403, {"error": {"message": "Forbidden"}})))
+        with self.assertRaises(SystemExit):
+            client.get_table_definitions()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+
+from chunking import ChunkPlanner
+from memory import MemoryGuard
+from prefetch import Prefetcher
+
+
+class CountingGuard(MemoryGuard):
+    '''
+    Memory guard counting the slots held
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.held = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.held += 1
+
+    def release(self, planner):
+        with self._lock:
+            self.held -= 1
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.read = []
+
+    def batches(self, count, fail_at=None):
+        for i in range(count):
+            if i == fail_at:
+                raise ValueError("broken batch")
+            self.read.append(i)
+            yield i
+
+    def consume(self, prefetcher, guard):
+        items = []
+        for item in prefetcher:
+            items.append(item)
+            guard.release(None)
+        return items
+
+    def test_batches_in_order(self):
+        for depth in [0, 1, 3]:
+            guard = CountingGuard()
+            prefetcher = Prefetcher(self.batches(20), lambda batch: batch * 10, ChunkPlanner(), guard, depth)
+            self.assertEqual(self.consume(prefetcher, guard), [(i, i * 10) for i in range(20)])
+            prefetcher.close()
+            self.assertEqual(guard.held, 0)
+
+    def test_reads_ahead_up_to_depth(self):
+        guard = CountingGuard()
+        prefetcher = Prefetcher(self.batches(20), str, ChunkPlanner(), guard, depth=2)
+        self.assertEqual(next(prefetcher), (0, "0"))
+        time.sleep(0.2)
+        # the queue holds two batches and the producer waits with the third one
+        self.assertEqual(self.read, [0, 1, 2, 3])
+        prefetcher.close()
+        self.assertEqual(guard.held, 1)
+
+    def test_next_batch_is_read_while_sending(self):
+        guard = CountingGuard()
+        prefetcher = Prefetcher(self.batches(3), str, ChunkPlanner(), guard, depth=1)
+        next(prefetcher)
+        time.sleep(0.1)
+        self.assertIn(1, self.read)
+        prefetcher.close()
+
+    def test_errors_are_raised_in_order(self):
+        for depth in [0, 2]:
+            guard = CountingGuard()
+            prefetcher = Prefetcher(self.batches(5, fail_at=3), str, ChunkPlanner(), guard, depth)
+            self.assertEqual([next(prefetcher) for _ in range(3)], [(0, "0"), (1, "1"), (2, "2")])
+            with self.assertRaises(ValueError):
+                next(prefetcher)
+            prefetcher.close()
+            self.assertEqual(guard.held, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
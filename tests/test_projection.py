@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder, iter_row_batches
+from projection import TableProjection
+from scanner import scan_table
+
+
+COLUMNS = ["id", "amount", "created", "note"]
+TYPES = {"id": "Int64", "amount": "Decimal", "created": "DateTime", "note": "String"}
+
+
+class TestTableProjection(unittest.TestCase):
+
+    def test_selection_and_renames(self):
+        projection = TableProjection(COLUMNS, [("created", None), ("amount", "value")])
+        self.assertEqual(projection.columns, ["created", "value"])
+        self.assertEqual(projection.apply(["1", "2.5", "2020-01-01", "x"]), ["2020-01-01", "2.5"])
+        self.assertEqual(projection.rename("amount"), "value")
+        self.assertIsNone(projection.rename("id"))
+        self.assertTrue(TableProjection(COLUMNS).identity)
+
+    def test_filters_are_typed(self):
+        projection = TableProjection(COLUMNS, filters=[("amount", "greater_or_equal", "10"),
+                                                       ("note", "not_equals", "test")], column_types=TYPES)
+        self.assertIsNotNone(projection.apply(["1", "10.0", "", "a"]))
+        self.assertIsNone(projection.apply(["1", "9", "", "a"]))
+        self.assertIsNone(projection.apply(["1", "", "", "a"]))
+        self.assertIsNone(projection.apply(["1", "100", "", "test"]))
+
+    def test_date_window(self):
+        projection = TableProjection(COLUMNS, filters=[("created", "within_last_days", 7)], column_types=TYPES)
+        recent = (datetime.now() - timedelta(days=1)).isoformat()
+        self.assertIsNotNone(projection.apply(["1", "1", recent, ""]))
+        self.assertIsNone(projection.apply(["1", "1", "2000-01-01T00:00:00Z", ""]))
+        self.assertIsNone(projection.apply(["1", "1", "2000-01-01 00:00:00.1234+00", ""]))
+        recent = (datetime.utcnow() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S.%f0+0000")
+        self.assertIsNotNone(projection.apply(["1", "1", recent, ""]))
+
+    def test_invalid_configuration(self):
+        with self.assertRaises(ValueError):
+            TableProjection(COLUMNS, [("missing", None)])
+        with self.assertRaises(ValueError):
+            TableProjection(COLUMNS, [("id", "key"), ("amount", "key")])
+        with self.assertRaises(ValueError):
+            TableProjection(COLUMNS, filters=[("id", "like", "1")])
+
+    def test_scan_and_batches_use_projection(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            file_out.write('id,amount,created,note\n1,5,2020-01-01,a\n2,50,2020-01-02,b\n3,500,2020-01-03,c\n')
+        self.addCleanup(os.remove, path)
+        projection = TableProjection(COLUMNS, [("id", "key"), ("amount", None)],
+                                     [("amount", "greater_than", "10")], TYPES)
+
+        scan = scan_table(path, {"key": "Int64", "amount": "Decimal"}, projection)
+        self.assertEqual((scan.columns, scan.row_count, scan.input_rows), (["key", "amount"], 2, 3))
+
+        row_encoder = RowEncoder(projection.columns, {"key": "Int64", "amount": "Decimal"})
+        batches = list(iter_row_batches(path, row_encoder, ChunkPlanner(), projection=projection))
+        self.assertEqual([json.loads(row) for row in batches[0].rows],
+                         [{"key": 2, "amount": 50}, {"key": 3, "amount": 500}])
+        self.assertEqual(batches[0].end_row, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
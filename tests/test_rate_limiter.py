@@ -0,0 +1,62 @@
+import unittest
+import mock
+
+from rate_limiter import RateGovernor, SlidingWindow
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher_time = mock.patch('rate_limiter.time', self.clock)
+        patcher_time.start()
+        self.addCleanup(patcher_time.stop)
+
+    def test_window_waits_for_oldest_event(self):
+        window = SlidingWindow(2, 60)
+        window.add(1, 0)
+        window.add(1, 10)
+        self.assertEqual(window.wait_time(1, 30), 30)
+        self.assertEqual(window.wait_time(1, 60), 0)
+
+    def test_governor_never_exceeds_request_limit(self):
+        governor = RateGovernor()
+        for _ in range(121):
+            governor.acquire(1)
+        self.assertEqual(self.clock.now, 60)
+        self.assertEqual(governor.metrics()["throttle_waits"], 1)
+
+    def test_governor_waits_for_rows(self):
+        governor = RateGovernor(rows_per_hour=20_000)
+        self.assertEqual(governor.acquire(10_000), 0)
+        self.assertEqual(governor.acquire(10_000), 0)
+        self.assertEqual(governor.acquire(10_000), 3600)
+
+    def test_large_table_regime(self):
+        governor = RateGovernor()
+        governor.enable_large_table_regime()
+        for _ in range(121):
+            governor.acquire(1)
+        self.assertEqual(self.clock.now, 3600)
+
+    def test_retry_after_blocks_requests(self):
+        governor = RateGovernor()
+        governor.throttled(30)
+        self.assertEqual(governor.acquire(1), 30)
+        self.assertEqual(governor.metrics(), {"throttle_waits": 1, "throttled_seconds": 30, "throttled_requests": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
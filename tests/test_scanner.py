@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from scanner import scan_table
+
+
+class TestScanner(unittest.TestCase):
+
+    def test_scan_counts_rows_with_quoted_newlines(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            file_out.write('"id","name"\n"1","multi\nline"\n"2",""\n"3"\n')
+        self.addCleanup(os.remove, path)
+
+        scan = scan_table(path)
+        self.assertEqual(scan.columns, ['id', 'name'])
+        self.assertEqual(scan.row_count, 3)
+        self.assertEqual(scan.byte_size, os.path.getsize(path))
+        self.assertEqual(scan.input_rows, 3)
+
+    def test_scan_counts_values_violating_limits(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', newline='') as file_out:
+            file_out.write('id,name,created\n1,{0},2020-01-01\nx,b,\n3,c,01/02/2020\n'.format('a' * 4001))
+        self.addCleanup(os.remove, path)
+
+        scan = scan_table(path, {'id': 'Int64', 'name': 'String', 'created': 'DateTime'})
+        self.assertEqual(scan.oversize_counts, {'id': 0, 'name': 1, 'created': 0})
+        self.assertEqual(scan.invalid_counts, {'id': 1, 'name': 0, 'created': 1})
+        self.assertEqual(scan.invalid_rows, 3)
+        self.assertEqual(scan_table(path).invalid_rows, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
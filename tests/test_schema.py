@@ -0,0 +1,32 @@
+import unittest
+
+from schema import diff_tables
+
+
+def table(name, *columns):
+    return {"name": name, "columns": [{"name": column, "dataType": data_type} for column, data_type in columns]}
+
+
+class TestDiffTables(unittest.TestCase):
+
+    def test_missing_and_changed_tables(self):
+        expected = [table("a", ("id", "Int64")), table("b", ("id", "Int64"), ("name", "String")), table("c")]
+        existing = {"a": table("a", ("id", "Int64"))["columns"], "b": table("b", ("id", "Int64"))["columns"]}
+        missing, changed = diff_tables(expected, existing)
+        self.assertEqual([t["name"] for t in missing], ["c"])
+        self.assertEqual([t["name"] for t in changed], ["b"])
+
+    def test_recorded_schema_used_when_columns_not_returned(self):
+        expected = [table("a", ("id", "Int64")), table("b", ("id", "String"))]
+        recorded = {"a": table("a", ("id", "Int64"))["columns"], "b": table("b", ("id", "Int64"))["columns"]}
+        missing, changed = diff_tables(expected, {"a": None, "b": None}, recorded)
+        self.assertEqual(missing, [])
+        self.assertEqual([t["name"] for t in changed], ["b"])
+
+    def test_unknown_schema_is_updated(self):
+        missing, changed = diff_tables([table("a", ("id", "Int64"))], {"a": None})
+        self.assertEqual([t["name"] for t in changed], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
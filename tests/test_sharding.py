@@ -0,0 +1,185 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder, iter_row_batches
+from fingerprint import DeltaFilter, FingerprintIndex
+from memory import MemoryGuard
+from projection import TableProjection
+from sharding import ParserPool, find_shards, iter_sharded_batches, split_part
+from validation import POLICY_SKIP_ROW
+
+from .test_table_files import write_sliced_table
+
+
+COLUMNS = ["id", "note"]
+TYPES = {"id": "Int64", "note": "String"}
+
+
+class ThreadPool:
+    '''
+    Parser pool running the shards in threads
+    '''
+
+    processes = 2
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.processes)
+
+    def submit(self, *args):
+        return self.executor.submit(*args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class CountingPool(ThreadPool):
+    '''
+    Parser pool recording the most shards in flight at once
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.peak = 0
+
+    def submit(self, *args):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        future = super().submit(*args)
+        result = future.result
+
+        def taken():
+            self.in_flight -= 1
+            return result()
+
+        future.result = taken
+        return future
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "t.csv")
+        with open(self.path, "w", newline='') as file_out:
+            file_out.write('id,"note\nwith line break"\n')
+            for i in range(200):
+                note = '"line {0}\nquoted ""{0}"""'.format(i) if i % 3 else "plain {0}".format(i)
+                file_out.write("{0},{1}\n".format(i if i % 7 else "x", note))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def batches(self, reader, policy=None, **kwargs):
+        row_encoder = RowEncoder(COLUMNS, TYPES, policy)
+        batches = list(reader(row_encoder, ChunkPlanner(max_rows=16), **kwargs))
+        return batches, row_encoder
+
+    def assert_same_batches(self, pool, delta=(None, None), policy=None, **kwargs):
+        serial, serial_encoder = self.batches(
+            lambda encoder, planner, **args: iter_row_batches(self.path, encoder, planner, delta=delta[0], **args),
+            policy, **kwargs)
+        sharded, sharded_encoder = self.batches(
+            lambda encoder, planner, **args: iter_sharded_batches(pool, self.path, encoder, planner, delta=delta[1],
+                                                                  shard_bytes=300, **args), policy, **kwargs)
+        self.assertEqual([batch.rows for batch in sharded], [batch.rows for batch in serial])
+        self.assertEqual([(batch.first_row, batch.end_row, batch.end_offset) for batch in sharded],
+                         [(batch.first_row, batch.end_row, batch.end_offset) for batch in serial])
+        self.assertEqual(sharded_encoder.error_counts, serial_encoder.error_counts)
+        self.assertEqual(sharded_encoder.skipped_rows, serial_encoder.skipped_rows)
+        return sharded
+
+    def test_shards_end_on_row_boundaries(self):
+        shards = split_part(self.path, shard_bytes=100, header=True)
+        self.assertGreater(len(shards), 5)
+        self.assertEqual(shards[0][0], len('id,"note\nwith line break"\n'))
+        self.assertEqual(shards[-1][1], os.path.getsize(self.path))
+        with open(self.path, 'rb') as file_in:
+            data = file_in.read()
+        for start, end in shards:
+            self.assertEqual(data[start:end].count(b'"') % 2, 0)
+            self.assertEqual(data[end - 1:end], b'\n')
+        self.assertEqual(split_part(self.path, shards[3][0], 100)[0][0], shards[3][0])
+        base, found = find_shards(self.path, shards[3][0], 100)
+        self.assertEqual((base, list(found)), (0, [(0, self.path, start, end) for start, end in shards[3:]]))
+
+    def test_same_batches_as_serial_reading(self):
+        pool = ThreadPool()
+        self.addCleanup(pool.shutdown)
+        self.assert_same_batches(pool)
+        projection = TableProjection(COLUMNS, [("note", None)], [("id", "greater_than", "100")], TYPES)
+        self.assert_same_batches(pool, projection=projection)
+        offset = split_part(self.path, shard_bytes=500, header=True)[2][0]
+        self.assert_same_batches(pool, start_offset=offset, start_row=30)
+
+    def test_read_ahead_within_memory_guard_budget(self):
+        serial, _ = self.batches(lambda encoder, planner: iter_row_batches(self.path, encoder, planner))
+        guard = MemoryGuard(max_shards=2)
+        # another upload holding a slot leaves one shard parsed ahead
+        for held, peak in [(True, 2), (False, 3)]:
+            if held:
+                self.assertTrue(guard.acquire_shard())
+            pool = CountingPool()
+            self.addCleanup(pool.shutdown)
+            sharded, _ = self.batches(lambda encoder, planner: iter_sharded_batches(
+                pool, self.path, encoder, planner, shard_bytes=300, memory_guard=guard))
+            self.assertEqual([batch.rows for batch in sharded], [batch.rows for batch in serial])
+            self.assertEqual(pool.peak, peak)
+            if held:
+                guard.release_shard()
+        self.assertEqual(guard.shards, 0)
+
+    def test_delta_filter(self):
+        pool = ThreadPool()
+        self.addCleanup(pool.shutdown)
+        serial_delta = DeltaFilter(FingerprintIndex(), [0])
+        sharded_delta = DeltaFilter(FingerprintIndex(), [0])
+        batches = self.assert_same_batches(pool, delta=[serial_delta, sharded_delta])
+        self.assertEqual((serial_delta.skipped, sharded_delta.skipped), (28, 28))
+        self.assertEqual(sum(len(batch.fingerprints) for batch in batches), 172)
+        delta = [DeltaFilter(FingerprintIndex(), [1]) for _ in range(2)]
+        batches = self.assert_same_batches(pool, delta=delta, policy=POLICY_SKIP_ROW)
+        self.assertEqual(sum(len(batch) for batch in batches), 200 - 29)
+
+    def test_sliced_table(self):
+        pool = ThreadPool()
+        self.addCleanup(pool.shutdown)
+        self.path = write_sliced_table(self.folder, "sliced.csv")
+        self.assertEqual([(shard[0], shard[2], shard[3]) for shard in find_shards(self.path, shard_bytes=4)[1]],
+                         [(0, 0, 26), (1, 0, 8), (1, 8, 12), (2, 0, 8)])
+        batches = self.assert_same_batches(pool)
+        self.assertEqual(sum(len(batch) for batch in batches), 7)
+        self.assert_same_batches(pool, start_offset=30, start_row=3)
+        self.assert_same_batches(pool, start_offset=42, start_row=6)
+
+    def test_gzipped_table(self):
+        pool = ThreadPool()
+        self.addCleanup(pool.shutdown)
+        with open(self.path, "rb") as file_in:
+            data = file_in.read()
+        self.path += ".gz"
+        with gzip.open(self.path, "wb") as file_out:
+            file_out.write(data)
+        chunks = [shard[1] for shard in find_shards(self.path, shard_bytes=300)[1]]
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(b"".join(chunks), data[len('id,"note\nwith line break"\n'):])
+        self.assertLess(max(len(chunk) for chunk in chunks), 400)
+        self.assert_same_batches(pool)
+        offset = split_part(self.path[:-3], shard_bytes=500, header=True)[2][0]
+        self.assert_same_batches(pool, start_offset=offset, start_row=30)
+
+    def test_worker_processes(self):
+        pool = ParserPool(2)
+        self.addCleanup(pool.shutdown)
+        projection = TableProjection(COLUMNS, filters=[("id", "less_or_equal", "150")], column_types=TYPES)
+        batches = self.assert_same_batches(pool, projection=projection)
+        self.assertEqual(batches[-1].end_row, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
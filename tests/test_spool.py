@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from checkpoint import UploadCheckpoint
+from chunking import ChunkPlanner
+from encoder import RowEncoder, iter_row_batches
+from fingerprint import DeltaFilter, FingerprintIndex
+from rate_limiter import RateGovernor
+from spool import SharedTables
+from uploader import TableUpload, Uploader
+
+from .test_uploader import FakeClient
+
+
+COLUMNS = ["id", "name"]
+TYPES = {"id": "Int64", "name": "String"}
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "t.csv")
+        with open(self.path, "w", newline='') as file_out:
+            file_out.write("id,name\n")
+            for i in range(300):
+                file_out.write('{0},"name\n{1}"\n'.format(i if i % 9 else "x", i % 50))
+        self.shared = SharedTables(os.path.join(self.folder, "spools"), ["a", "b"])
+        os.mkdir(self.shared.folder)
+
+    def tearDown(self):
+        self.shared.close()
+        shutil.rmtree(self.folder)
+
+    def table(self, delta=None):
+        return TableUpload("t", self.path, COLUMNS, TYPES, delta=delta)
+
+    def test_datasets_read_the_same_spool(self):
+        serial = list(iter_row_batches(self.path, RowEncoder(COLUMNS, TYPES), ChunkPlanner(max_rows=7)))
+        readers = []
+        for reader, max_rows in [("a", 7), ("b", 40)]:
+            row_encoder = RowEncoder(COLUMNS, TYPES)
+            readers.append((self.shared.iter_batches(self.table(), row_encoder, ChunkPlanner(max_rows=max_rows),
+                                                     reader=reader), row_encoder))
+        self.assertEqual(len(self.shared._spools), 1)
+        # readers consume the spool at their own pace
+        fast = list(readers[1][0])
+        slow = list(readers[0][0])
+        self.assertEqual([(batch.rows, batch.end_row, batch.end_offset) for batch in slow],
+                         [(batch.rows, batch.end_row, batch.end_offset) for batch in serial])
+        self.assertEqual([row for batch in fast for row in batch.rows], [row for batch in serial for row in batch.rows])
+        self.assertEqual((fast[-1].end_row, fast[-1].end_offset), (300, os.path.getsize(self.path)))
+        self.assertEqual(readers[0][1].error_counts, {"id": 34})
+        self.assertEqual(readers[1][1].error_counts, {"id": 34})
+
+    def test_delta_filter_of_every_dataset(self):
+        index = FingerprintIndex()
+        for batch in iter_row_batches(self.path, RowEncoder(COLUMNS, TYPES), ChunkPlanner(),
+                                      delta=DeltaFilter(index, [1])):
+            index.update(batch.fingerprints)
+        new = DeltaFilter(FingerprintIndex(), [1])
+        loaded = DeltaFilter(index, [1])
+        sent = [list(self.shared.iter_batches(self.table(delta), RowEncoder(COLUMNS, TYPES), ChunkPlanner(),
+                                              reader=reader)) for reader, delta in [("a", new), ("b", loaded)]]
+        self.assertEqual(len(self.shared._spools), 1)
+        self.assertEqual(sum(len(batch) for batch in sent[0]), 50)
+        self.assertEqual(sum(len(batch) for batch in sent[1]), 0)
+        self.assertEqual((new.skipped, loaded.skipped), (250, 300))
+
+    def test_upload_resumed_elsewhere_reads_alone(self):
+        list(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(), reader="a"))
+        self.assertIsNone(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(),
+                                                   start_offset=100, start_row=10, reader="b"))
+        # the spool is no longer kept for the reader
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+    def test_errors_are_raised_by_every_reader(self):
+        table = TableUpload("t", os.path.join(self.folder, "missing.csv"), COLUMNS, TYPES)
+        for reader in ["a", "b"]:
+            with self.assertRaises(OSError):
+                list(self.shared.iter_batches(table, RowEncoder(COLUMNS, TYPES), ChunkPlanner(), reader=reader))
+
+    def test_uploads_of_several_datasets(self):
+        clients = [FakeClient(), FakeClient()]
+        self.shared.readers = set(clients)
+        for client in clients:
+            uploader = Uploader(client, RateGovernor(), UploadCheckpoint(None, "dataset"), threading.Event(),
+                                shared_tables=self.shared)
+            with mock.patch("uploader.logging"):
+                uploader.run([TableUpload(name, self.path, COLUMNS, None) for name in ["a", "b"]], 2)
+        self.assertEqual(len(self.shared._spools), 1)
+        self.assertEqual(len(clients[0].rows), 600)
+        self.assertEqual(clients[0].rows, clients[1].rows)
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+    def test_shards_removed_once_read_by_every_reader(self):
+        with open(self.path, "a", newline='') as file_out:
+            for i in range(300, 10000):
+                file_out.write('{0},"{1}"\n'.format(i, "x" * 2000))
+        fast = self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(max_rows=100),
+                                        reader="a")
+        slow = self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(max_rows=100),
+                                        reader="b")
+        list(fast)
+        shards = len(os.listdir(self.shared.folder))
+        self.assertGreater(shards, 2)
+        # shards read by the slow reader are removed as it goes
+        for batch in slow:
+            if batch.end_row > 5000:
+                break
+        self.assertLess(len(os.listdir(self.shared.folder)), shards)
+        list(slow)
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+    def test_released_reader_does_not_hold_shards(self):
+        list(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(), reader="a"))
+        self.assertNotEqual(os.listdir(self.shared.folder), [])
+        self.shared.release("b")
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+    def test_skipped_table_does_not_hold_shards(self):
+        self.shared.skip(self.table(), "b")
+        list(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(), reader="a"))
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+    def test_table_read_with_another_encoding_does_not_hold_shards(self):
+        list(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, TYPES), ChunkPlanner(), reader="a"))
+        self.assertNotEqual(os.listdir(self.shared.folder), [])
+        list(self.shared.iter_batches(self.table(), RowEncoder(COLUMNS, None), ChunkPlanner(), reader="b"))
+        self.assertEqual(len(self.shared._spools), 2)
+        self.assertEqual(os.listdir(self.shared.folder), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
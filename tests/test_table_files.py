@@ -0,0 +1,71 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from chunking import ChunkPlanner
+from encoder import RowEncoder, iter_row_batches
+from scanner import scan_table
+from table_files import iter_table_lines, table_parts
+
+
+COLUMNS = ["id", "note"]
+TYPES = {"id": "Int64", "note": "String"}
+SLICES = [
+    ("part_0.csv", ['1,a\n', '2,"quoted\nline break"\n']),
+    ("part_1.csv.gz", ['3,c\n', '4,d\n', '5,e\n']),
+    ("part_2.csv", ['6,f\n', '7,g\n'])
+]
+
+
+def write_sliced_table(folder, name="t.csv"):
+    table = os.path.join(folder, name)
+    os.mkdir(table)
+    for slice_name, lines in SLICES:
+        opener = gzip.open if slice_name.endswith(".gz") else open
+        with opener(os.path.join(table, slice_name), "wb") as file_out:
+            file_out.write("".join(lines).encode("utf-8"))
+    return table
+
+
+class TestTableFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.sliced = write_sliced_table(self.folder)
+        self.data = "".join(line for _, lines in SLICES for line in lines).encode("utf-8")
+        self.single = os.path.join(self.folder, "single.csv")
+        with open(self.single, "wb") as file_out:
+            file_out.write(b"id,note\n" + self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_slices_are_read_in_order(self):
+        self.assertEqual([part.compressed for part in table_parts(self.sliced)], [False, True, False])
+        self.assertEqual(b"".join(iter_table_lines(self.sliced)), self.data)
+        for offset in [len(self.data) - 8, len(self.data) - 16, 3]:
+            self.assertEqual(b"".join(iter_table_lines(self.sliced, offset)), self.data[offset:])
+
+    def test_scan_uses_manifest_columns(self):
+        scan = scan_table(self.sliced, TYPES, columns=COLUMNS)
+        single = scan_table(self.single, TYPES)
+        self.assertEqual((scan.columns, scan.row_count, scan.byte_size), (COLUMNS, 7, len(self.data)))
+        self.assertEqual((scan.invalid_counts, scan.oversize_counts), (single.invalid_counts, single.oversize_counts))
+
+    def test_batches_and_resume(self):
+        def batches(path, start_offset=0, start_row=0):
+            return list(iter_row_batches(path, RowEncoder(COLUMNS, TYPES), ChunkPlanner(max_rows=2),
+                                         start_offset=start_offset, start_row=start_row))
+
+        sliced = batches(self.sliced)
+        self.assertEqual([batch.rows for batch in sliced], [batch.rows for batch in batches(self.single)])
+        self.assertEqual(sliced[-1].end_offset, len(self.data))
+        resumed = batches(self.sliced, sliced[1].end_offset, sliced[1].end_row)
+        self.assertEqual([batch.rows for batch in resumed], [batch.rows for batch in sliced[2:]])
+        self.assertEqual(resumed[-1].end_row, 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
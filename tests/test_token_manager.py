@@ -0,0 +1,70 @@
+import threading
+import unittest
+
+from powerbi import PowerBI
+from token_manager import TokenManager
+
+
+class FakeTokenEndpoint:
+
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.issued = 0
+        self.refreshed = threading.Event()
+
+    def __call__(self):
+        self.issued += 1
+        if self.issued > 1:
+            self.refreshed.set()
+        return "token-{0}".format(self.issued), str(self.expires_in)
+
+
+class FakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession:
+
+    def __init__(self, valid_token):
+        self.valid_token = valid_token
+        self.authorizations = []
+
+    def request(self, method, url, params=None, headers=None, data=None, timeout=None):
+        self.authorizations.append(headers["Authorization"])
+        return FakeResponse(200 if headers["Authorization"] == "Bearer " + self.valid_token else 401)
+
+
+class TestTokenManager(unittest.TestCase):
+
+    def test_refresh_on_expired_token_only_once(self):
+        endpoint = FakeTokenEndpoint()
+        manager = TokenManager(endpoint)
+        self.assertEqual(manager.token, "token-1")
+        manager.refresh(expired_token="token-1")
+        manager.refresh(expired_token="token-1")
+        self.assertEqual(manager.token, "token-2")
+        self.assertEqual(endpoint.issued, 2)
+
+    def test_background_refresh_before_expiry(self):
+        endpoint = FakeTokenEndpoint(expires_in=0.1)
+        manager = TokenManager(endpoint, refresh_margin=0.05)
+        manager.start()
+        self.addCleanup(manager.stop)
+        self.assertTrue(endpoint.refreshed.wait(2))
+        self.assertNotEqual(manager.token, "token-1")
+
+    def test_request_retried_with_refreshed_token_after_401(self):
+        manager = TokenManager(FakeTokenEndpoint())
+        client = PowerBI.__new__(PowerBI)
+        client.session = FakeSession(valid_token="token-2")
+        client.compress = False
+        client.token_manager = manager
+        response = client.request("GET", "http://localhost/datasets", {"Authorization": "Bearer token-1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session.authorizations, ["Bearer token-1", "Bearer token-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from checkpoint import UploadCheckpoint
+from fingerprint import DeltaFilter, FingerprintIndex
+from powerbi import PayloadTooLargeError, RowsRejectedError, ServerError, ThrottledError
+from quarantine import Quarantine
+from rate_limiter import RateGovernor
+from uploader import TableUpload, Uploader
+
+
+class FakeClient:
+
+    dataset = "dataset"
+
+    def __init__(self, throttled_deletes=0, rejected_names=(), server_errors=0, max_rows=None):
+        self.calls = []
+        self.max_rows = max_rows
+        self.throttled_deletes = throttled_deletes
+        self.server_errors = server_errors
+        self.rejected_names = rejected_names
+        self.rows = []
+
+    def put_table(self, tablename, payload):
+        self.calls.append(("put_table", tablename))
+
+    def delete_rows(self, tablename):
+        self.calls.append(("delete_rows", tablename))
+        if self.throttled_deletes:
+            self.throttled_deletes -= 1
+            raise ThrottledError("throttled", retry_after=0)
+
+    def post_rows(self, tablename, body):
+        self.calls.append(("post_rows", tablename))
+        if self.server_errors:
+            self.server_errors -= 1
+            raise ServerError("Request failed with 503")
+        rows = json.loads(body)["rows"]
+        if any(row["name"] in self.rejected_names for row in rows):
+            raise RowsRejectedError("Invalid value")
+        if self.max_rows is not None and len(rows) > self.max_rows:
+            raise PayloadTooLargeError("Request failed with 413")
+        self.rows.extend(rows)
+
+
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "t.csv")
+        with open(self.path, "w") as file_out:
+            file_out.write("id,name\n1,a\n2,b\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def run_uploads(self, client, tables, quarantine=None, max_workers=2):
+        uploader = Uploader(client, RateGovernor(), UploadCheckpoint(None, "dataset"), threading.Event(),
+                            quarantine=quarantine)
+        with mock.patch("uploader.logging"):
+            uploader.run(tables, max_workers=max_workers)
+        return uploader
+
+    def test_each_upload_starts_after_its_preparation(self):
+        client = FakeClient()
+        tables = [TableUpload(name, self.path, ["id", "name"], None, table_definition={"name": name},
+                              drop_rows=True) for name in ["a", "b", "c"]]
+        self.run_uploads(client, tables)
+        for name in ["a", "b", "c"]:
+            calls = [call for call, table in client.calls if table == name]
+            self.assertEqual(calls, ["put_table", "delete_rows", "post_rows"])
+
+    def test_uploads_start_before_remaining_preparations(self):
+        client = FakeClient()
+        tables = [TableUpload(name, self.path, ["id", "name"], None, drop_rows=True) for name in ["a", "b", "c"]]
+        self.run_uploads(client, tables, max_workers=1)
+        self.assertEqual(client.calls, [(call, name) for name in ["a", "b", "c"]
+                                        for call in ["delete_rows", "post_rows"]])
+
+    def test_throttled_delete_is_retried(self):
+        client = FakeClient(throttled_deletes=2)
+        uploader = self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], None, drop_rows=True)])
+        self.assertEqual([call for call, _ in client.calls], ["delete_rows"] * 3 + ["post_rows"])
+        self.assertEqual(uploader.governor.metrics()["throttled_requests"], 2)
+
+    def test_server_errors_are_retried_within_the_rate_limits(self):
+        client = FakeClient(server_errors=2)
+        with mock.patch("uploader.SERVER_ERROR_BACKOFF", 0):
+            uploader = self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], None)])
+        self.assertEqual(len(client.rows), 2)
+        requests_window = uploader.governor.windows[0][0]
+        self.assertEqual(requests_window.total, 3)
+        self.assertEqual(uploader.metrics["a"].summary()["retries"], 2)
+
+        client = FakeClient(server_errors=10)
+        with mock.patch("uploader.SERVER_ERROR_BACKOFF", 0), self.assertRaises(ServerError):
+            self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], None)])
+        self.assertEqual(len(client.calls), 5)
+
+    def test_rejected_rows_are_quarantined(self):
+        with open(self.path, "w") as file_out:
+            file_out.write("id,name\n")
+            for i in range(100):
+                file_out.write("{0},{1}\n".format(i, "bad" if i in (17, 18, 63) else "row {0}".format(i)))
+        client = FakeClient(rejected_names=("bad",))
+        with self.assertRaises(SystemExit):
+            self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], {"id": "Int64"})])
+
+        client = FakeClient(rejected_names=("bad",))
+        quarantine = Quarantine(os.path.join(self.folder, "rejected.csv"))
+        delta = DeltaFilter(FingerprintIndex(), [0])
+        uploader = self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], {"id": "Int64"},
+                                                         delta=delta)], quarantine)
+        quarantine.close()
+        self.assertEqual([row["id"] for row in client.rows], [i for i in range(100) if i not in (17, 18, 63)])
+        self.assertLess(len(client.calls), 30)
+        with open(quarantine.path) as file_in:
+            rejected = list(csv.DictReader(file_in))
+        self.assertEqual([json.loads(row["row"])["id"] for row in rejected], [17, 18, 63])
+        self.assertEqual({(row["dataset"], row["table"], row["error"]) for row in rejected},
+                         {("dataset", "a", "Invalid value")})
+        self.assertTrue(os.path.exists(quarantine.path + ".manifest"))
+        self.assertEqual(uploader.metrics["a"].summary()["rows_rejected"], 3)
+        self.assertEqual(len(delta.index), 97)
+
+    def test_too_large_parts_of_rejected_batch_are_split(self):
+        with open(self.path, "w") as file_out:
+            file_out.write("id,name\n")
+            for i in range(100):
+                file_out.write("{0},{1}\n".format(i, "bad" if i in (17, 63) else "row {0}".format(i)))
+        client = FakeClient(rejected_names=("bad",), max_rows=20)
+        quarantine = Quarantine(os.path.join(self.folder, "rejected.csv"))
+        uploader = self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], {"id": "Int64"})],
+                                    quarantine)
+        quarantine.close()
+        self.assertEqual(sorted(row["id"] for row in client.rows), [i for i in range(100) if i not in (17, 63)])
+        with open(quarantine.path) as file_in:
+            rejected = list(csv.DictReader(file_in))
+        self.assertEqual([json.loads(row["row"])["id"] for row in rejected], [17, 63])
+        self.assertEqual(uploader.metrics["a"].summary()["rows_rejected"], 2)
+
+    def test_batch_with_all_rows_rejected_fails(self):
+        client = FakeClient(rejected_names=("a", "b"))
+        quarantine = Quarantine(os.path.join(self.folder, "rejected.csv"))
+        with self.assertRaises(SystemExit):
+            self.run_uploads(client, [TableUpload("a", self.path, ["id", "name"], None)], quarantine)
+
+
+if __name__ == "__main__":
+    unittest.main()
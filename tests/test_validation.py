@@ -0,0 +1,30 @@
+import unittest
+
+from scanner import TableScan
+from validation import table_limit_errors, value_issues
+
+
+def scan(column_count=2, row_count=10, oversize=0, invalid=0):
+    columns = ["c{0}".format(i) for i in range(column_count)]
+    return TableScan("t.csv", columns, row_count, 100, [oversize] + [0] * (column_count - 1),
+                     [0] * (column_count - 1) + [invalid])
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_table_limits(self):
+        self.assertEqual(table_limit_errors({"a": scan()}), [])
+        errors = table_limit_errors({"a": scan(column_count=76), "b": scan()})
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(table_limit_errors({str(i): scan() for i in range(76)})), 1)
+
+    def test_value_issues(self):
+        self.assertEqual(value_issues("a", scan()), [])
+        issues = value_issues("a", scan(oversize=2, invalid=3))
+        self.assertEqual(len(issues), 2)
+        self.assertIn("2 values of column c0", issues[0])
+        self.assertIn("3 values of column c1", issues[1])
+
+
+if __name__ == "__main__":
+    unittest.main()